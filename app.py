@@ -1,11 +1,13 @@
 import streamlit as st
 import requests
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
+import json
 import uuid
 import time
 
 # Configuration
 BACKEND_URL = "http://localhost:8000"
+JOB_POLL_INTERVAL = 1.0  # Seconds between background job polls
 
 st.set_page_config(
     page_title="ADIC SharePoint RAG",
@@ -232,6 +234,9 @@ if "conversation_id" not in st.session_state:
     st.session_state.conversation_id = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "backend" not in st.session_state:
+    # Keeps the backend's session affinity cookie, so a chat stays on one replica
+    st.session_state.backend = requests.Session()
 
 # Sidebar with enhanced design
 with st.sidebar:
@@ -260,6 +265,11 @@ with st.sidebar:
     # Add temperature control for demo
     st.markdown("### 🎨 Advanced")
     show_sources = st.checkbox("📚 Auto-expand Sources", value=False, help="Automatically show source citations")
+    run_as_job = st.checkbox(
+        "⏳ Run in Background",
+        value=False,
+        help="Submit slow questions (broad searches, long chats) as a background job and poll for the answer"
+    )
     
     st.markdown("---")
     st.markdown("### 📌 Session Info")
@@ -318,35 +328,79 @@ with col1:
 with col2:
     if st.button("🏥 Benefits Info", use_container_width=True):
         st.session_state.quick_prompt = "Tell me about employee benefits"
-with col3:show_sources):
-                for citation in message["citations"]:
-                    citation_html = f"""
-                    <div class="citation-card">
-                        <div style="display: flex; align-items: start; gap: 1rem;">
-                            <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                                        color: white; padding: 0.5rem 0.75rem; border-radius: 8px; 
-                                        font-weight: bold; min-width: 40px; text-align: center;">
-                                {citation['number']}
-                            </div>
-                            <div style="flex: 1;">
-                                <a href="{citation['url']}" target="_blank" 
-                                   style="color: #667eea; font-weight: 600; font-size: 1.05rem; 
-prompt = st.chat_input("💭 Ask me anything about your SharePoint documents...")
+with col3:
+    if st.button("🏖️ Time Off", use_container_width=True):
+        st.session_state.quick_prompt = "How do I request time off?"
+with col4:
+    if st.button("💻 IT Support", use_container_width=True):
+        st.session_state.quick_prompt = "How do I get help from IT support?"
 
-# Handle quick prompts
-if 'quick_prompt' in st.session_state and st.session_state.quick_prompt:
-    prompt = st.session_state.quick_prompt
-    st.session_state.quick_prompt = None
+def render_citations(citations: List[Dict], expanded: bool = False):
+    """Render citation cards inside a collapsible sources section."""
+    with st.expander("📚 **View Sources & Citations**", expanded=expanded):
+        for citation in citations:
+            citation_html = f"""
+            <div class="citation-card">
+                <div style="display: flex; align-items: start; gap: 1rem;">
+                    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                                color: white; padding: 0.5rem 0.75rem; border-radius: 8px; 
+                                font-weight: bold; min-width: 40px; text-align: center;">
+                        {citation['number']}
+                    </div>
+                    <div style="flex: 1;">
+                        <a href="{citation['url']}" target="_blank" 
+                           style="color: #667eea; font-weight: 600; font-size: 1.05rem; 
+                                  text-decoration: none; display: flex; align-items: center; gap: 0.5rem;">
+                            📄 {citation['title']}
+                            <span style="font-size: 0.8rem; opacity: 0.6;">↗</span>
+                        </a>
+                        <p style="color: #666; margin-top: 0.5rem; font-size: 0.95rem; line-height: 1.5;">
+                            {citation['snippet']}
+                        </p>
+                    </div>
+                </div>
+            </div>
+            """
+            st.markdown(citation_html, unsafe_allow_html=True)
+
+class BackendStreamError(Exception):
+    """Error reported by the backend after accepting the request (stream error event or failed job)."""
 
-if promptdecoration: none; display: flex; align-items: center; gap: 0.5rem;">
-                                    📄 {citation['title']}
-                                    <span style="font-size: 0.8rem; opacity: 0.6;">↗</span>
-                                </a>
-                                <p style="color: #666; margin-top: 0.5rem; font-size: 0.95rem; line-height: 1.5;">
-                                    {citation['snippet']}
-                                </p>
-                            </div>
-                        </div
+def stream_query(payload: Dict) -> Iterator[Tuple[str, Dict]]:
+    """POST to the streaming endpoint and yield (event, data) pairs as SSE frames arrive."""
+    with st.session_state.backend.post(
+        f"{BACKEND_URL}/api/query/stream",
+        json=payload,
+        stream=True,
+        timeout=(5, 30)  # Read timeout applies between frames, not to the whole answer
+    ) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+def run_job(payload: Dict, placeholder) -> Dict:
+    """Submit the query as a background job and poll until it finishes; returns the query result."""
+    response = st.session_state.backend.post(f"{BACKEND_URL}/api/jobs", json=payload, timeout=10)
+    response.raise_for_status()
+    job = response.json()
+    
+    started = time.time()
+    while job["status"] in ("queued", "running"):
+        placeholder.markdown(f"⏳ *Background job {job['status']} ({int(time.time() - started)}s)...*")
+        time.sleep(JOB_POLL_INTERVAL)
+        response = st.session_state.backend.get(f"{BACKEND_URL}/api/jobs/{job['job_id']}", timeout=10)
+        response.raise_for_status()
+        job = response.json()
+    
+    if job["status"] != "succeeded":
+        raise BackendStreamError(job["error"]["detail"] if job["error"] else f"Job {job['status']}")
+    return job["result"]
 
 # Display chat messages
 for message in st.session_state.messages:
@@ -356,88 +410,79 @@ for message in st.session_state.messages:
         
         # Show citations for assistant messages
         if message["role"] == "assistant" and message.get("citations"):
-            with st.expander("📚 **View Sources & Citations**", expanded=False):
-                for citation in message["citations"]:
-                    citation_html = f"""
-                    <div style="background: linear-gradient(135deg, rgba(102, 126, 234, 0.1) 0%, rgba(118, 75, 162, 0.1) 100%); 
-                                padding: 1rem; border-radius: 10px; margin: 0.5rem 0;">
-                        <strong style="color: #667eea;">[{citation['number']}]</strong> 
-                        <a href="{citation['url']}" target="_blank" style="color: #764ba2; font-weight: 600;">{citation['title']}</a>
-                        <br><small style="color: #666;">{citation['snippet']}</small>
-                    </div>
-                    """
-                    st.markdown(citation_html, unsafe_allow_html=True)
+            render_citations(message["citations"], expanded=show_sources)
 
 # Chat input
-if prompt := st.chat_input("Ask a question..."):
+prompt = st.chat_input("💭 Ask me anything about your SharePoint documents...")
+
+# Handle quick prompts
+if 'quick_prompt' in st.session_state and st.session_state.quick_prompt:
+    prompt = st.session_state.quick_prompt
+    st.session_state.quick_prompt = None
+
+if prompt:
     # Add user message to chat
     st.session_state.messages.append({"role": "user", "content": prompt})
     
     with st.chat_message("user", avatar="🧑‍💼"):
         st.markdown(prompt)
     
-    # Query backend
+    # Query backend and render the answer as it streams in
     with st.chat_message("assistant", avatar="🤖"):
-        with st.spinner("🔍 Searching knowledge base and analyzing..."):
-            try:
-                response = requests.post(
-                    f"{BACKEND_URL}/api/query",show_sources):
-                        for citation in data["citations"]:
-                            citation_html = f"""
-                            <div class="citation-card">
-                                <div style="display: flex; align-items: start; gap: 1rem;">
-                                    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                                                color: white; padding: 0.5rem 0.75rem; border-radius: 8px; 
-                                                font-weight: bold; min-width: 40px; text-align: center;">
-                                        {citation['number']}
-                                    </div>
-                                    <div style="flex: 1;">
-                                        <a href="{citation['url']}" target="_blank" 
-                                           style="color: #667eea; font-weight: 600; font-size: 1.05rem; 
-                                                  text-decoration: none; display: flex; align-items: center; gap: 0.5rem;">
-                                            📄 {citation['title']}
-                                            <span style="font-size: 0.8rem; opacity: 0.6;">↗</span>
-                                        </a>
-                                        <p style="color: #666; margin-top: 0.5rem; font-size: 0.95rem; line-height: 1.5;">
-                                            {citation['snippet']}
-                                        </p>
-                                    </div>
-                                </div
-                )
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                # Update conversation ID
-                st.session_state.conversation_id = data["conversation_id"]
-                
-                # Display answer
-                st.markdown(data["answer"])
-                
-                # Display citations
-                if data["citations"]:
-                    with st.expander("📚 **View Sources & Citations**", expanded=False):
-                        for citation in data["citations"]:
-                            citation_html = f"""
-                            <div style="background: linear-gradient(135deg, rgba(102, 126, 234, 0.1) 0%, rgba(118, 75, 162, 0.1) 100%); 
-                                        padding: 1rem; border-radius: 10px; margin: 0.5rem 0;">
-                                <strong style="color: #667eea;">[{citation['number']}]</strong> 
-                                <a href="{citation['url']}" target="_blank" style="color: #764ba2; font-weight: 600;">{citation['title']}</a>
-                                <br><small style="color: #666;">{citation['snippet']}</small>
-                            </div>
-                            """
-                            st.markdown(citation_html, unsafe_allow_html=True)
-                
-                # Add to messages
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": data["answer"],
-                    "citations": data["citations"]
-                })
-                
-            except requests.exceptions.ConnectionError:
-                st.error("🚫 **Connection Error**\\n\\nCannot connect to the backend server. Please ensure the API is running on port 8000.")
-            except requests.exceptions.HTTPError as e:
-                st.error(f"⚠️ **API Error**\\n\\n{e.response.text}")
-            except Exception as e:
-                st.error(f"❌ **Unexpected Error**\\n\\n{str(e)}")
+        answer_placeholder = st.empty()
+        answer_placeholder.markdown("🔍 *Searching knowledge base and analyzing...*")
+        
+        answer = ""
+        citations = []
+        payload = {
+            "query": prompt,
+            "conversation_id": st.session_state.conversation_id,
+            "user_id": st.session_state.user_id,
+            "top_k": top_k
+        }
+        try:
+            if run_as_job:
+                result = run_job(payload, answer_placeholder)
+                answer, citations = result["answer"], result["citations"]
+                if result["conversation_id"] != "none":
+                    st.session_state.conversation_id = result["conversation_id"]
+            else:
+                for event, data in stream_query(payload):
+                    if event == "citations":
+                        citations = data["citations"]
+                    elif event == "delta":
+                        answer += data["content"]
+                        answer_placeholder.markdown(answer + "▌")
+                    elif event == "done":
+                        answer = data["answer"]
+                        if data["conversation_id"] != "none":
+                            st.session_state.conversation_id = data["conversation_id"]
+                    elif event == "error":
+                        raise BackendStreamError(data["detail"])
+            
+            # Display final answer without the cursor
+            answer_placeholder.markdown(answer)
+            
+            # Display citations
+            if citations:
+                render_citations(citations, expanded=show_sources)
+            
+            # Add to messages
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": answer,
+                "citations": citations
+            })
+            
+        except requests.exceptions.ConnectionError:
+            answer_placeholder.empty()
+            st.error("🚫 **Connection Error**\\n\\nCannot connect to the backend server. Please ensure the API is running on port 8000.")
+        except requests.exceptions.HTTPError as e:
+            answer_placeholder.empty()
+            st.error(f"⚠️ **API Error**\\n\\n{e.response.text}")
+        except BackendStreamError as e:
+            answer_placeholder.empty()
+            st.error(f"⚠️ **API Error**\\n\\n{str(e)}")
+        except Exception as e:
+            answer_placeholder.empty()
+            st.error(f"❌ **Unexpected Error**\\n\\n{str(e)}")
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+class TTLCache:
+    """
+    Bounded in-memory cache with a per-entry TTL and LRU eviction.
+    
+    Expired entries are dropped lazily on access and when the cache is full.
+    With `stale_ttl`, expired entries are kept that much longer for
+    `get_stale`, e.g. to serve something while the upstream is down.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, stale_ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or entry[0] <= now:
+            if entry is not None and entry[0] + self.stale_ttl <= now:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Return the entry even if expired, as long as it is within `stale_ttl`."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] + self.stale_ttl <= time.monotonic():
+            return None
+        return entry[1]
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one upstream call.
+    
+    The first caller starts the call as its own task; callers arriving while it
+    is in flight await the same task. Cancelling one caller does not cancel the
+    shared call for the others.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        
+        return await asyncio.shield(task)
+    
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
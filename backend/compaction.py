@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+SummarizeFn = Callable[[Optional[str], List[Dict]], Awaitable[str]]
+
+# Message fields kept in the recent window (citations are left out to keep the header small)
+WINDOW_FIELDS = ("id", "role", "content", "timestamp")
+
+class ConversationCompactor:
+    """
+    Background task that keeps each conversation's compact history current.
+    
+    When a turn has been persisted the conversation is scheduled. Compaction
+    reads the messages not yet folded into the summary, keeps the newest
+    `window` of them as the recent window and summarizes the older ones into
+    the rolling summary, then writes both onto the conversation header, so
+    the query path reads a bounded amount of state however long the chat
+    grows. Each summary update sends only the messages that left the window.
+    
+    A conversation is scheduled at most once at a time, and always goes to
+    the same worker, so its compactions never overlap. Failures are logged
+    and not retried: the query path falls back to the recent messages until
+    the next turn schedules the conversation again. Conversations scheduled
+    while the compactor is not running are ignored.
+    """
+    
+    def __init__(
+        self,
+        store,
+        summarize_fn: SummarizeFn,
+        window: int = 4,
+        workers: int = 2
+    ):
+        self.store = store
+        self.summarize_fn = summarize_fn
+        self.window = window
+        self._queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+        self._queued: Set[Tuple[str, str]] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.compactions = 0
+        self.summaries = 0
+        self.failures = 0
+    
+    async def start(self):
+        """Start the workers. Called from the FastAPI lifespan."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+    
+    async def close(self):
+        """Stop the workers; scheduled compactions are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+        for queue in self._queues:
+            while not queue.empty():
+                queue.get_nowait()
+    
+    def schedule(self, user_id: str, conversation_id: str):
+        """Queue a conversation for compaction (no-op if already queued)."""
+        key = (user_id, conversation_id)
+        if not self._tasks or key in self._queued:
+            return
+        self._queued.add(key)
+        self._queues[hash(key) % len(self._queues)].put_nowait(key)
+    
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            key = await queue.get()
+            # Turns persisted from now on schedule the conversation again
+            self._queued.discard(key)
+            try:
+                await self.compact(*key)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Compaction of conversation {key[1]} failed: {str(e)}")
+    
+    async def compact(self, user_id: str, conversation_id: str):
+        """Fold messages that left the recent window into the summary and store the new state."""
+        with metrics.stage("compaction"):
+            header = await self.store.get_conversation_header(user_id, conversation_id)
+            if header is None or "messages" in header:
+                return  # Deleted, or a legacy single-document conversation
+            
+            messages = await self.store.get_messages_since(user_id, conversation_id, header.get("summarizedThrough"))
+            split = max(len(messages) - self.window, 0)
+            overflow, recent = messages[:split], messages[split:]
+            
+            summary = header.get("summary")
+            if overflow:
+                summary = await self.summarize_fn(summary, overflow)
+                self.summaries += 1
+            summarized = header.get("summarizedCount", 0) + len(overflow)
+            
+            await self.store.save_compaction(user_id, conversation_id, {
+                "summary": summary,
+                "summarizedCount": summarized,
+                "summarizedThrough": overflow[-1]["timestamp"] if overflow else header.get("summarizedThrough"),
+                "recentMessages": [{field: m.get(field) for field in WINDOW_FIELDS} for m in recent],
+                "compactedCount": summarized + len(recent)
+            })
+            self.compactions += 1
+    
+    def stats(self) -> Dict:
+        return {
+            "queued": len(self._queued),
+            "compactions": self.compactions,
+            "summaries": self.summaries,
+            "failures": self.failures
+        }
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from backend import metrics
+from backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+def page_etag(page: Dict) -> str:
+    """Strong ETag for a list page: a hash of its JSON representation."""
+    body = json.dumps(page, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value matches `etag` (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in [c[2:] if c.startswith("W/") else c for c in candidates]
+
+class CachedConversationStore:
+    """
+    Conversation store wrapper that caches each user's first conversation list page.
+    
+    list_conversations() for the first page at the default page size is
+    served from an in-process cache of headers per user, bounded by user
+    count with LRU eviction. Writes made through this wrapper
+    (create_conversation, add_message, save_turn) update the cached page in
+    place: the conversation moves to the top with its new updatedAt and
+    messageCount. Nothing is dropped from the page, so the Cosmos
+    continuation token cached with it (which resumes after the last sort
+    value returned) still leads to the right next page; a page that would
+    grow past the page size is dropped instead. save_turn only writes
+    through when the store reports that it wrote the turn, so a replayed
+    turn does not count its messages twice. The TTL
+    bounds staleness from writes made by other processes. Only pages the
+    store actually returned are cached; a failed read raises and leaves
+    the cache untouched. Every other method passes through to the wrapped
+    store.
+    """
+    
+    def __init__(self, store, page_size: int = 20, max_users: int = 10000, ttl: float = 30.0):
+        self.store = store
+        self.page_size = page_size
+        self.cache = TTLCache(max_entries=max_users, ttl=ttl)
+    
+    def __getattr__(self, name: str):
+        return getattr(self.store, name)
+    
+    async def list_conversations(
+        self,
+        user_id: str,
+        page_size: int = 20,
+        continuation: Optional[str] = None
+    ) -> Dict:
+        cacheable = continuation is None and page_size == self.page_size and self.cache.ttl > 0
+        if cacheable:
+            page = self.cache.get(user_id)
+            metrics.record_cache("conversations", hits=int(page is not None), misses=int(page is None))
+            if page is not None:
+                return {**page, "conversations": list(page["conversations"])}
+        
+        page = await self.store.list_conversations(user_id, page_size=page_size, continuation=continuation)
+        if cacheable:
+            self.cache.set(user_id, {**page, "conversations": list(page["conversations"])})
+        return page
+    
+    async def create_conversation(self, user_id: str, title: str = "New Conversation") -> str:
+        conversation_id = await self.store.create_conversation(user_id, title)
+        now = datetime.utcnow().isoformat()
+        self._write_through(user_id, conversation_id, now, 0, {
+            "id": conversation_id,
+            "conversationId": conversation_id,
+            "title": title,
+            "createdAt": now,
+            "messageCount": 0
+        })
+        return conversation_id
+    
+    async def add_message(
+        self,
+        user_id: str,
+        conversation_id: str,
+        role: str,
+        content: str,
+        citations: Optional[List[Dict]] = None
+    ):
+        await self.store.add_message(user_id, conversation_id, role, content, citations)
+        self._write_through(user_id, conversation_id, datetime.utcnow().isoformat(), 1)
+    
+    async def save_turn(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str] = None,
+        create: bool = False
+    ) -> bool:
+        saved = await self.store.save_turn(user_id, conversation_id, messages, title=title, create=create)
+        if not saved:
+            return False
+        header = {
+            "id": conversation_id,
+            "conversationId": conversation_id,
+            "title": title or "New Conversation",
+            "createdAt": messages[0]["timestamp"],
+            "messageCount": 0
+        } if create else None
+        self._write_through(user_id, conversation_id, messages[-1]["timestamp"], len(messages), header)
+        return True
+    
+    def _write_through(
+        self,
+        user_id: str,
+        conversation_id: str,
+        updated_at: str,
+        added_messages: int,
+        header: Optional[Dict] = None
+    ):
+        """Move the conversation to the top of the user's cached page, if one is cached."""
+        page = self.cache.get_stale(user_id)
+        if page is None:
+            return
+        
+        conversations = page["conversations"]
+        current = next((c for c in conversations if c["conversationId"] == conversation_id), None) or header
+        rest = [c for c in conversations if c["conversationId"] != conversation_id]
+        if current is None or len(rest) + 1 > self.page_size:
+            # Older than the cached page (its header isn't known here), or the page would outgrow page_size
+            self.cache.delete(user_id)
+            return
+        
+        page["conversations"] = [{
+            **current,
+            "updatedAt": updated_at,
+            "messageCount": current.get("messageCount", 0) + added_messages
+        }] + rest
+    
+    def stats(self) -> Dict:
+        return self.cache.stats()
@@ -0,0 +1,559 @@
+"""
+Credential-free stand-ins for the upstream clients, used when DEMO_MODE is on.
+
+- InMemoryConversationStore replaces Cosmos DB (conversations are lost on restart).
+- DemoRetrievalClient replaces Graph search with a BM25 index over the files
+  in DEMO_DOCS_PATH, built at startup.
+- ExtractiveAnswerGenerator replaces Azure OpenAI: answers quote the retrieved
+  sentences that best match the question, and embeddings are feature-hashed.
+- StaticTokenProvider replaces the Entra ID token provider.
+
+Every stand-in has the interface of the client it replaces, so the FastAPI
+layer (pipeline, caches, persistence, streaming) runs unchanged.
+"""
+import asyncio
+import copy
+import hashlib
+import logging
+import math
+import os
+import re
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
+from backend import metrics
+from backend.cosmos import page_by_offset
+from backend.ingestion import HTML_EXTENSIONS, TEXT_EXTENSIONS, chunk_text, extract_text
+from backend.rerank import tokenize
+from backend.retrieval import RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+DEMO_TOKEN = "demo-token"
+
+NO_ANSWER = "The retrieved documents don't contain a passage that answers this question."
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+MARKDOWN_HEADING = re.compile(r"^#+\s.*$", re.MULTILINE)
+FRAGMENT_PATTERN = re.compile(r"\S+\s*")
+
+class StaticTokenProvider:
+    """Token provider that never calls Entra ID."""
+    
+    async def start(self):
+        pass
+    
+    async def close(self):
+        pass
+    
+    async def get_token(self) -> str:
+        return DEMO_TOKEN
+
+class InMemoryConversationStore:
+    """
+    Conversation store with the interface of CosmosDBClient, held in process memory.
+    
+    Headers are kept per user and messages per conversation; returned items
+    are copies, so callers cannot mutate the store.
+    """
+    
+    def __init__(self):
+        self._conversations: Dict[str, Dict[str, Dict]] = {}
+        self._messages: Dict[Tuple[str, str], List[Dict]] = {}
+    
+    async def start(self):
+        pass
+    
+    async def close(self):
+        pass
+    
+    def _header(self, user_id: str, conversation_id: str) -> Optional[Dict]:
+        return self._conversations.get(user_id, {}).get(conversation_id)
+    
+    async def create_conversation(self, user_id: str, title: str = "New Conversation") -> str:
+        conversation_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
+        self._conversations.setdefault(user_id, {})[conversation_id] = {
+            "id": conversation_id,
+            "userId": user_id,
+            "conversationId": conversation_id,
+            "title": title,
+            "createdAt": now,
+            "updatedAt": now,
+            "messageCount": 0,
+            "type": "conversation"
+        }
+        self._messages[(user_id, conversation_id)] = []
+        return conversation_id
+    
+    async def add_message(
+        self,
+        user_id: str,
+        conversation_id: str,
+        role: str,
+        content: str,
+        citations: Optional[List[Dict]] = None
+    ):
+        await self.save_turn(user_id, conversation_id, [{
+            "id": str(uuid.uuid4()),
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat(),
+            "citations": citations or []
+        }])
+    
+    async def save_turn(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str] = None,
+        create: bool = False
+    ) -> bool:
+        """
+        Append a turn; messages already stored (same id) are skipped, as with
+        Cosmos upserts. Returns False if the whole turn was already stored.
+        """
+        header = self._header(user_id, conversation_id)
+        if header is None:
+            if not create:
+                raise KeyError(f"Conversation {conversation_id} not found")
+            header = {
+                "id": conversation_id,
+                "userId": user_id,
+                "conversationId": conversation_id,
+                "title": title or "New Conversation",
+                "createdAt": messages[0]["timestamp"],
+                "messageCount": 0,
+                "type": "conversation"
+            }
+            self._conversations.setdefault(user_id, {})[conversation_id] = header
+        
+        stored = self._messages.setdefault((user_id, conversation_id), [])
+        existing_ids = {message["id"] for message in stored}
+        new_messages = [copy.deepcopy(m) for m in messages if m["id"] not in existing_ids]
+        if not new_messages:
+            return False
+        stored.extend(new_messages)
+        header["messageCount"] += len(new_messages)
+        header["updatedAt"] = messages[-1]["timestamp"]
+        return True
+    
+    async def get_conversation(
+        self,
+        user_id: str,
+        conversation_id: str,
+        include_messages: bool = True,
+        include_citations: bool = True,
+        page_size: int = 50
+    ) -> Optional[Dict]:
+        header = self._header(user_id, conversation_id)
+        if header is None:
+            return None
+        conversation = {k: copy.deepcopy(v) for k, v in header.items() if k != "recentMessages"}
+        if include_messages:
+            page = await self.get_messages_page(
+                user_id,
+                conversation_id,
+                page_size=page_size,
+                include_citations=include_citations
+            )
+            conversation["messages"] = page["messages"]
+            conversation["continuation"] = page["continuation"]
+        return conversation
+    
+    async def get_messages_page(
+        self,
+        user_id: str,
+        conversation_id: str,
+        page_size: int = 50,
+        continuation: Optional[str] = None,
+        include_citations: bool = True,
+        newest_first: bool = False
+    ) -> Optional[Dict]:
+        if self._header(user_id, conversation_id) is None:
+            return None
+        messages = self._messages.get((user_id, conversation_id), [])
+        ordered = list(reversed(messages)) if newest_first else messages
+        page, next_continuation = page_by_offset(ordered, page_size, continuation)
+        return {
+            "messages": [
+                {k: copy.deepcopy(v) for k, v in message.items() if include_citations or k != "citations"}
+                for message in page
+            ],
+            "continuation": next_continuation
+        }
+    
+    async def get_recent_messages(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limit: int = 4
+    ) -> List[Dict]:
+        messages = self._messages.get((user_id, conversation_id), [])
+        return copy.deepcopy(messages[-limit:]) if limit else []
+    
+    async def get_compact_history(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limit: int = 4
+    ) -> Optional[Dict]:
+        header = self._header(user_id, conversation_id)
+        if header is None:
+            return None
+        if header.get("compactedCount", -1) >= header["messageCount"]:
+            messages = copy.deepcopy(header.get("recentMessages", [])[-limit:])
+        else:
+            messages = await self.get_recent_messages(user_id, conversation_id, limit)
+        return {
+            "summary": header.get("summary"),
+            "messages": messages
+        }
+    
+    async def get_conversation_header(self, user_id: str, conversation_id: str) -> Optional[Dict]:
+        header = self._header(user_id, conversation_id)
+        return copy.deepcopy(header) if header is not None else None
+    
+    async def get_messages_since(self, user_id: str, conversation_id: str, since: Optional[str] = None) -> List[Dict]:
+        messages = self._messages.get((user_id, conversation_id), [])
+        return copy.deepcopy([m for m in messages if since is None or m["timestamp"] > since])
+    
+    async def save_compaction(self, user_id: str, conversation_id: str, state: Dict):
+        header = self._header(user_id, conversation_id)
+        if header is None:
+            raise KeyError(f"Conversation {conversation_id} not found")
+        header.update(copy.deepcopy(state))
+    
+    async def list_conversations(
+        self,
+        user_id: str,
+        page_size: int = 20,
+        continuation: Optional[str] = None
+    ) -> Dict:
+        headers = sorted(
+            self._conversations.get(user_id, {}).values(),
+            key=lambda header: header["updatedAt"],
+            reverse=True
+        )
+        page, next_continuation = page_by_offset(headers, page_size, continuation)
+        fields = ("id", "conversationId", "title", "createdAt", "updatedAt", "messageCount")
+        return {
+            "conversations": [{field: header[field] for field in fields} for header in page],
+            "continuation": next_continuation
+        }
+    
+    def stats(self) -> Dict:
+        return {
+            "conversations": sum(len(c) for c in self._conversations.values()),
+            "messages": sum(len(m) for m in self._messages.values())
+        }
+
+class BM25Index:
+    """
+    Array-backed BM25 inverted index over a fixed list of documents.
+    
+    Postings are stored CSR-style: the postings of term t are
+    `doc_ids[offsets[t]:offsets[t + 1]]`, and `weights` holds the matching
+    BM25 term-frequency components, which are query-independent and so are
+    computed once at build time. A query gathers the postings of its terms,
+    scales them by IDF and accumulates into one dense score array; top-k
+    selection uses argpartition.
+    """
+    
+    def __init__(self, documents: List[str], k1: float = 1.2, b: float = 0.75):
+        self.vocabulary: Dict[str, int] = {}
+        term_ids, doc_ids, frequencies = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            lengths[doc_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc_id)
+                frequencies.append(count)
+        
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        # Stable sort keeps each term's postings in document order
+        order = np.argsort(term_ids, kind="stable")
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        frequencies = np.asarray(frequencies, dtype=np.float32)[order]
+        
+        document_frequencies = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(document_frequencies, out=self.offsets[1:])
+        
+        n = len(documents)
+        self.idf = np.log(1 + (n - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if n else 0.0
+        norms = k1 * (1 - b + b * lengths / max(average_length, 1.0))
+        self.weights = (frequencies * (k1 + 1) / (frequencies + norms[self.doc_ids])).astype(np.float32)
+        self.size = n
+    
+    def search(self, query: str, top: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Best `top` (document index, score) pairs for the query, highest first.
+        
+        `allowed` is an optional boolean mask over documents; only documents
+        matching at least one query term are returned.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in dict.fromkeys(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A document appears at most once per term, so this fancy-indexed add is exact
+            scores[self.doc_ids[start:end]] += self.idf[term_id] * self.weights[start:end]
+        
+        if allowed is not None:
+            scores[~allowed] = 0.0
+        matches = np.flatnonzero(scores)
+        if len(matches) > top:
+            matches = matches[np.argpartition(-scores[matches], top - 1)[:top]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(int(i), float(scores[i])) for i in matches]
+    
+    @property
+    def nbytes(self) -> int:
+        return self.doc_ids.nbytes + self.weights.nbytes + self.offsets.nbytes + self.idf.nbytes
+
+class DemoRetrievalClient:
+    """
+    Retrieval client with the interface of M365RetrievalClient, searching local files.
+    
+    Text and HTML files under `path` are chunked as in ingestion and indexed
+    with BM25 on start(). A file's top-level subfolder is its site, so
+    `site_filter` restricts results to one subfolder; files directly in
+    `path` have no site.
+    """
+    
+    def __init__(self, path: str, chunk_chars: int = 1500, chunk_overlap: int = 200):
+        self.path = path
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        self.chunks: List[RetrievalResult] = []
+        self.index = BM25Index([])
+        self._sites = np.zeros(0, dtype=object)
+        self.documents = 0
+        self.searches = 0
+    
+    async def start(self):
+        """Chunk and index the demo documents. Called from the FastAPI lifespan."""
+        if not os.path.isdir(self.path):
+            logger.warning(f"Demo documents folder {self.path} not found; searches will return no results")
+            return
+        
+        chunks = []
+        for file_path in self._files():
+            relative = os.path.relpath(file_path, self.path).replace(os.sep, "/")
+            site = relative.split("/")[0] if "/" in relative else None
+            title = os.path.splitext(os.path.basename(file_path))[0]
+            async for chunk in chunk_text(self._text(file_path), self.chunk_chars, self.chunk_overlap):
+                chunks.append(RetrievalResult(content=chunk, title=title, url=relative, site=site))
+            self.documents += 1
+        
+        self.index = await asyncio.to_thread(BM25Index, [f"{c.title} {c.content}" for c in chunks])
+        self.chunks = chunks
+        self._sites = np.array([(c.site or "").lower() for c in chunks], dtype=object)
+        logger.info(
+            f"Indexed {len(chunks)} chunks from {self.documents} demo documents "
+            f"({len(self.index.vocabulary)} terms, {self.index.nbytes} bytes)"
+        )
+    
+    def _files(self) -> List[str]:
+        extensions = TEXT_EXTENSIONS | HTML_EXTENSIONS
+        files = []
+        for directory, _, names in os.walk(self.path):
+            files.extend(
+                os.path.join(directory, name)
+                for name in names
+                if os.path.splitext(name.lower())[1] in extensions
+            )
+        return sorted(files)
+    
+    @staticmethod
+    async def _text(file_path: str) -> AsyncIterator[str]:
+        """
+        The file's text. Markdown headings are dropped: chunking collapses
+        newlines, so a heading would otherwise run into the next sentence.
+        """
+        with open(file_path, "rb") as f:
+            data = f.read()
+        
+        async def content() -> AsyncIterator[bytes]:
+            yield data
+        
+        text = "".join([piece async for piece in extract_text(content(), file_path)])
+        if file_path.lower().endswith(".md"):
+            text = MARKDOWN_HEADING.sub("", text)
+        yield text
+    
+    async def search_content(
+        self,
+        query: str,
+        access_token: str,
+        top: int = 10,
+        site_filter: Optional[str] = None
+    ) -> List[RetrievalResult]:
+        self.searches += 1
+        allowed = self._sites == site_filter.lower() if site_filter else None
+        return [
+            self.chunks[i].model_copy(update={"score": score})
+            for i, score in self.index.search(query, top, allowed)
+        ]
+    
+    def stats(self) -> Dict:
+        return {
+            "backend": "demo",
+            "documents": self.documents,
+            "chunks": len(self.chunks),
+            "terms": len(self.index.vocabulary),
+            "index_bytes": self.index.nbytes,
+            "searches": self.searches
+        }
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embeddings (feature hashing, L2-normalized).
+    
+    Near-identical texts get a cosine similarity close to 1, which is all the
+    semantic cache and embedding re-ranking need in demo mode.
+    """
+    
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.embedded = 0
+    
+    async def start(self):
+        pass
+    
+    async def close(self):
+        pass
+    
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in tokenize(text):
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest, "little")
+            vector[bucket % self.dimensions] += 1.0 if bucket & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        self.embedded += len(texts)
+        return [self._vector(text) for text in texts]
+    
+    def stats(self) -> Dict:
+        return {
+            "backend": "hashing",
+            "embedded": self.embedded
+        }
+
+class ExtractiveAnswerGenerator:
+    """
+    Answer generator with the interface of LLMClient that needs no model.
+    
+    The answer is made of the `max_sentences` retrieved sentences that best
+    match the question (query terms weighted by inverse sentence frequency),
+    in document order, each followed by its [n] citation marker. The same
+    question and chunks always give the same answer. Streams emit one
+    'delta' per word. Usage counts words, not model tokens. The conversation
+    summary is the list of questions asked, capped at `summary_max_chars`.
+    """
+    
+    def __init__(self, max_sentences: int = 3, summary_max_chars: int = 1200):
+        self.max_sentences = max_sentences
+        self.summary_max_chars = summary_max_chars
+        self.embeddings = HashingEmbedder()
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.embed(texts)
+    
+    async def summarize_conversation(self, summary: Optional[str], messages: List[Dict]) -> str:
+        questions = [f"Asked: {m['content']}" for m in messages if m["role"] == "user"]
+        text = " ".join(filter(None, [summary] + questions))
+        return text[-self.summary_max_chars:]
+    
+    def extract_answer(self, query: str, chunks: List[RetrievalResult]) -> str:
+        sentences = [
+            (number, position, sentence.strip())
+            for number, chunk in enumerate(chunks, start=1)
+            for position, sentence in enumerate(SENTENCE_PATTERN.split(chunk.content))
+            if sentence.strip().endswith((".", "!", "?"))  # Skips headings and list fragments
+        ]
+        sentence_terms = [set(tokenize(sentence)) for _, _, sentence in sentences]
+        query_terms = set(tokenize(query))
+        frequencies = Counter(term for terms in sentence_terms for term in terms & query_terms)
+        
+        scored = []
+        for (number, position, sentence), terms in zip(sentences, sentence_terms):
+            score = sum(math.log(1 + len(sentences) / frequencies[term]) for term in terms & query_terms)
+            if score > 0:
+                scored.append((-score, number, position, sentence))
+        
+        best = sorted(sorted(scored)[:self.max_sentences], key=lambda s: (s[1], s[2]))
+        if not best:
+            return NO_ANSWER
+        return " ".join(f"{sentence} [{number}]" for _, number, _, sentence in best)
+    
+    def _usage(self, query: str, chunks: List[RetrievalResult], answer: str) -> Dict:
+        prompt_words = len(tokenize(query)) + sum(len(tokenize(chunk.content)) for chunk in chunks)
+        completion_words = len(tokenize(answer))
+        return {
+            "prompt_tokens": prompt_words,
+            "completion_tokens": completion_words,
+            "total_tokens": prompt_words + completion_words
+        }
+    
+    def _build_citations(self, chunks: List[RetrievalResult]) -> List[Dict]:
+        return [
+            {
+                "number": idx + 1,
+                "title": chunk.title,
+                "url": chunk.url,
+                "snippet": chunk.content[:200]
+            }
+            for idx, chunk in enumerate(chunks)
+        ]
+    
+    async def generate_grounded_response(
+        self,
+        query: str,
+        retrieved_chunks: List[RetrievalResult],
+        conversation_history: List[Dict] = None,
+        conversation_summary: Optional[str] = None
+    ) -> Dict[str, any]:
+        with metrics.stage("llm"):
+            answer = self.extract_answer(query, retrieved_chunks)
+        return {
+            "answer": answer,
+            "citations": self._build_citations(retrieved_chunks),
+            "usage": self._usage(query, retrieved_chunks, answer)
+        }
+    
+    async def stream_grounded_response(
+        self,
+        query: str,
+        retrieved_chunks: List[RetrievalResult],
+        conversation_history: List[Dict] = None,
+        conversation_summary: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        citations = self._build_citations(retrieved_chunks)
+        yield {"type": "citations", "citations": citations}
+        
+        with metrics.stage("llm") as timer:
+            answer = self.extract_answer(query, retrieved_chunks)
+            metrics.LLM_TTFT_SECONDS.observe(timer.elapsed())
+            for fragment in FRAGMENT_PATTERN.findall(answer):
+                yield {"type": "delta", "content": fragment}
+        
+        yield {
+            "type": "done",
+            "answer": answer,
+            "citations": citations,
+            "usage": self._usage(query, retrieved_chunks, answer)
+        }
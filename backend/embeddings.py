@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import openai
+from backend import metrics
+from backend.prompt import TokenCounter
+from backend.ratelimit import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by a hash of (deployment, text).
+    
+    Backed by SQLite so it survives restarts and is shared by the API
+    workers and the ingestion job. All methods are blocking and are called
+    from a worker thread.
+    
+    The cache is bounded: open() prunes entries older than `max_age`
+    seconds, then the oldest entries beyond `max_rows` (None leaves either
+    bound off), so vectors for one-off queries and deleted documents do not
+    accumulate across restarts.
+    """
+    
+    def __init__(self, path: str, max_age: Optional[float] = None, max_rows: Optional[int] = None):
+        self.path = path
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+        self.prune()
+    
+    def prune(self) -> int:
+        """Delete entries past the age and row bounds, oldest first. Returns the number deleted."""
+        deleted = 0
+        with self._lock:
+            if self.max_age is not None:
+                deleted += self._conn.execute(
+                    "DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.max_age,)
+                ).rowcount
+            if self.max_rows is not None:
+                deleted += self._conn.execute("""
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_rows,)).rowcount
+        if deleted:
+            logger.info(f"Pruned {deleted} entries from the embedding cache at {self.path}")
+        return deleted
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    @property
+    def is_open(self) -> bool:
+        return self._conn is not None
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+    
+    def put_many(self, vectors: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()]
+            )
+
+class EmbeddingService:
+    """
+    Batched, cached access to the embedding deployment.
+    
+    A call to `embed` deduplicates its inputs by content hash and looks them
+    up in the persistent cache; only the misses are sent to the API, packed
+    into requests of at most `batch_size` inputs and `batch_max_tokens`
+    tokens. Requests run with bounded concurrency behind the deployment's
+    adaptive rate limiter: a 429 pauses every request for the Retry-After
+    period and lowers the rate, and 5xx responses are retried with backoff.
+    Re-embedding unchanged text therefore makes no API calls.
+    """
+    
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+    
+    def __init__(
+        self,
+        client,
+        deployment: str,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 256,
+        batch_max_tokens: int = 100000,
+        max_input_tokens: int = 8191,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        max_retry_delay: float = 60.0,
+        timeout: float = 60.0,
+        counter: Optional[TokenCounter] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None
+    ):
+        # Retries are handled here, with Retry-After awareness, not by the SDK
+        self.client = client.with_options(max_retries=0)
+        self.deployment = deployment
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_max_tokens = batch_max_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.timeout = timeout
+        self.counter = counter or TokenCounter(deployment)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(f"openai:{deployment}", rate=10.0)
+        
+        self.requests = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.embedded = 0
+    
+    async def start(self):
+        """Open the on-disk cache. Called from the FastAPI lifespan."""
+        if self.cache is not None and not self.cache.is_open:
+            await asyncio.to_thread(self.cache.open)
+    
+    async def close(self):
+        if self.cache is not None:
+            self.cache.close()
+    
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.deployment}\0{text}".encode("utf-8")).hexdigest()
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, returning one vector per input in input order."""
+        keys = [self.key(text) for text in texts]
+        unique = dict(zip(keys, texts))
+        
+        vectors: Dict[str, List[float]] = {}
+        if self.cache is not None and self.cache.is_open:
+            vectors = await asyncio.to_thread(self.cache.get_many, list(unique))
+            self.cache_hits += len(vectors)
+            metrics.record_cache("embedding", hits=len(vectors), misses=len(unique) - len(vectors))
+        
+        missing = [(key, text) for key, text in unique.items() if key not in vectors]
+        if missing:
+            results = await asyncio.gather(*[self._embed_batch(batch) for batch in self._batches(missing)])
+            fresh = {key: vector for result in results for key, vector in result.items()}
+            self.embedded += len(fresh)
+            vectors.update(fresh)
+            if self.cache is not None and self.cache.is_open:
+                await asyncio.to_thread(self.cache.put_many, fresh)
+        
+        return [vectors[key] for key in keys]
+    
+    def _batches(self, items: List[tuple]) -> List[List[tuple]]:
+        batches: List[List[tuple]] = []
+        current: List[tuple] = []
+        current_tokens = 0
+        for key, text in items:
+            text = self.counter.truncate(text, self.max_input_tokens)
+            tokens = self.counter.count(text)
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.batch_max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append((key, text))
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_batch(self, batch: List[tuple]) -> Dict[str, List[float]]:
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    await self.rate_limiter.acquire()
+                    self.requests += 1
+                    raw = await self.client.embeddings.with_raw_response.create(
+                        model=self.deployment,
+                        input=[text for _, text in batch],
+                        timeout=self.timeout
+                    )
+                self.rate_limiter.observe(raw.status_code, raw.headers)
+                response = raw.parse()
+                if response.usage is not None:
+                    metrics.record_tokens(self.deployment, response.usage.prompt_tokens)
+                ordered = sorted(response.data, key=lambda item: item.index)
+                return {key: item.embedding for (key, _), item in zip(batch, ordered)}
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                status = getattr(e, "status_code", None)
+                if status is not None:
+                    self.rate_limiter.observe(status, e.response.headers)
+                if (status is not None and status not in self.RETRYABLE_STATUS) or attempt >= self.max_retries:
+                    logger.error(f"Embedding batch of {len(batch)} failed: {str(e)}")
+                    raise
+                
+                attempt += 1
+                self.retries += 1
+                metrics.RETRIES.labels(self.rate_limiter.name).inc()
+                if status in self.rate_limiter.THROTTLE_STATUS:
+                    continue  # The limiter holds the retry until the upstream's Retry-After
+                
+                delay = random.uniform(0, min(2 ** attempt, self.max_retry_delay))
+                logger.warning(f"Embedding request failed ({status or 'connection'}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+    
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "embedded": self.embedded
+        }
@@ -0,0 +1,72 @@
+import httpx
+import logging
+from typing import Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class HttpClientPool:
+    """
+    Application-scoped, pooled httpx client.
+    
+    One AsyncClient is opened at startup and shared by every request, so TCP and
+    TLS setup is paid once per connection instead of once per call, and HTTP/2
+    lets concurrent requests multiplex over the same connection. Auth headers are
+    supplied per call, so the pool is independent of any particular token.
+    """
+    
+    def __init__(
+        self,
+        base_url: str = "",
+        http2: bool = True,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0
+    ):
+        self.base_url = base_url
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    async def start(self):
+        """Open the shared client. Called from the FastAPI lifespan."""
+        if self._client is not None:
+            return
+        
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=self.http2,
+            limits=self.limits,
+            timeout=self.timeout
+        )
+        logger.info(f"Opened HTTP pool for {self.base_url} (http2={self.http2})")
+    
+    async def close(self):
+        """Close all pooled connections. Called from the FastAPI lifespan."""
+        if self._client is None:
+            return
+        
+        await self._client.aclose()
+        self._client = None
+        logger.info(f"Closed HTTP pool for {self.base_url}")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("HTTP pool is not started")
+        return self._client
+
+graph_pool = HttpClientPool(
+    base_url="https://graph.microsoft.com/v1.0",
+    http2=settings.graph_http2,
+    max_connections=settings.graph_max_connections,
+    max_keepalive_connections=settings.graph_max_keepalive_connections,
+    keepalive_expiry=settings.graph_keepalive_expiry,
+    timeout=settings.graph_timeout
+)
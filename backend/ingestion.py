@@ -0,0 +1,640 @@
+"""
+Incremental SharePoint ingestion into the local vector index.
+
+Usage:
+    python -m backend.ingestion
+
+Each run walks the drives of the configured sites with Graph delta queries,
+starting from the delta link saved by the previous run, so only items that
+changed since then are listed and downloaded. Changed files are extracted
+and chunked as they stream in, chunks are upserted or deleted in a local
+SQLite chunk store, and new chunks are embedded. Only the chunks changed
+since the last run are then applied to the vector index, which skips
+re-training but still rewrites the index files (see VectorIndex.update);
+its centroids are re-trained with a full rebuild once the changes exceed
+INGESTION_RETRAIN_RATIO of the rows they were trained on.
+"""
+import asyncio
+import codecs
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from html.parser import HTMLParser
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import httpx
+import numpy as np
+from config import settings
+from backend.ratelimit import AdaptiveRateLimiter
+from backend.vector_index import PUBLIC_PRINCIPAL, IndexedChunk, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".json", ".xml"}
+HTML_EXTENSIONS = {".html", ".htm", ".aspx"}
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+TokenFn = Callable[[], Awaitable[str]]
+
+class ChunkStore:
+    """
+    Local SQLite store of ingested items, their chunks and the per-drive delta links.
+    
+    Chunks keep their embedding across re-ingestion when their text is
+    unchanged, so only new or edited text is sent for embedding. Chunks not
+    yet in the vector index are flagged, and the ids of chunks replaced or
+    deleted since are kept in `removed_chunks`, so the index can be updated
+    with just the changes. All methods are blocking and are called from a
+    worker thread.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS delta_links (
+                drive_id TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                delta_link TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                item_id TEXT PRIMARY KEY,
+                drive_id TEXT NOT NULL,
+                version TEXT,
+                title TEXT,
+                url TEXT,
+                site TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                item_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                acl TEXT NOT NULL,
+                embedding BLOB,
+                indexed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_item ON chunks (item_id);
+            CREATE TABLE IF NOT EXISTS removed_chunks (
+                chunk_id TEXT PRIMARY KEY
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")]
+        if "indexed" not in columns:
+            # Stores written before incremental index updates; the next run rebuilds the index
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0")
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def get_delta_link(self, drive_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT delta_link FROM delta_links WHERE drive_id = ?", (drive_id,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def set_delta_link(self, drive_id: str, site: str, delta_link: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO delta_links VALUES (?, ?, ?, ?)",
+                (drive_id, site, delta_link, time.time())
+            )
+    
+    def clear_delta_link(self, drive_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM delta_links WHERE drive_id = ?", (drive_id,))
+    
+    def item_version(self, item_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM items WHERE item_id = ?", (item_id,)).fetchone()
+        return row[0] if row else None
+    
+    def update_item_metadata(self, item: Dict):
+        """Record a rename/move without touching the item's chunk text or embeddings."""
+        with self._lock:
+            renamed = self._conn.execute(
+                "UPDATE items SET title = ?, url = ? WHERE item_id = ? AND (title IS NOT ? OR url IS NOT ?)",
+                (item["title"], item["url"], item["item_id"], item["title"], item["url"])
+            ).rowcount
+            if renamed:
+                # The index stores titles and URLs, so the chunks are re-added under the new ones
+                self._conn.execute("UPDATE chunks SET indexed = 0 WHERE item_id = ?", (item["item_id"],))
+    
+    def update_acl(self, item_id: str, acl: List[str]) -> bool:
+        """Replace the ACL of an item's chunks, flagging them for re-indexing. False if it was unchanged."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE chunks SET acl = ?, indexed = 0 WHERE item_id = ? AND acl IS NOT ?",
+                (json.dumps(acl), item_id, json.dumps(acl))
+            ).rowcount > 0
+    
+    def replace_item(self, item: Dict, chunks: List[str], acl: List[str]):
+        """Upsert an item and replace its chunks in one transaction."""
+        with self._lock:
+            previous = dict(self._conn.execute(
+                "SELECT content_hash, embedding FROM chunks WHERE item_id = ? AND embedding IS NOT NULL",
+                (item["item_id"],)
+            ).fetchall())
+            
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                    (item["item_id"], item["drive_id"], item["version"], item["title"], item["url"], item["site"])
+                )
+                self._remove_chunks([item["item_id"]])
+                for seq, content in enumerate(chunks):
+                    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+                    self._conn.execute(
+                        "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                        (f"{item['item_id']}:{seq}", item["item_id"], seq, content, content_hash,
+                         json.dumps(acl), previous.get(content_hash))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def delete_item(self, item_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._remove_chunks([item_id])
+            deleted = self._conn.execute("DELETE FROM items WHERE item_id = ?", (item_id,)).rowcount
+            self._conn.execute("COMMIT")
+        return deleted > 0
+    
+    def delete_unseen_items(self, drive_id: str, seen: Set[str]) -> int:
+        """
+        Delete the drive's items that a full enumeration did not list.
+        
+        A resync after an expired delta link lists only live items, without
+        tombstones for the ones deleted meanwhile. Returns how many were deleted.
+        """
+        with self._lock:
+            item_ids = [
+                item_id for (item_id,) in self._conn.execute("SELECT item_id FROM items WHERE drive_id = ?", (drive_id,))
+                if item_id not in seen
+            ]
+            self._conn.execute("BEGIN")
+            for start in range(0, len(item_ids), 500):
+                batch = item_ids[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                self._remove_chunks(batch)
+                self._conn.execute(f"DELETE FROM items WHERE item_id IN ({marks})", batch)
+            self._conn.execute("COMMIT")
+        return len(item_ids)
+    
+    def _remove_chunks(self, item_ids: List[str]):
+        """Delete the items' chunks, remembering their ids for the next index update."""
+        marks = ",".join("?" * len(item_ids))
+        self._conn.execute(
+            f"INSERT OR IGNORE INTO removed_chunks SELECT chunk_id FROM chunks WHERE item_id IN ({marks})",
+            item_ids
+        )
+        self._conn.execute(f"DELETE FROM chunks WHERE item_id IN ({marks})", item_ids)
+    
+    def pending_embeddings(self, limit: int) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT chunk_id, content FROM chunks WHERE embedding IS NULL LIMIT ?", (limit,)
+            ).fetchall()
+    
+    def set_embeddings(self, embeddings: List[Tuple[str, np.ndarray]]):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET embedding = ? WHERE chunk_id = ?",
+                [(np.asarray(vector, dtype=np.float32).tobytes(), chunk_id) for chunk_id, vector in embeddings]
+            )
+    
+    def export(self, changed_only: bool = False) -> Tuple[List[IndexedChunk], np.ndarray]:
+        """
+        Embedded chunks with their vectors, for building the vector index
+        (only those not yet in the index with `changed_only`).
+        """
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT c.chunk_id, c.content, c.acl, c.embedding, i.title, i.url, i.site
+                FROM chunks c JOIN items i ON i.item_id = c.item_id
+                WHERE c.embedding IS NOT NULL {"AND c.indexed = 0" if changed_only else ""}
+                ORDER BY c.item_id, c.seq
+            """).fetchall()
+        
+        chunks = [
+            IndexedChunk(chunk_id=chunk_id, content=content, title=title or "Untitled", url=url or "", site=site, acl=json.loads(acl))
+            for chunk_id, content, acl, _, title, url, site in rows
+        ]
+        vectors = np.stack([np.frombuffer(row[3], dtype=np.float32) for row in rows]) if rows else np.zeros((0, 0))
+        return chunks, vectors
+    
+    def removed_chunks(self) -> List[str]:
+        """Ids of indexed chunks replaced or deleted since the last index update."""
+        with self._lock:
+            return [chunk_id for (chunk_id,) in self._conn.execute("SELECT chunk_id FROM removed_chunks")]
+    
+    def mark_indexed(self, chunk_ids: Optional[List[str]] = None, removed: Optional[List[str]] = None):
+        """Record that the index now matches the store: for the given chunks, or for all of them by default."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            if chunk_ids is None:
+                self._conn.execute("UPDATE chunks SET indexed = 1 WHERE embedding IS NOT NULL")
+                self._conn.execute("DELETE FROM removed_chunks")
+            else:
+                self._conn.executemany("UPDATE chunks SET indexed = 1 WHERE chunk_id = ?", [(c,) for c in chunk_ids])
+                self._conn.executemany("DELETE FROM removed_chunks WHERE chunk_id = ?", [(c,) for c in removed or []])
+            self._conn.execute("COMMIT")
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            items = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {"items": items, "chunks": chunks}
+
+class _HtmlText(HTMLParser):
+    """Incremental HTML-to-text: feed markup as it arrives and drain the text seen so far."""
+    
+    SKIP_TAGS = {"script", "style", "head"}
+    
+    def __init__(self):
+        super().__init__()
+        self._parts: List[str] = []
+        self._skip = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in ("p", "div", "li", "br", "tr", "h1", "h2", "h3", "h4"):
+            self._parts.append("\n")
+    
+    def handle_data(self, data):
+        if not self._skip:
+            self._parts.append(data)
+    
+    def drain(self) -> str:
+        text = "".join(self._parts)
+        self._parts = []
+        return text
+
+async def extract_text(byte_stream: AsyncIterator[bytes], name: str) -> AsyncIterator[str]:
+    """Decode a downloaded file incrementally, stripping markup for HTML pages."""
+    extension = os.path.splitext(name.lower())[1]
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = _HtmlText() if extension in HTML_EXTENSIONS else None
+    
+    async for data in byte_stream:
+        text = decoder.decode(data)
+        if parser is not None:
+            parser.feed(text)
+            text = parser.drain()
+        if text:
+            yield text
+    
+    text = decoder.decode(b"", final=True)
+    if parser is not None:
+        parser.feed(text)
+        parser.close()
+        text = parser.drain()
+    if text:
+        yield text
+
+async def chunk_text(pieces: AsyncIterator[str], max_chars: int = 1500, overlap: int = 200) -> AsyncIterator[str]:
+    """
+    Split streamed text into chunks of at most `max_chars`, preferring
+    paragraph and then word boundaries, with `overlap` characters carried
+    into the next chunk. Only about one chunk of text is held in memory.
+    """
+    overlap = min(overlap, max_chars // 4)  # Every cut must make progress
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        while len(buffer) >= max_chars:
+            cut = buffer.rfind("\n\n", max_chars // 2, max_chars)
+            if cut == -1:
+                cut = buffer.rfind(" ", max_chars // 2, max_chars)
+            if cut == -1:
+                cut = max_chars
+            
+            chunk = " ".join(buffer[:cut].split())
+            if chunk:
+                yield chunk
+            buffer = buffer[cut - overlap:]
+    
+    chunk = " ".join(buffer.split())
+    if chunk:
+        yield chunk
+
+class DeltaSync:
+    """
+    Walks site drives with Graph delta queries and applies the changes to a ChunkStore.
+    
+    Listing happens on one task per drive; changed files are handed to a
+    bounded pool of download workers through a bounded queue, and every Graph
+    call passes through a shared rate limiter. A drive's new delta link is
+    saved only after all of its changes were applied, so an interrupted run
+    resumes from the previous link and re-applies idempotently. A full
+    enumeration (first sync, or resync after an expired link) carries no
+    tombstones, so stored items it did not list are deleted once it completes.
+    With `item_permissions`, the delta also lists items whose only change is
+    to their sharing, and the ACL of every listed item is re-read, so a
+    revoked principal drops out of the index on the next run.
+    """
+    
+    def __init__(
+        self,
+        store: ChunkStore,
+        token_fn: TokenFn,
+        sites: List[str],
+        base_url: str = GRAPH_BASE_URL,
+        workers: int = 4,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        chunk_chars: int = 1500,
+        chunk_overlap: int = 200,
+        item_permissions: bool = False,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        self.store = store
+        self.token_fn = token_fn
+        self.sites = sites
+        self.base_url = base_url
+        self.workers = workers
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter("graph-ingestion", rate=10.0)
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        self.item_permissions = item_permissions
+        self._client = client
+        self.counts = {
+            "listed": 0,
+            "downloaded": 0,
+            "unchanged": 0,
+            "acl_updated": 0,
+            "deleted": 0,
+            "skipped": 0,
+            "failed": 0
+        }
+    
+    async def run(self) -> Dict:
+        """Sync every drive of every configured site once. Returns per-run counts."""
+        owns_client = self._client is None
+        if owns_client:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=60.0, follow_redirects=True)
+        
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            for site in self.sites:
+                for drive_id in await self._drives(site):
+                    await self._sync_drive(site, drive_id, queue)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if owns_client:
+                await self._client.aclose()
+                self._client = None
+        
+        return dict(self.counts)
+    
+    async def _drives(self, site: str) -> List[str]:
+        data = await self._get_json(f"/sites/{site}/drives")
+        return [drive["id"] for drive in data.get("value", [])]
+    
+    async def _sync_drive(self, site: str, drive_id: str, queue: asyncio.Queue):
+        failed_before = self.counts["failed"]
+        delta_link = await asyncio.to_thread(self.store.get_delta_link, drive_id)
+        url = delta_link or f"/drives/{drive_id}/root/delta"
+        seen: Optional[Set[str]] = None if delta_link else set()
+        
+        while True:
+            try:
+                page = await self._get_json(url, self._delta_headers())
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 410:
+                    raise
+                # Delta link expired: Graph requires a full re-enumeration
+                logger.warning(f"Delta link for drive {drive_id} expired; resyncing")
+                await asyncio.to_thread(self.store.clear_delta_link, drive_id)
+                url = f"/drives/{drive_id}/root/delta"
+                seen = set()
+                continue
+            
+            for entry in page.get("value", []):
+                self.counts["listed"] += 1
+                if seen is not None:
+                    seen.add(entry["id"])
+                await queue.put((site, drive_id, entry))
+            
+            if "@odata.nextLink" in page:
+                url = page["@odata.nextLink"]
+                continue
+            
+            await queue.join()
+            if seen is not None and self.counts["failed"] == failed_before:
+                self.counts["deleted"] += await asyncio.to_thread(self.store.delete_unseen_items, drive_id, seen)
+            if self.counts["failed"] == failed_before and "@odata.deltaLink" in page:
+                await asyncio.to_thread(self.store.set_delta_link, drive_id, site, page["@odata.deltaLink"])
+            elif self.counts["failed"] != failed_before:
+                logger.warning(f"Keeping previous delta link for drive {drive_id}; failed items will be retried")
+            return
+    
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            site, drive_id, entry = await queue.get()
+            try:
+                await self._apply(site, drive_id, entry)
+            except Exception as e:
+                self.counts["failed"] += 1
+                logger.error(f"Failed to ingest item {entry.get('id')}: {str(e)}")
+            finally:
+                queue.task_done()
+    
+    async def _apply(self, site: str, drive_id: str, entry: Dict):
+        item_id = entry["id"]
+        
+        if "deleted" in entry:
+            if await asyncio.to_thread(self.store.delete_item, item_id):
+                self.counts["deleted"] += 1
+            return
+        
+        if "file" not in entry:
+            return  # Folders and the drive root carry no content
+        
+        item = {
+            "item_id": item_id,
+            "drive_id": drive_id,
+            # cTag changes only when content changes; eTag also changes on rename
+            "version": entry.get("cTag") or entry.get("eTag"),
+            "title": entry.get("name", "Untitled"),
+            "url": entry.get("webUrl", ""),
+            "site": entry.get("parentReference", {}).get("siteId") or site
+        }
+        
+        if await asyncio.to_thread(self.store.item_version, item_id) == item["version"]:
+            await asyncio.to_thread(self.store.update_item_metadata, item)
+            # Sharing changes (e.g. a revoked user) leave the cTag alone; refresh the ACL of every listed item
+            if self.item_permissions and await asyncio.to_thread(
+                self.store.update_acl, item_id, await self._acl(drive_id, item_id)
+            ):
+                self.counts["acl_updated"] += 1
+            self.counts["unchanged"] += 1
+            return
+        
+        extension = os.path.splitext(item["title"].lower())[1]
+        if extension not in TEXT_EXTENSIONS | HTML_EXTENSIONS:
+            # No local extractor for binary formats; drop any stale chunks
+            await asyncio.to_thread(self.store.replace_item, item, [], [])
+            self.counts["skipped"] += 1
+            return
+        
+        acl = await self._acl(drive_id, item_id)
+        chunks = await self._download_chunks(drive_id, item_id, item["title"])
+        await asyncio.to_thread(self.store.replace_item, item, chunks, acl)
+        self.counts["downloaded"] += 1
+    
+    async def _download_chunks(self, drive_id: str, item_id: str, name: str) -> List[str]:
+        await self.rate_limiter.acquire()
+        headers = {"Authorization": f"Bearer {await self.token_fn()}"}
+        async with self._client.stream("GET", f"/drives/{drive_id}/items/{item_id}/content", headers=headers) as response:
+            self.rate_limiter.observe(response.status_code, response.headers)
+            response.raise_for_status()
+            pieces = extract_text(response.aiter_bytes(), name)
+            return [chunk async for chunk in chunk_text(pieces, self.chunk_chars, self.chunk_overlap)]
+    
+    async def _acl(self, drive_id: str, item_id: str) -> List[str]:
+        if not self.item_permissions:
+            return [PUBLIC_PRINCIPAL]
+        
+        data = await self._get_json(f"/drives/{drive_id}/items/{item_id}/permissions")
+        principals = set()
+        for permission in data.get("value", []):
+            if permission.get("link", {}).get("scope") in ("organization", "anonymous"):
+                principals.add(PUBLIC_PRINCIPAL)
+            for grant in [permission.get("grantedToV2", {}), *permission.get("grantedToIdentitiesV2", [])]:
+                for kind in ("user", "group", "siteGroup"):
+                    if grant.get(kind, {}).get("id"):
+                        principals.add(f"{kind}:{grant[kind]['id']}")
+        return sorted(principals)
+    
+    def _delta_headers(self) -> Dict[str, str]:
+        if not self.item_permissions:
+            return {}
+        # Without these, items whose only change is to their permissions are left out of the delta
+        return {"Prefer": "deltashowsharingchanges, hierarchicalsharing"}
+    
+    async def _get_json(self, url: str, headers: Optional[Dict[str, str]] = None, max_attempts: int = 5) -> Dict:
+        for attempt in range(max_attempts):
+            await self.rate_limiter.acquire()
+            response = await self._client.get(
+                url,
+                headers={"Authorization": f"Bearer {await self.token_fn()}", **(headers or {})}
+            )
+            self.rate_limiter.observe(response.status_code, response.headers)
+            if response.status_code in self.rate_limiter.THROTTLE_STATUS and attempt < max_attempts - 1:
+                continue  # The limiter holds the retry until Graph's Retry-After
+            response.raise_for_status()
+            return response.json()
+
+async def embed_pending(store: ChunkStore, embed_fn: EmbedFn, batch_size: int = 1024) -> int:
+    """Embed chunks that have no vector yet. Returns the number embedded."""
+    embedded = 0
+    while True:
+        pending = await asyncio.to_thread(store.pending_embeddings, batch_size)
+        if not pending:
+            return embedded
+        
+        vectors = await embed_fn([content for _, content in pending])
+        await asyncio.to_thread(store.set_embeddings, [(chunk_id, vector) for (chunk_id, _), vector in zip(pending, vectors)])
+        embedded += len(pending)
+
+async def rebuild_index(store: ChunkStore, index_path: str):
+    chunks, vectors = await asyncio.to_thread(store.export)
+    await asyncio.to_thread(VectorIndex.build, index_path, chunks, vectors)
+    await asyncio.to_thread(store.mark_indexed)
+
+async def update_index(store: ChunkStore, index_path: str, retrain_ratio: float = 0.2) -> str:
+    """
+    Apply the chunks changed since the last update to the index, assigning
+    new chunks to the nearest existing inverted list. Rebuilds (re-training
+    the centroids) when there is no index yet, the embedding dimension has
+    changed, or the rows changed since the last training would exceed
+    `retrain_ratio` of the rows it was trained on. Returns "unchanged",
+    "updated" or "rebuilt".
+    """
+    manifest = await asyncio.to_thread(VectorIndex.read_manifest, index_path)
+    removed = await asyncio.to_thread(store.removed_chunks)
+    chunks, vectors = await asyncio.to_thread(store.export, True)
+    if manifest is not None and not removed and not chunks:
+        return "unchanged"
+    
+    if (
+        manifest is None
+        or not manifest.get("trained_count")
+        or (chunks and vectors.shape[1] != manifest["dim"])
+        or manifest.get("changed", 0) + len(removed) + len(chunks) > retrain_ratio * manifest["trained_count"]
+    ):
+        await rebuild_index(store, index_path)
+        return "rebuilt"
+    
+    await asyncio.to_thread(VectorIndex.update, index_path, chunks, vectors, removed)
+    await asyncio.to_thread(store.mark_indexed, [chunk.chunk_id for chunk in chunks], removed)
+    return "updated"
+
+async def main():
+    from backend.auth import token_provider
+    from backend.llm import LLMClient
+    
+    store = ChunkStore(settings.ingestion_store_path)
+    store.open()
+    llm_client = LLMClient()
+    await llm_client.embeddings.start()
+    await token_provider.start()
+    try:
+        sync = DeltaSync(
+            store,
+            token_provider.get_token,
+            settings.ingestion_sites,
+            workers=settings.ingestion_workers,
+            rate_limiter=AdaptiveRateLimiter(
+                "graph-ingestion",
+                rate=settings.ingestion_rate_limit,
+                min_rate=settings.rate_limit_min
+            ),
+            chunk_chars=settings.ingestion_chunk_chars,
+            chunk_overlap=settings.ingestion_chunk_overlap,
+            item_permissions=settings.ingestion_item_permissions
+        )
+        counts = await sync.run()
+        logger.info(f"Delta sync finished: {counts}")
+        
+        embedded = await embed_pending(store, llm_client.embed)
+        index = await update_index(store, settings.vector_index_path, settings.ingestion_retrain_ratio)
+        logger.info(f"Embedded {embedded} chunks; index {index}; store now holds {store.stats()}")
+    finally:
+        await token_provider.close()
+        await llm_client.embeddings.close()
+        store.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
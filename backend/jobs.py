@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+JobFn = Callable[[Dict], Awaitable[Any]]
+
+# Job states; the last three are final
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+class JobQueueFullError(Exception):
+    """Raised by submit() when the replica already has `max_queued` jobs waiting."""
+
+class JobStore:
+    """
+    Persistent job table (SQLite, WAL mode).
+    
+    Holds each job's request, state and result, so queued jobs survive a
+    restart and finished results can be read back until they expire. All
+    methods are blocking and are called from a worker thread by JobQueue.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                expires_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def insert(self, job_id: str, request: Dict, created_at: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, request, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request), created_at)
+            )
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        """The job, unless it does not exist or its result has expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, request, result, error, created_at, started_at, finished_at, expires_at "
+                "FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None or (row[8] is not None and row[8] <= time.time()):
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "request": json.loads(row[2]),
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": json.loads(row[4]) if row[4] else None,
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7]
+        }
+    
+    def start(self, job_id: str, started_at: str) -> bool:
+        """Mark a queued job as running. False if it is no longer queued (e.g. cancelled)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ? AND status = ?",
+                (RUNNING, started_at, job_id, QUEUED)
+            )
+        return cursor.rowcount == 1
+    
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        finished_at: str,
+        expires_at: float,
+        result: Any = None,
+        error: Optional[Dict] = None,
+        from_status: Optional[str] = None
+    ) -> bool:
+        """Record a final state (only if the job is in `from_status`, when given)."""
+        query = "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ? WHERE job_id = ?"
+        params = [
+            status,
+            json.dumps(result) if result is not None else None,
+            json.dumps(error) if error is not None else None,
+            finished_at,
+            expires_at,
+            job_id
+        ]
+        if from_status:
+            query += " AND status = ?"
+            params.append(from_status)
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+        return cursor.rowcount == 1
+    
+    def queued(self) -> List[str]:
+        """Ids of queued jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def fail_running(self, error: Dict, finished_at: str, expires_at: float) -> int:
+        """Fail jobs left running by a previous process. Returns how many there were."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, expires_at = ? WHERE status = ?",
+                (FAILED, json.dumps(error), finished_at, expires_at, RUNNING)
+            )
+        return cursor.rowcount
+    
+    def purge(self, now: float) -> int:
+        """Delete jobs whose results have expired."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+        return cursor.rowcount
+
+class JobQueue:
+    """
+    Bounded in-process worker pool for long-running requests.
+    
+    submit() records the job in the job table and returns at once; one of
+    `workers` tasks runs `job_fn(request)` and stores its result (or error),
+    which stays readable for `result_ttl` seconds. At most `max_queued`
+    jobs wait at a time, so each replica has a fixed concurrency and
+    backlog. Queued jobs are picked up again after a restart; jobs that
+    were running when the process stopped are marked failed, since they
+    may have had side effects already.
+    
+    Jobs live in this replica's table: with several replicas, polls must
+    reach the replica that accepted the job (session affinity).
+    """
+    
+    def __init__(
+        self,
+        store: JobStore,
+        job_fn: JobFn,
+        workers: int = 4,
+        max_queued: int = 100,
+        result_ttl: float = 3600.0
+    ):
+        self.store = store
+        self.job_fn = job_fn
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelling: Set[str] = set()
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+    
+    async def start(self):
+        """Open the job table, requeue waiting jobs and start the workers. Called from the FastAPI lifespan."""
+        if self._tasks:
+            return
+        
+        await asyncio.to_thread(self.store.open)
+        now = time.time()
+        await asyncio.to_thread(self.store.purge, now)
+        interrupted = await asyncio.to_thread(
+            self.store.fail_running,
+            {"status_code": 500, "detail": "Interrupted by a restart"},
+            datetime.utcnow().isoformat(),
+            now + self.result_ttl
+        )
+        queued = await asyncio.to_thread(self.store.queued)
+        for job_id in queued:
+            self._queue.put_nowait(job_id)
+        if interrupted or queued:
+            logger.info(f"Resuming {len(queued)} queued jobs ({interrupted} interrupted jobs failed)")
+        
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def close(self):
+        """Stop the workers. Queued jobs resume on the next start; running ones are reported as interrupted."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = asyncio.Queue()
+        await asyncio.to_thread(self.store.close)
+    
+    async def submit(self, request: Dict) -> Dict:
+        """Queue a job for `request`. Raises JobQueueFullError when the backlog is full."""
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFullError(f"{self._queue.qsize()} jobs already queued")
+        
+        job_id = str(uuid.uuid4())
+        await asyncio.to_thread(self.store.insert, job_id, request, datetime.utcnow().isoformat())
+        self._queue.put_nowait(job_id)
+        return await self.get(job_id)
+    
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+    
+    async def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued or running job. Finished jobs are returned unchanged."""
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        
+        if job["status"] == QUEUED:
+            # The worker skips it: JobStore.start() only claims queued jobs
+            if await asyncio.to_thread(self._finish, job_id, CANCELLED, None, None, QUEUED):
+                self.cancelled += 1
+        elif job["status"] == RUNNING and job_id in self._running:
+            task = self._running[job_id]
+            self._cancelling.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+        return await self.get(job_id)
+    
+    def _finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Any = None,
+        error: Optional[Dict] = None,
+        from_status: Optional[str] = None
+    ) -> bool:
+        now = time.time()
+        return self.store.finish(
+            job_id,
+            status,
+            datetime.utcnow().isoformat(),
+            now + self.result_ttl,
+            result=result,
+            error=error,
+            from_status=from_status
+        )
+    
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} could not be run: {str(e)}")
+    
+    async def _run(self, job_id: str):
+        if not await asyncio.to_thread(self.store.start, job_id, datetime.utcnow().isoformat()):
+            return  # Cancelled while queued
+        job = await self.get(job_id)
+        
+        task = asyncio.create_task(self.job_fn(job["request"]))
+        self._running[job_id] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if job_id not in self._cancelling:
+                raise  # The worker itself is stopping
+            await asyncio.to_thread(self._finish, job_id, CANCELLED)
+            self.cancelled += 1
+        except Exception as e:
+            error = {"status_code": getattr(e, "status_code", 500), "detail": getattr(e, "detail", str(e))}
+            await asyncio.to_thread(self._finish, job_id, FAILED, None, error)
+            self.failed += 1
+            logger.warning(f"Job {job_id} failed: {str(e)}")
+        else:
+            await asyncio.to_thread(self._finish, job_id, SUCCEEDED, result)
+            self.succeeded += 1
+        finally:
+            self._running.pop(job_id, None)
+            self._cancelling.discard(job_id)
+        
+        await asyncio.to_thread(self.store.purge, time.time())
+    
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": len(self._running),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled
+        }
@@ -0,0 +1,182 @@
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Spans are optional; Prometheus metrics work without them
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Stages range from in-memory lookups (ms) to LLM completions (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of one query pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_TTFT_SECONDS = Histogram(
+    "rag_llm_time_to_first_token_seconds",
+    "Time from sending a streamed completion to its first content token",
+    buckets=LATENCY_BUCKETS
+)
+TOKENS = Counter(
+    "rag_llm_tokens",
+    "Azure OpenAI tokens consumed",
+    ["deployment", "kind"]
+)
+CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups",
+    "Cache lookups by cache and result (hit/miss)",
+    ["cache", "result"]
+)
+RETRIES = Counter(
+    "rag_upstream_retries",
+    "Upstream calls retried after a throttling or server error",
+    ["upstream"]
+)
+THROTTLED = Counter(
+    "rag_upstream_throttled",
+    "Throttling responses (429/503) received from an upstream",
+    ["upstream"]
+)
+RATE_LIMIT = Gauge(
+    "rag_rate_limit_requests_per_second",
+    "Current pacing rate of an upstream's adaptive rate limiter",
+    ["upstream"]
+)
+RATE_LIMIT_QUEUE_DEPTH = Gauge(
+    "rag_rate_limit_queue_depth",
+    "Callers waiting for a token from an upstream's rate limiter",
+    ["upstream"]
+)
+PERSISTENCE_QUEUE_DEPTH = Gauge(
+    "rag_persistence_queue_depth",
+    "Conversation turns journaled but not yet written to the conversation store"
+)
+PERSISTENCE_FLUSH_LAG = Gauge(
+    "rag_persistence_flush_lag_seconds",
+    "Age of the oldest conversation turn not yet written to the conversation store"
+)
+PERSISTENCE_WRITES = Counter(
+    "rag_persistence_turn_writes",
+    "Write-behind conversation turn writes by result (flushed/retried/dead_lettered)",
+    ["result"]
+)
+COSMOS_REQUEST_UNITS = Counter(
+    "rag_cosmos_request_units",
+    "Cosmos DB request units charged",
+    ["operation"]
+)
+COSMOS_REQUESTS = Counter(
+    "rag_cosmos_requests",
+    "Cosmos DB requests by operation and status code",
+    ["operation", "status"]
+)
+
+_tracer = trace.get_tracer(__name__) if trace is not None else None
+_tracer_provider = None
+_stage_listeners: List[Callable[[str, float], None]] = []
+
+class StageTimer:
+    """Handle yielded by `stage()`; `elapsed()` is the time since the stage started."""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+@contextmanager
+def stage(name: str) -> Iterator[StageTimer]:
+    """
+    Time a pipeline stage into `rag_stage_duration_seconds{stage=name}`.
+    
+    The stage also runs inside an OpenTelemetry span, which is a no-op
+    unless trace export has been configured.
+    """
+    timer = StageTimer(name)
+    with span(name):
+        try:
+            yield timer
+        finally:
+            elapsed = timer.elapsed()
+            STAGE_SECONDS.labels(name).observe(elapsed)
+            for listener in _stage_listeners:
+                listener(name, elapsed)
+
+def add_stage_listener(listener: Callable[[str, float], None]):
+    """Also call `listener(stage, seconds)` for every timed stage, e.g. to collect raw samples in a load test."""
+    _stage_listeners.append(listener)
+
+def span(name: str):
+    """Current OpenTelemetry span named `rag.<name>` (a null context without OpenTelemetry)."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(f"rag.{name}")
+
+def record_tokens(deployment: str, prompt_tokens: int, completion_tokens: int = 0):
+    TOKENS.labels(deployment, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        TOKENS.labels(deployment, "completion").inc(completion_tokens)
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+def record_cosmos_request(operation: str, status: int, request_charge: Optional[str]):
+    COSMOS_REQUESTS.labels(operation, str(status)).inc()
+    if request_charge:
+        try:
+            COSMOS_REQUEST_UNITS.labels(operation).inc(float(request_charge))
+        except ValueError:
+            pass
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format stage durations as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+def render() -> bytes:
+    """Current metrics in the Prometheus text exposition format."""
+    return generate_latest()
+
+def configure_tracing(endpoint: str, service_name: str) -> bool:
+    """
+    Export spans over OTLP/HTTP to `endpoint` (e.g. an OpenTelemetry Collector).
+    
+    Needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http;
+    without them a warning is logged and spans stay no-ops.
+    """
+    global _tracer_provider
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OpenTelemetry SDK or OTLP exporter not installed; trace export disabled")
+        return False
+    
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")))
+    trace.set_tracer_provider(provider)
+    _tracer_provider = provider
+    logger.info(f"Exporting traces to {endpoint}")
+    return True
+
+def shutdown_tracing():
+    """Flush and stop trace export. Called from the FastAPI lifespan."""
+    global _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+        _tracer_provider = None
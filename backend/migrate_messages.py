@@ -0,0 +1,26 @@
+"""
+Migrate legacy single-document conversations to itemized message storage.
+
+Usage:
+    python -m backend.migrate_messages
+
+Safe to re-run: message items are upserted by id and conversations that are
+already migrated are skipped.
+"""
+import asyncio
+import logging
+from backend.cosmos import cosmos_client
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def main():
+    await cosmos_client.start()
+    try:
+        migrated = await cosmos_client.migrate_legacy_conversations()
+        logger.info(f"Migrated {migrated} conversations")
+    finally:
+        await cosmos_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,390 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from config import settings
+from backend import metrics
+from backend.cosmos import cosmos_client
+
+logger = logging.getLogger(__name__)
+
+# Store statuses that retrying cannot fix (bad request, missing conversation, item too large)
+PERMANENT_STATUS = {400, 404, 413}
+
+def new_conversation_id() -> str:
+    """
+    A UUIDv7-layout id for a new conversation: the first 48 bits are the
+    creation time in milliseconds, so conversation_age() works before the
+    conversation has reached the store.
+    """
+    value = uuid.uuid4().int & ~(((1 << 48) - 1) << 80) & ~(0xF << 76)
+    value |= (int(time.time() * 1000) << 80) | (0x7 << 76)
+    return str(uuid.UUID(int=value))
+
+def conversation_age(conversation_id: str) -> Optional[float]:
+    """Seconds since a new_conversation_id() id was minted; None for other ids."""
+    try:
+        parsed = uuid.UUID(conversation_id)
+    except ValueError:
+        return None
+    if parsed.version != 7:
+        return None
+    return time.time() - (parsed.int >> 80) / 1000
+
+def new_messages(messages: List[Dict]) -> List[Dict]:
+    """Stamp a turn's messages with the id, timestamp and citations of stored messages."""
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "timestamp": datetime.utcnow().isoformat(),
+            "citations": [],
+            **message
+        }
+        for message in messages
+    ]
+
+def is_permanent_failure(e: Exception) -> bool:
+    """Whether a failed turn write can never succeed, so retrying it is pointless."""
+    status_code = getattr(e, "status_code", None)
+    if status_code is not None:
+        return status_code in PERMANENT_STATUS
+    # Rejected by the store itself (e.g. the in-memory demo store's missing conversation)
+    return isinstance(e, (KeyError, ValueError, TypeError))
+
+class TurnJournal:
+    """
+    Durable local journal of chat turns waiting to be written to Cosmos DB.
+    
+    Backed by SQLite in WAL mode with synchronous=FULL, so an acknowledged
+    append survives a process crash or restart. Turns that can never be
+    written are moved to a dead-letter table for inspection. All methods are
+    blocking and are called from a worker thread by TurnWriter.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS turns (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                turn_id TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_turns (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                turn_id TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                failed_at REAL NOT NULL
+            )
+        """)
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def append(self, turn: Dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO turns (turn_id, payload, enqueued_at) VALUES (?, ?, ?)",
+                (turn["turn_id"], json.dumps(turn), turn["enqueued_at"])
+            )
+    
+    def pending(self, limit: int = 100, after_seq: int = 0) -> List[Tuple[int, Dict]]:
+        """Oldest-first pending turns after `after_seq`, with their sequence numbers."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, payload FROM turns WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+    
+    def delete(self, turn_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE turn_id = ?", (turn_id,))
+    
+    def record_failure(self, turn_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE turns SET attempts = attempts + 1, last_error = ? WHERE turn_id = ?",
+                (error, turn_id)
+            )
+    
+    def dead_letter(self, turn_id: str, error: str):
+        """Move a turn that can never be written from the journal to the dead-letter table."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_turns (turn_id, payload, enqueued_at, attempts, error, failed_at) "
+                    "SELECT turn_id, payload, enqueued_at, attempts + 1, ?, ? FROM turns WHERE turn_id = ?",
+                    (error, time.time(), turn_id)
+                )
+                self._conn.execute("DELETE FROM turns WHERE turn_id = ?", (turn_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def dead_letter_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_turns").fetchone()[0]
+
+class TurnWriter:
+    """
+    Write-behind persistence of chat turns.
+    
+    submit() appends the turn (user + assistant message) to the local journal
+    and returns; a background task flushes journal entries to Cosmos DB, one
+    transactional batch per turn, in order within each conversation. Cosmos
+    slowdowns or outages delay the flush instead of failing the user's
+    request, and entries still in the journal are replayed after a restart.
+    A turn that fails with a permanent error (see is_permanent_failure) is
+    dead-lettered rather than retried, so it cannot hold up other turns.
+    
+    Pending turns are only visible on the replica that journaled them. A
+    follow-up turn handled by another replica before the first turn was
+    flushed finds no conversation yet; if the conversation was started
+    less than `missing_conversation_grace` seconds ago (see
+    conversation_age), its write is retried on "not found" until the
+    creating replica has flushed, and dead-lettered after that.
+    """
+    
+    def __init__(
+        self,
+        store,
+        journal: TurnJournal,
+        flush_interval: float = 0.5,
+        max_retry_delay: float = 30.0,
+        missing_conversation_grace: float = 300.0
+    ):
+        self.store = store
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.missing_conversation_grace = missing_conversation_grace
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Pending turns by (user_id, conversation_id), so history reads see unflushed messages
+        self._pending: Dict[tuple, List[Dict]] = {}
+        self._queue_depth = 0
+        self._oldest_enqueued_at: Optional[float] = None
+        self._flushed_total = 0
+        self._failed_attempts_total = 0
+        self._dead_lettered_total = 0
+        self._last_flush_lag = 0.0
+        self._flush_listeners: List[Callable[[str, str], None]] = []
+        metrics.PERSISTENCE_QUEUE_DEPTH.set_function(lambda: self._queue_depth)
+        metrics.PERSISTENCE_FLUSH_LAG.set_function(self.flush_lag)
+    
+    async def start(self):
+        """Open the journal, load unflushed turns and start the flush task."""
+        if self._task is not None:
+            return
+        
+        await asyncio.to_thread(self.journal.open)
+        for _, turn in await asyncio.to_thread(self.journal.pending, 1_000_000):
+            self._track(turn)
+        self._dead_lettered_total = await asyncio.to_thread(self.journal.dead_letter_count)
+        if self._queue_depth:
+            logger.info(f"Replaying {self._queue_depth} journaled turns")
+        
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+    
+    async def close(self, timeout: float = 10.0):
+        """
+        Keep flushing until the journal is empty or `timeout` has passed, then
+        stop. Leftovers stay journaled, and are lost if the journal is not on
+        a persistent volume.
+        """
+        if self._task is None:
+            return
+        
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Turn writer stopped with {self._queue_depth} turns still journaled")
+        self._task = None
+        await asyncio.to_thread(self.journal.close)
+    
+    async def submit(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str] = None,
+        create: bool = False
+    ):
+        """Durably journal a turn for background persistence."""
+        now = time.time()
+        turn = {
+            "turn_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "title": title,
+            "create": create,
+            "enqueued_at": now,
+            "messages": new_messages(messages)
+        }
+        
+        await asyncio.to_thread(self.journal.append, turn)
+        self._track(turn)
+        self._wakeup.set()
+    
+    def add_flush_listener(self, listener: Callable[[str, str], None]):
+        """Call `listener(user_id, conversation_id)` after each turn is written to Cosmos DB."""
+        self._flush_listeners.append(listener)
+    
+    def pending_messages(self, user_id: str, conversation_id: str) -> List[Dict]:
+        """Messages journaled for a conversation but not yet in Cosmos DB, oldest first."""
+        turns = self._pending.get((user_id, conversation_id), [])
+        return [message for turn in turns for message in turn["messages"]]
+    
+    def flush_lag(self) -> float:
+        """Seconds the oldest unflushed turn has been waiting (0 when nothing is pending)."""
+        return time.time() - self._oldest_enqueued_at if self._oldest_enqueued_at else 0.0
+    
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self._queue_depth,
+            "flush_lag_seconds": round(self.flush_lag(), 3),
+            "last_flush_lag_seconds": round(self._last_flush_lag, 3),
+            "flushed_total": self._flushed_total,
+            "failed_attempts_total": self._failed_attempts_total,
+            "dead_lettered_total": self._dead_lettered_total
+        }
+    
+    def _track(self, turn: Dict):
+        self._pending.setdefault((turn["user_id"], turn["conversation_id"]), []).append(turn)
+        self._queue_depth += 1
+        if self._oldest_enqueued_at is None:
+            self._oldest_enqueued_at = turn["enqueued_at"]
+    
+    def _untrack(self, turn: Dict):
+        key = (turn["user_id"], turn["conversation_id"])
+        turns = self._pending.get(key, [])
+        turns[:] = [t for t in turns if t["turn_id"] != turn["turn_id"]]
+        if not turns:
+            self._pending.pop(key, None)
+        
+        self._queue_depth -= 1
+        oldest = [t["enqueued_at"] for ts in self._pending.values() for t in ts]
+        self._oldest_enqueued_at = min(oldest) if oldest else None
+    
+    async def _run(self):
+        retry_delay = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=retry_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            try:
+                flushed_all = await self._flush()
+            except Exception as e:
+                logger.error(f"Turn journal flush failed: {str(e)}")
+                flushed_all = False
+            
+            if self._closing and (flushed_all or not self._queue_depth):
+                return
+            retry_delay = self.flush_interval if flushed_all else min(retry_delay * 2, self.max_retry_delay)
+            if self._closing:
+                retry_delay = self.flush_interval  # Draining: keep retrying until close() gives up
+    
+    async def _flush(self) -> bool:
+        """
+        Flush journaled turns oldest first. Returns False if a write is to be retried.
+        
+        After a transient failure, later turns of the same conversation wait
+        for the next attempt (so they cannot overtake it), while other
+        conversations carry on.
+        """
+        blocked: Set[tuple] = set()
+        after_seq = 0
+        while True:
+            turns = await asyncio.to_thread(self.journal.pending, 100, after_seq)
+            if not turns:
+                return not blocked
+            
+            for seq, turn in turns:
+                after_seq = seq
+                key = (turn["user_id"], turn["conversation_id"])
+                if key in blocked:
+                    continue
+                try:
+                    await self.store.save_turn(
+                        user_id=turn["user_id"],
+                        conversation_id=turn["conversation_id"],
+                        messages=turn["messages"],
+                        title=turn["title"],
+                        create=turn["create"]
+                    )
+                except Exception as e:
+                    self._failed_attempts_total += 1
+                    if is_permanent_failure(e) and not self._may_still_appear(turn, e):
+                        logger.error(f"Dead-lettering turn {turn['turn_id']}: {str(e)}")
+                        await asyncio.to_thread(self.journal.dead_letter, turn["turn_id"], str(e))
+                        self._dead_lettered_total += 1
+                        metrics.PERSISTENCE_WRITES.labels("dead_lettered").inc()
+                        self._untrack(turn)
+                    else:
+                        logger.error(f"Failed to persist turn {turn['turn_id']}: {str(e)}")
+                        await asyncio.to_thread(self.journal.record_failure, turn["turn_id"], str(e))
+                        metrics.PERSISTENCE_WRITES.labels("retried").inc()
+                        blocked.add(key)
+                    continue
+                
+                await asyncio.to_thread(self.journal.delete, turn["turn_id"])
+                self._last_flush_lag = time.time() - turn["enqueued_at"]
+                self._flushed_total += 1
+                metrics.PERSISTENCE_WRITES.labels("flushed").inc()
+                self._untrack(turn)
+                for listener in self._flush_listeners:
+                    listener(turn["user_id"], turn["conversation_id"])
+    
+    def _may_still_appear(self, turn: Dict, e: Exception) -> bool:
+        """Whether a follow-up turn's conversation may still be created by another replica's flush."""
+        missing = getattr(e, "status_code", None) == 404 or isinstance(e, KeyError)
+        age = conversation_age(turn["conversation_id"])
+        return (
+            missing
+            and not turn["create"]
+            and age is not None
+            and age < self.missing_conversation_grace
+        )
+
+turn_writer = TurnWriter(
+    store=cosmos_client,
+    journal=TurnJournal(settings.persistence_journal_path),
+    flush_interval=settings.persistence_flush_interval,
+    max_retry_delay=settings.persistence_max_retry_delay,
+    missing_conversation_grace=settings.persistence_missing_conversation_grace
+)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, ContextManager, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+class Stage:
+    def __init__(self, name: str, fn: StageFn, depends_on: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.depends_on = list(depends_on)
+
+class StageGraph:
+    """
+    Runs pipeline stages as a dependency graph.
+    
+    Every stage starts as soon as the stages it depends on have finished, so
+    independent stages run concurrently. A stage receives the results of all
+    completed stages (keyed by stage name) and its return value becomes its
+    result. If any stage fails, all other running or waiting stages are
+    cancelled and the original exception is raised.
+    
+    Stage durations are kept in `timings`; an `observer` (a context manager
+    factory taking the stage name, e.g. metrics.stage) is entered around
+    each stage for histograms and tracing spans.
+    
+    Example:
+        graph = StageGraph()
+        graph.add("retrieval", retrieve)
+        graph.add("history", load_history)
+        graph.add("generation", generate, depends_on=["retrieval", "history"])
+        results = await graph.run()
+    """
+    
+    def __init__(self, observer: Optional[Callable[[str], ContextManager]] = None):
+        self._stages: Dict[str, Stage] = {}
+        self._observer = observer
+        self.timings: Dict[str, float] = {}
+    
+    def add(self, name: str, fn: StageFn, depends_on: Iterable[str] = ()) -> "StageGraph":
+        """Add a stage. Dependencies must already be registered, which keeps the graph acyclic."""
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        
+        stage = Stage(name, fn, depends_on)
+        missing = [dep for dep in stage.depends_on if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+        
+        self._stages[name] = stage
+        return self
+    
+    async def run(self) -> Dict[str, Any]:
+        """Run all stages and return their results keyed by stage name."""
+        results: Dict[str, Any] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_stage(stage: Stage) -> Any:
+            if stage.depends_on:
+                await asyncio.gather(*(tasks[dep] for dep in stage.depends_on))
+            
+            start = time.perf_counter()
+            try:
+                with self._observer(stage.name) if self._observer else nullcontext():
+                    result = await stage.fn(results)
+            finally:
+                self.timings[stage.name] = time.perf_counter() - start
+            
+            results[stage.name] = result
+            return result
+        
+        for name, stage in self._stages.items():
+            tasks[name] = asyncio.create_task(run_stage(stage), name=f"stage:{name}")
+        
+        try:
+            done, _ = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+            return results
+        finally:
+            await self._cancel_pending(tasks.values())
+    
+    async def _cancel_pending(self, tasks: Iterable[asyncio.Task]):
+        pending: List[asyncio.Task] = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"Cancelled stages: {[task.get_name() for task in pending]}")
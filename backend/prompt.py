@@ -0,0 +1,182 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from backend.retrieval import RetrievalResult
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Chat format adds a few tokens of framing per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class TokenCounter:
+    """Counts and truncates text in model tokens (tiktoken), or ~4 chars/token without it."""
+    
+    def __init__(self, model: str = "gpt-4o"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    self.encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    self.encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # tiktoken downloads its BPE files on first use; offline hosts get the estimate
+                logger.warning(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+    
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return (len(text) + 3) // 4
+    
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self.encoding.decode(tokens[:max_tokens - 1]) + "…"
+        if len(text) <= max_tokens * 4:
+            return text
+        return text[:(max_tokens - 1) * 4] + "…"
+
+class PromptBuilder:
+    """
+    Assembles chat messages within a fixed token budget.
+    
+    Layout is [system, summary, history..., context + question]: the static
+    system prompt always comes first and history precedes the per-request
+    context, keeping the longest possible stable prefix for provider-side
+    prompt caching. The budget covers the whole request, so
+    `max_completion_tokens` is reserved up front; the rest goes to system
+    prompt and question (never trimmed), then the rolling summary of earlier
+    turns (capped at `summary_max_tokens`) and history (each turn capped,
+    oldest dropped first), then retrieved chunks in rank order, each capped
+    and the last one trimmed to fit.
+    """
+    
+    def __init__(
+        self,
+        system_prompt: str,
+        token_budget: int = 6000,
+        max_completion_tokens: int = 800,
+        chunk_max_tokens: int = 350,
+        history_turn_max_tokens: int = 200,
+        summary_max_tokens: int = 300,
+        min_chunk_tokens: int = 50,
+        counter: Optional[TokenCounter] = None
+    ):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.max_completion_tokens = max_completion_tokens
+        self.chunk_max_tokens = chunk_max_tokens
+        self.history_turn_max_tokens = history_turn_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.counter = counter or TokenCounter()
+        self._system_tokens = self.counter.count(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    
+    def build(
+        self,
+        query: str,
+        chunks: List[RetrievalResult],
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_summary: Optional[str] = None
+    ) -> Tuple[List[Dict], List[RetrievalResult], Dict]:
+        """
+        Returns (messages, chunks actually included, prompt token breakdown).
+        
+        Citation numbers must be built from the returned chunks, which match the
+        [n] markers in the context.
+        """
+        question = f"\n\nQuestion: {query}"
+        question_tokens = self.counter.count("Context:\n" + question) + MESSAGE_OVERHEAD_TOKENS
+        remaining = self.token_budget - self.max_completion_tokens - self._system_tokens - question_tokens
+        
+        history_budget = remaining // 3
+        summary, summary_tokens = self._fit_summary(conversation_summary, history_budget)
+        history, history_tokens = self._fit_history(conversation_history or [], history_budget - summary_tokens)
+        remaining -= summary_tokens + history_tokens
+        
+        context, included, context_tokens = self._fit_context(chunks, remaining)
+        
+        messages = (
+            [{"role": "system", "content": self.system_prompt}]
+            + summary
+            + history
+            + [{"role": "user", "content": f"Context:\n{context}{question}"}]
+        )
+        
+        usage = {
+            "prompt_tokens": self._system_tokens + summary_tokens + history_tokens + context_tokens + question_tokens,
+            "system_tokens": self._system_tokens,
+            "summary_tokens": summary_tokens,
+            "history_tokens": history_tokens,
+            "context_tokens": context_tokens,
+            "question_tokens": question_tokens,
+            "history_messages": len(history),
+            "chunks_included": len(included),
+            "chunks_dropped": len(chunks) - len(included)
+        }
+        return messages, included, usage
+    
+    def _fit_summary(self, summary: Optional[str], budget: int) -> Tuple[List[Dict], int]:
+        """The rolling summary of earlier turns as a system message, or nothing if it doesn't fit."""
+        if not summary:
+            return [], 0
+        
+        content = f"Summary of the earlier conversation:\n{self.counter.truncate(summary, self.summary_max_tokens)}"
+        tokens = self.counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+        if tokens > budget:
+            return [], 0
+        return [{"role": "system", "content": content}], tokens
+    
+    def _fit_history(self, history: List[Dict], budget: int) -> Tuple[List[Dict], int]:
+        """Keep the most recent turns that fit, each truncated to the per-turn cap."""
+        fitted: List[Dict] = []
+        used = 0
+        
+        for message in reversed(history):
+            content = self.counter.truncate(message["content"], self.history_turn_max_tokens)
+            tokens = self.counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > budget:
+                break
+            fitted.append({"role": message["role"], "content": content})
+            used += tokens
+        
+        fitted.reverse()
+        return fitted, used
+    
+    def _fit_context(self, chunks: List[RetrievalResult], budget: int) -> Tuple[str, List[RetrievalResult], int]:
+        """Add chunks in rank order until the budget is spent, skipping duplicates."""
+        parts: List[str] = []
+        included: List[RetrievalResult] = []
+        seen = set()
+        used = 0
+        
+        for chunk in chunks:
+            key = (chunk.url, chunk.content)
+            if key in seen:
+                continue
+            seen.add(key)
+            
+            separator = "\n---\n" if parts else ""
+            header = f"{separator}[{len(included) + 1}] {chunk.title}\n"
+            footer = f"\nSource: {chunk.url}\n"
+            frame_tokens = self.counter.count(header + footer)
+            
+            content_budget = min(self.chunk_max_tokens, budget - used - frame_tokens)
+            if content_budget < self.min_chunk_tokens:
+                break
+            
+            content = self.counter.truncate(chunk.content, content_budget)
+            part = header + content + footer
+            parts.append(part)
+            included.append(chunk)
+            used += frame_tokens + self.counter.count(content)
+        
+        return "".join(parts), included, used
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+# Remaining-quota headers sent by Graph, SharePoint and Azure OpenAI
+REMAINING_HEADERS = (
+    "ratelimit-remaining",
+    "x-ratelimit-remaining-requests",
+    "x-ratelimit-remaining-tokens",
+    "x-ms-ratelimit-remaining-requests",
+    "x-ms-ratelimit-remaining-tokens"
+)
+RESET_HEADERS = ("ratelimit-reset", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from retry-after-ms / x-ms-retry-after-ms / Retry-After (delta or HTTP date)."""
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        if name in headers:
+            try:
+                return float(headers[name]) / 1000
+            except ValueError:
+                pass
+    
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+def _duration_seconds(value: str) -> Optional[float]:
+    """Parse reset values such as "12", "1s" or "250ms"."""
+    try:
+        if value.endswith("ms"):
+            return float(value[:-2]) / 1000
+        return float(value.rstrip("s"))
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` requests per second with bursts up to `burst`.
+    
+    Callers wait in arrival order for a token instead of failing, so a burst
+    of work is smoothed out to the upstream's sustained rate.
+    """
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self.waiting = 0
+        self.waited_seconds = 0.0
+    
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._fill()
+                    delay = max(self._paused_until - time.monotonic(), 0.0)
+                    if not delay and self._tokens >= 1:
+                        break
+                    delay = delay or (1 - self._tokens) / self.rate
+                    self.waited_seconds += delay
+                    await asyncio.sleep(delay)
+                self._tokens -= 1
+        finally:
+            self.waiting -= 1
+    
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free right now, without queueing ahead of waiting callers."""
+        if self._lock.locked() or self._paused_until > time.monotonic():
+            return False
+        self._fill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+    
+    def pause(self, seconds: float):
+        """Hold every caller for `seconds`, e.g. for an upstream Retry-After."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = min(self._tokens, 0.0)  # No burst straight after the pause
+    
+    def _fill(self):
+        now = time.monotonic()
+        # Tokens do not accrue while paused
+        elapsed = max(now - max(self._updated, self._paused_until), 0.0)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+    
+    def stats(self) -> Dict:
+        return {
+            "rate": round(self.rate, 3),
+            "burst": self.burst,
+            "queue_depth": self.waiting,
+            "paused_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+            "waited_seconds": round(self.waited_seconds, 3)
+        }
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket for one upstream whose rate adapts to throttling (AIMD).
+    
+    Each successful call raises the rate additively (by about `increase`
+    requests/s per second of traffic); a throttling response cuts it by
+    `decrease` (at most once per `cooldown` seconds, so one burst of 429s
+    counts once) and pauses all callers for the upstream's Retry-After.
+    Remaining-quota headers that reach zero pause callers until the quota
+    resets, before the upstream has to throttle.
+    """
+    
+    THROTTLE_STATUS = {429, 503}
+    
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        min_rate: float = 0.5,
+        max_rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0
+    ):
+        super().__init__(rate, burst or max(int(rate), 1))
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._decreased_at = 0.0
+        self.throttled = 0
+        # Read at scrape time; throttles are counted in rag_upstream_throttled
+        metrics.RATE_LIMIT.labels(name).set_function(lambda: self.rate)
+        metrics.RATE_LIMIT_QUEUE_DEPTH.labels(name).set_function(lambda: self.waiting)
+    
+    def observe(self, status_code: int, headers: Mapping[str, str]):
+        """Adjust pacing from an upstream response."""
+        if status_code in self.THROTTLE_STATUS:
+            self.on_throttle(retry_after_seconds(headers))
+            return
+        
+        for name in REMAINING_HEADERS:
+            if headers.get(name) == "0":
+                reset = next((_duration_seconds(headers[h]) for h in RESET_HEADERS if h in headers), None)
+                self.pause(reset if reset is not None else 1.0)
+                return
+        
+        # Graph reports usage above 80% of the app's limit before it starts throttling
+        try:
+            if float(headers.get("x-ms-throttle-limit-percentage", 0)) >= 0.9:
+                self._decrease()
+                return
+        except ValueError:
+            pass
+        
+        if status_code < 400:
+            self.on_success()
+    
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+    
+    def on_throttle(self, retry_after: Optional[float] = None):
+        self.throttled += 1
+        metrics.THROTTLED.labels(self.name).inc()
+        self._decrease()
+        self.pause(retry_after if retry_after is not None else 1.0 / self.rate)
+        logger.warning(f"{self.name} throttled; rate now {self.rate:.2f}/s, paused {retry_after or 0:.1f}s")
+    
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+    
+    def stats(self) -> Dict:
+        return {**super().stats(), "throttled": self.throttled}
+
+class RateLimiterRegistry:
+    """Process-wide AdaptiveRateLimiters, one per upstream name."""
+    
+    def __init__(self):
+        self._limiters: Dict[str, AdaptiveRateLimiter] = {}
+    
+    def get(self, name: str, rate: float, **kwargs) -> AdaptiveRateLimiter:
+        """Return the limiter for `name`, creating it with these settings on first use."""
+        if name not in self._limiters:
+            self._limiters[name] = AdaptiveRateLimiter(name, rate, **kwargs)
+        return self._limiters[name]
+    
+    def stats(self) -> Dict:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+rate_limiters = RateLimiterRegistry()
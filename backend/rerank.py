@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+import numpy as np
+from backend.retrieval import RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class Reranker:
+    """
+    Re-ranks an over-fetched candidate set locally before it reaches the LLM.
+    
+    Candidates are scored with BM25 computed as one batched NumPy expression
+    over a (candidates x query terms) frequency matrix, optionally blended
+    with query/candidate embedding cosine similarity. Scoring runs under a
+    latency budget. If the embedding call misses its deadline (its own
+    timeout, or what is left of the budget) or fails, the BM25 order is used;
+    only if BM25 scoring itself exceeds the budget are the candidates
+    returned in their original (Graph) order.
+    """
+    
+    def __init__(
+        self,
+        embed_fn: Optional[EmbedFn] = None,
+        embedding_weight: float = 0.5,
+        latency_budget: float = 0.15,
+        embedding_timeout: Optional[float] = None,
+        k1: float = 1.2,
+        b: float = 0.75
+    ):
+        self.embed_fn = embed_fn
+        self.embedding_weight = embedding_weight
+        self.latency_budget = latency_budget
+        self.embedding_timeout = embedding_timeout
+        self.k1 = k1
+        self.b = b
+        self.reranked = 0
+        self.fallbacks = 0
+        self.embedding_fallbacks = 0
+    
+    async def rerank(self, query: str, candidates: List[RetrievalResult], top_k: int) -> List[RetrievalResult]:
+        """Return the best `top_k` candidates, with `score` set to the local relevance score."""
+        if len(candidates) <= 1:
+            return candidates[:top_k]
+        
+        start = time.perf_counter()
+        try:
+            scores = self._normalize(self.bm25_scores(query, [self._text(c) for c in candidates]))
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"Re-ranking failed, using Graph order: {str(e)}")
+            return candidates[:top_k]
+        
+        if time.perf_counter() - start > self.latency_budget:
+            self.fallbacks += 1
+            logger.warning(f"Re-ranking exceeded {self.latency_budget * 1000:.0f} ms budget; using Graph order")
+            return candidates[:top_k]
+        
+        if self.embed_fn is not None:
+            scores = await self._blend_embeddings(query, candidates, scores, start)
+        
+        self.reranked += 1
+        # Stable sort keeps Graph order among equal scores
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [candidates[i].model_copy(update={"score": float(scores[i])}) for i in order]
+    
+    async def _blend_embeddings(
+        self,
+        query: str,
+        candidates: List[RetrievalResult],
+        bm25: np.ndarray,
+        start: float
+    ) -> np.ndarray:
+        """BM25 scores blended with embedding similarity, or the BM25 scores alone if the embedding is late or fails."""
+        timeout = self.embedding_timeout
+        if timeout is None:
+            timeout = self.latency_budget - (time.perf_counter() - start)
+        try:
+            similarity = await asyncio.wait_for(self._embedding_scores(query, candidates), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            self.embedding_fallbacks += 1
+            logger.warning(f"Re-ranking embeddings exceeded {max(timeout, 0) * 1000:.0f} ms; using BM25 order")
+            return bm25
+        except Exception as e:
+            self.embedding_fallbacks += 1
+            logger.warning(f"Re-ranking embeddings failed, using BM25 order: {str(e)}")
+            return bm25
+        return (1 - self.embedding_weight) * bm25 + self.embedding_weight * self._normalize(similarity)
+    
+    def bm25_scores(self, query: str, documents: List[str]) -> np.ndarray:
+        """BM25 score of each document for the query, with IDF computed over the candidate set."""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return np.zeros(len(documents), dtype=np.float32)
+        
+        term_index = {term: i for i, term in enumerate(query_terms)}
+        tf = np.zeros((len(documents), len(query_terms)), dtype=np.float32)
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        
+        for row, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                column = term_index.get(token)
+                if column is not None:
+                    tf[row, column] += 1
+        
+        n_docs = len(documents)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        avg_length = max(lengths.mean(), 1.0)
+        norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+        
+        return ((tf * (self.k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+    
+    async def _embedding_scores(self, query: str, candidates: List[RetrievalResult]) -> np.ndarray:
+        vectors = np.asarray(
+            await self.embed_fn([query] + [self._text(c) for c in candidates]),
+            dtype=np.float32
+        )
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[1:] @ vectors[0]
+    
+    @staticmethod
+    def _text(candidate: RetrievalResult) -> str:
+        return f"{candidate.title}\n{candidate.content}"
+    
+    @staticmethod
+    def _normalize(scores: np.ndarray) -> np.ndarray:
+        """Min-max scale to [0, 1] so BM25 and cosine scores can be blended."""
+        spread = scores.max() - scores.min()
+        if spread <= 0:
+            return np.zeros_like(scores)
+        return (scores - scores.min()) / spread
+    
+    def stats(self) -> Dict:
+        return {"reranked": self.reranked, "fallbacks": self.fallbacks, "embedding_fallbacks": self.embedding_fallbacks}
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+import numpy as np
+from backend.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the upstream's circuit is open."""
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream.
+    
+    Closed: calls pass; `failure_threshold` consecutive failures open it.
+    Open: calls are refused for `reset_timeout` seconds.
+    Half-open: up to `half_open_max_calls` probe calls pass; a success
+    closes the circuit, a failure re-opens it.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+    
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+    
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream now. Counts the call as a probe when half-open."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self._state = self.CLOSED
+        self._failures = 0
+    
+    def record_failure(self):
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.opened += 1
+                logger.warning(f"Circuit {self.name} opened after {self._failures} failures")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+    
+    async def call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn` through the breaker; any exception counts as a failure."""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        try:
+            result = await fn()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+    
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+class LatencyTracker:
+    """Ring buffer of recent call latencies for percentile estimates."""
+    
+    def __init__(self, window: int = 512):
+        self._samples = np.zeros(window, dtype=np.float64)
+        self._count = 0
+    
+    def record(self, seconds: float):
+        self._samples[self._count % len(self._samples)] = seconds
+        self._count += 1
+    
+    def percentile(self, q: float) -> Optional[float]:
+        filled = min(self._count, len(self._samples))
+        if not filled:
+            return None
+        return float(np.percentile(self._samples[:filled], q))
+    
+    def __len__(self) -> int:
+        return min(self._count, len(self._samples))
+
+class Hedger:
+    """
+    Hedged requests: if a call hasn't finished after the recent p95 latency,
+    start a duplicate and take whichever finishes first.
+    
+    Duplicates are capped at `budget` of all calls (e.g. 0.05 = at most 5%
+    extra upstream load), and no hedging happens until `min_samples`
+    latencies have been seen. A duplicate also needs a free token from the
+    caller's rate limiter, if one is given; when none is available the call
+    is not hedged, so hedges never exceed the upstream's pacing. A call
+    only wins if it succeeds (no exception, and `accept(result)` when given,
+    e.g. not a 429 response); otherwise the other call is awaited. The
+    slower call is cancelled, and its elapsed time still counts as a
+    latency sample, so the tail stays in the percentile.
+    """
+    
+    def __init__(
+        self,
+        budget: float = 0.05,
+        percentile: float = 95.0,
+        min_delay: float = 0.05,
+        max_delay: float = 5.0,
+        min_samples: int = 20,
+        tracker: Optional[LatencyTracker] = None
+    ):
+        self.budget = budget
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.tracker = tracker or LatencyTracker()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rate_limited = 0
+    
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little history."""
+        if len(self.tracker) < self.min_samples:
+            return None
+        return min(max(self.tracker.percentile(self.percentile), self.min_delay), self.max_delay)
+    
+    async def run(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        rate_limiter: Optional[TokenBucket] = None,
+        accept: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        self.calls += 1
+        primary = asyncio.ensure_future(self._timed(fn))
+        tasks = [primary]
+        try:
+            delay = self.delay()
+            if delay is None or self.hedged >= self.budget * self.calls:
+                return await primary
+            
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if rate_limiter is not None and not rate_limiter.try_acquire():
+                self.rate_limited += 1
+                return await primary
+            
+            self.hedged += 1
+            hedge = asyncio.ensure_future(self._timed(fn))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and (accept is None or accept(task.result())):
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Neither succeeded; surface the primary's outcome
+            return primary.result()
+        finally:
+            # The slower call (or both, if the caller was cancelled) is abandoned
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def _timed(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            # Includes failed and cancelled calls: a cancelled slow call is a tail sample
+            self.tracker.record(time.perf_counter() - start)
+    
+    def stats(self) -> Dict:
+        p95 = self.tracker.percentile(self.percentile)
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "rate_limited": self.rate_limited,
+            f"p{int(self.percentile)}_seconds": round(p95, 3) if p95 is not None else None
+        }
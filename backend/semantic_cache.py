@@ -0,0 +1,126 @@
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+class SemanticCache:
+    """
+    In-memory semantic answer cache.
+    
+    Queries are normalized and embedded; cached entries live as rows of a
+    preallocated float32 matrix of unit vectors, so a lookup is a single
+    matrix-vector product followed by a masked argmax. A hit requires cosine
+    similarity >= threshold within the same scope (site filter, permission
+    context and retrieval depth) and an unexpired entry. When full, the least recently used entry
+    is evicted.
+    """
+    
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        threshold: float = 0.92,
+        ttl: float = 3600.0,
+        max_entries: int = 10000
+    ):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), allocated on first insert
+        self._scopes = np.full(max_entries, -1, dtype=np.int32)  # -1 marks a free slot
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._payloads: List[Optional[Dict]] = [None] * max_entries
+        self._scope_ids: Dict[str, int] = {}
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Case-fold, collapse whitespace and drop trailing punctuation."""
+        query = re.sub(r"\s+", " ", query.strip().lower())
+        return query.rstrip("?!. ")
+    
+    @staticmethod
+    def scope_key(site_filter: Optional[str], permission_context: str, top_k: int) -> str:
+        # An answer grounded on fewer chunks must not be served to a request asking for more
+        return f"{permission_context}|{site_filter or '*'}|{top_k}"
+    
+    async def embed(self, query: str) -> np.ndarray:
+        """Embed the normalized query as a float32 unit vector."""
+        [vector] = await self.embed_fn([self.normalize(query)])
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, embedding: np.ndarray, scope: str) -> Optional[Dict]:
+        """Return the cached payload for the most similar in-scope entry, if similar enough."""
+        scope_id = self._scope_ids.get(scope)
+        if self._vectors is None or scope_id is None:
+            self.misses += 1
+            return None
+        
+        now = time.time()
+        candidates = (self._scopes == scope_id) & (self._expires_at > now)
+        if not candidates.any():
+            self.misses += 1
+            return None
+        
+        similarities = self._vectors @ embedding
+        similarities[~candidates] = -np.inf
+        best = int(np.argmax(similarities))
+        
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self._last_used[best] = now
+        return self._payloads[best]
+    
+    def store(self, embedding: np.ndarray, scope: str, payload: Dict):
+        """Cache a payload under the given query embedding and scope."""
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+        
+        scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+        slot = self._free_slot()
+        now = time.time()
+        
+        self._vectors[slot] = embedding
+        self._scopes[slot] = scope_id
+        self._expires_at[slot] = now + self.ttl
+        self._last_used[slot] = now
+        self._payloads[slot] = payload
+    
+    def _free_slot(self) -> int:
+        """Find an empty or expired slot, evicting the least recently used entry if needed."""
+        now = time.time()
+        expired = (self._scopes >= 0) & (self._expires_at <= now)
+        self._scopes[expired] = -1
+        
+        free = np.flatnonzero(self._scopes < 0)
+        if free.size:
+            return int(free[0])
+        
+        slot = int(np.argmin(self._last_used))
+        self.evictions += 1
+        return slot
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(np.count_nonzero(self._scopes >= 0)),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
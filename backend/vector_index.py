@@ -0,0 +1,515 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from pydantic import BaseModel
+from backend.retrieval import RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+PUBLIC_PRINCIPAL = "everyone"
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.bin"
+CENTROIDS_FILE = "centroids.npy"
+OFFSETS_FILE = "list_offsets.npy"
+METADATA_FILE = "metadata.db"
+
+class IndexedChunk(BaseModel):
+    chunk_id: str
+    content: str
+    title: str
+    url: str
+    site: Optional[str] = None
+    acl: List[str] = [PUBLIC_PRINCIPAL]  # Principals allowed to see this chunk
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards (with backslash as the ESCAPE character) so `value` matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _train_centroids(vectors: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over (a sample of) the unit vectors."""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > n_lists * 256:
+        sample = vectors[rng.choice(len(vectors), n_lists * 256, replace=False)]
+    
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = sample[assignment == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = _unit_rows(centroids)
+    return centroids
+
+class VectorIndex:
+    """
+    Read-only IVF index of pre-embedded SharePoint chunks.
+    
+    On disk an index is a directory holding:
+      - vectors.bin: unit vectors (float16 or float32), grouped by inverted list
+      - centroids.npy / list_offsets.npy: the coarse quantizer and each list's row range
+      - metadata.db: SQLite side table with chunk text, title, URL, site and ACL principals
+    
+    Vectors are opened with np.memmap in read-only mode, so every worker
+    process maps the same file and shares its pages through the OS page cache
+    instead of holding a private copy. A search only touches the rows of the
+    `nprobe` lists whose centroids are closest to the query.
+    
+    Searches take a snapshot of the open index under a short lock and run
+    without it, so concurrent searches proceed in parallel and a reload only
+    waits for the reference swap. A search that started before a reload
+    finishes against the index it started with.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = 0
+        self.count = 0
+        self._manifest_mtime = 0.0
+        self._vectors: Optional[np.memmap] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self) -> bool:
+        return self._vectors is not None
+    
+    def open(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            logger.warning(f"No vector index at {self.path}; local retrieval will return no results")
+            return
+        
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest_mtime = os.path.getmtime(manifest_path)
+        
+        dim = manifest["dim"]
+        count = manifest["count"]
+        centroids = np.load(os.path.join(self.path, CENTROIDS_FILE))
+        offsets = np.load(os.path.join(self.path, OFFSETS_FILE))
+        if count:
+            vectors = np.memmap(
+                os.path.join(self.path, VECTORS_FILE),
+                dtype=manifest["dtype"],
+                mode="r",
+                shape=(count, dim)
+            )
+        else:
+            # An empty file cannot be mapped
+            vectors = np.zeros((0, dim), dtype=manifest["dtype"])
+        
+        uri = f"file:{os.path.abspath(os.path.join(self.path, METADATA_FILE))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        
+        # Swap in the new index; searches holding the previous snapshot keep
+        # its mapping and connection, which are released once they finish
+        with self._lock:
+            self.dim = dim
+            self.count = count
+            self._manifest_mtime = manifest_mtime
+            self._vectors = vectors
+            self._centroids = centroids
+            self._offsets = offsets
+            self._conn = conn
+        logger.info(f"Opened vector index at {self.path}: {count} chunks, {len(centroids)} lists")
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._vectors = None
+            self._centroids = None
+            self._offsets = None
+    
+    def reload(self):
+        """Re-open the index after it has been rebuilt on disk; searches keep running on the old one meanwhile."""
+        self.open()
+    
+    def reload_if_changed(self) -> bool:
+        """Reload if a different index has been built at `path` since it was opened."""
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, MANIFEST_FILE))
+        except OSError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        
+        self.reload()
+        return True
+    
+    def search(
+        self,
+        query_vector: np.ndarray,
+        top: int,
+        principals: Sequence[str],
+        site_filter: Optional[str] = None,
+        nprobe: int = 8
+    ) -> List[Tuple[Dict, float]]:
+        """
+        Return up to `top` (metadata, similarity) pairs visible to `principals`.
+        
+        Blocking; callers on the event loop should run it in a worker thread.
+        """
+        with self._lock:
+            vectors, centroids, offsets, conn = self._vectors, self._centroids, self._offsets, self._conn
+        if vectors is None or len(vectors) == 0:
+            return []
+        
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        
+        lists = np.argsort(centroids @ query)[::-1][:nprobe]
+        rows = np.concatenate([
+            np.arange(offsets[i], offsets[i + 1]) for i in lists
+        ])
+        if len(rows) == 0:
+            return []
+        
+        # Contiguous list slices are read straight from the mapped file
+        scores = np.concatenate([
+            np.asarray(vectors[offsets[i]:offsets[i + 1]], dtype=np.float32) @ query
+            for i in lists
+        ])
+        ranked = np.argsort(scores)[::-1]
+        
+        # Filter in score order, fetching metadata in batches until enough hits are visible
+        hits = []
+        batch_size = max(top * 4, 32)
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start:start + batch_size]
+            visible = self._visible_metadata(conn, [int(rows[i]) for i in batch], principals, site_filter)
+            for i in batch:
+                metadata = visible.get(int(rows[i]))
+                if metadata is not None:
+                    hits.append((metadata, float(scores[i])))
+                    if len(hits) >= top:
+                        return hits
+        return hits
+    
+    @staticmethod
+    def _visible_metadata(
+        conn: sqlite3.Connection,
+        rows: List[int],
+        principals: Sequence[str],
+        site_filter: Optional[str]
+    ) -> Dict[int, Dict]:
+        row_marks = ",".join("?" * len(rows))
+        principal_marks = ",".join("?" * len(principals))
+        sql = f"""
+            SELECT c.row, c.chunk_id, c.title, c.url, c.site, c.content FROM chunks c
+            WHERE c.row IN ({row_marks})
+            AND EXISTS (SELECT 1 FROM chunk_acl a WHERE a.row = c.row AND a.principal IN ({principal_marks}))
+        """
+        params: List = [*rows, *principals]
+        if site_filter:
+            # Graph filters accept a site URL; indexed chunks carry the site id and document URL
+            sql += " AND (c.site = ? OR c.url LIKE ? ESCAPE '\\')"
+            params.extend([site_filter, f"{_escape_like(site_filter.rstrip('/'))}/%"])
+        
+        return {
+            row: {"chunk_id": chunk_id, "title": title, "url": url, "site": site, "content": content}
+            for row, chunk_id, title, url, site, content in conn.execute(sql, params)
+        }
+    
+    @staticmethod
+    def read_manifest(path: str) -> Optional[Dict]:
+        """The manifest of the index at `path`, or None if there is none."""
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    @staticmethod
+    def build(
+        path: str,
+        chunks: List[IndexedChunk],
+        vectors: np.ndarray,
+        n_lists: Optional[int] = None,
+        dtype: str = "float16"
+    ):
+        """
+        Write a new index for `chunks` and their embeddings to `path`.
+        
+        The index is assembled in a sibling directory and swapped in, so
+        processes reading the previous index keep their mapping until they
+        reload.
+        """
+        if len(chunks) != len(vectors):
+            raise ValueError("chunks and vectors must have the same length")
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = _unit_rows(vectors.reshape(len(chunks), -1) if chunks else np.zeros((0, 0), dtype=np.float32))
+        count, dim = vectors.shape
+        n_lists = n_lists or max(1, int(np.sqrt(count)))
+        n_lists = min(n_lists, max(count, 1))
+        
+        if count:
+            centroids = _train_centroids(vectors, n_lists)
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+        else:
+            centroids = np.zeros((1, dim), dtype=np.float32)
+            assignment = np.zeros(0, dtype=np.int64)
+        
+        def insert_metadata(conn: sqlite3.Connection, order: np.ndarray):
+            for row, source in enumerate(order):
+                _insert_chunk(conn, row, chunks[int(source)])
+        
+        _write_index(path, centroids, vectors.astype(dtype), assignment, insert_metadata, {"trained_count": count, "changed": 0})
+        logger.info(f"Built vector index at {path}: {count} chunks, {len(centroids)} lists")
+    
+    @staticmethod
+    def update(path: str, chunks: List[IndexedChunk], vectors: np.ndarray, removed: Sequence[str]) -> Dict:
+        """
+        Apply changed and removed chunks to the index at `path` without re-training it.
+        
+        Rows whose chunk id is in `removed` or among `chunks` are dropped, and
+        `chunks` are added to the inverted list of their nearest existing
+        centroid. This saves the k-means training and re-embedding of a full
+        build(), not I/O: the vectors file and metadata are still rewritten
+        in full (kept rows are copied), so each update costs O(index size)
+        in disk writes. The manifest counts the rows changed since the
+        centroids were trained, so callers can tell when a full build() is
+        due. The result is swapped in like build(). Returns the new manifest.
+        """
+        if len(chunks) != len(vectors):
+            raise ValueError("chunks and vectors must have the same length")
+        
+        manifest = VectorIndex.read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No vector index at {path}")
+        
+        centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+        offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        count, dim, dtype = manifest["count"], manifest["dim"], manifest["dtype"]
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = _unit_rows(vectors.reshape(len(chunks), -1) if chunks else np.zeros((0, dim), dtype=np.float32))
+        if vectors.shape[1] != dim:
+            raise ValueError(f"Index at {path} has dimension {dim}, got {vectors.shape[1]}")
+        
+        dropped = set(removed) | {chunk.chunk_id for chunk in chunks}
+        conn = sqlite3.connect(f"file:{os.path.abspath(os.path.join(path, METADATA_FILE))}?mode=ro", uri=True)
+        try:
+            chunk_ids = [chunk_id for _, chunk_id in conn.execute("SELECT row, chunk_id FROM chunks ORDER BY row")]
+        finally:
+            conn.close()
+        kept = np.array([i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in dropped], dtype=np.int64)
+        
+        if count:
+            previous = np.memmap(os.path.join(path, VECTORS_FILE), dtype=dtype, mode="r", shape=(count, dim))
+        else:
+            previous = np.zeros((0, dim), dtype=dtype)
+        old_lists = np.repeat(np.arange(len(centroids)), np.diff(offsets))
+        assignment = np.concatenate([old_lists[kept], np.argmax(vectors @ centroids.T, axis=1)]).astype(np.int64)
+        combined = np.concatenate([np.asarray(previous[kept]), vectors.astype(dtype)])
+        
+        def insert_metadata(conn: sqlite3.Connection, order: np.ndarray):
+            # Kept rows are copied from the previous metadata under their new row numbers
+            conn.execute("ATTACH DATABASE ? AS previous", (os.path.join(path, METADATA_FILE),))
+            conn.execute("CREATE TEMP TABLE moved (old_row INTEGER PRIMARY KEY, new_row INTEGER NOT NULL)")
+            conn.executemany(
+                "INSERT INTO moved VALUES (?, ?)",
+                [(int(kept[source]), row) for row, source in enumerate(order) if source < len(kept)]
+            )
+            conn.execute("""
+                INSERT INTO chunks SELECT m.new_row, c.chunk_id, c.title, c.url, c.site, c.content
+                FROM previous.chunks c JOIN moved m ON m.old_row = c.row
+            """)
+            conn.execute("""
+                INSERT INTO chunk_acl SELECT m.new_row, a.principal
+                FROM previous.chunk_acl a JOIN moved m ON m.old_row = a.row
+            """)
+            for row, source in enumerate(order):
+                if source >= len(kept):
+                    _insert_chunk(conn, row, chunks[int(source) - len(kept)])
+            conn.commit()
+            conn.execute("DETACH DATABASE previous")
+        
+        changed = manifest.get("changed", 0) + (count - len(kept)) + len(chunks)
+        manifest = _write_index(
+            path,
+            centroids,
+            combined,
+            assignment,
+            insert_metadata,
+            {"trained_count": manifest.get("trained_count", count), "changed": changed}
+        )
+        logger.info(f"Updated vector index at {path}: {count - len(kept)} rows dropped, {len(chunks)} added, {manifest['count']} chunks")
+        return manifest
+
+def _insert_chunk(conn: sqlite3.Connection, row: int, chunk: IndexedChunk):
+    conn.execute(
+        "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+        (row, chunk.chunk_id, chunk.title, chunk.url, chunk.site, chunk.content)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO chunk_acl VALUES (?, ?)",
+        [(row, principal) for principal in chunk.acl]
+    )
+
+def _write_index(
+    path: str,
+    centroids: np.ndarray,
+    vectors: np.ndarray,
+    assignment: np.ndarray,
+    insert_metadata: Callable[[sqlite3.Connection, np.ndarray], None],
+    manifest: Dict
+) -> Dict:
+    """
+    Write `vectors` grouped by their inverted list, with metadata rows
+    filled in by `insert_metadata(conn, order)`, and swap the result in at `path`.
+    """
+    count, dim = vectors.shape
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=len(centroids)))
+    
+    staging = f"{path}.new"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    
+    vectors[order].tofile(os.path.join(staging, VECTORS_FILE))
+    np.save(os.path.join(staging, CENTROIDS_FILE), centroids.astype(np.float32))
+    np.save(os.path.join(staging, OFFSETS_FILE), offsets)
+    
+    conn = sqlite3.connect(os.path.join(staging, METADATA_FILE))
+    try:
+        conn.execute("""
+            CREATE TABLE chunks (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL,
+                title TEXT,
+                url TEXT,
+                site TEXT,
+                content TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE chunk_acl (
+                row INTEGER NOT NULL,
+                principal TEXT NOT NULL,
+                PRIMARY KEY (row, principal)
+            ) WITHOUT ROWID
+        """)
+        insert_metadata(conn, order)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    manifest = {"dim": dim, "count": count, "dtype": vectors.dtype.name, "n_lists": len(centroids), **manifest}
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    
+    previous = f"{path}.old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+class LocalRetrievalClient:
+    """
+    Retrieval backend that searches the local vector index instead of Graph.
+    
+    Drop-in alternative to M365RetrievalClient: same search_content
+    signature, same RetrievalResult objects. The access token is not used.
+    Hits are filtered to chunks whose ACL contains one of the caller's
+    principals (or the public principal); tokens are app-only, so the default
+    caller is the application's permission context.
+    """
+    
+    def __init__(
+        self,
+        index: VectorIndex,
+        embed_fn: EmbedFn,
+        principals: Optional[List[str]] = None,
+        nprobe: int = 8,
+        reload_interval: float = 30.0
+    ):
+        self.index = index
+        self.embed_fn = embed_fn
+        self.principals = principals or []
+        self.nprobe = nprobe
+        self.reload_interval = reload_interval
+        self.searches = 0
+        self._checked_at = time.monotonic()
+    
+    async def search_content(
+        self,
+        query: str,
+        access_token: str,
+        top: int = 5,
+        site_filter: Optional[str] = None,
+        principals: Optional[List[str]] = None
+    ) -> List[RetrievalResult]:
+        """
+        Search the local index.
+        
+        Args:
+            query: User's search query
+            access_token: Unused; accepted for interface compatibility
+            top: Maximum number of results
+            site_filter: Optional SharePoint site id or URL filter
+            principals: Caller principals for ACL filtering (defaults to the client's)
+        """
+        # Pick up indexes rebuilt by the ingestion job
+        if time.monotonic() - self._checked_at > self.reload_interval:
+            self._checked_at = time.monotonic()
+            await asyncio.to_thread(self.index.reload_if_changed)
+        
+        if not self.index.is_open:
+            return []
+        
+        try:
+            [vector] = await self.embed_fn([query])
+            allowed = [PUBLIC_PRINCIPAL, *(principals if principals is not None else self.principals)]
+            hits = await asyncio.to_thread(
+                self.index.search,
+                np.asarray(vector, dtype=np.float32),
+                top,
+                allowed,
+                site_filter,
+                self.nprobe
+            )
+        except Exception as e:
+            logger.error(f"Local index search failed: {str(e)}")
+            return []
+        
+        self.searches += 1
+        return [
+            RetrievalResult(
+                content=metadata["content"][:1000],  # Limit chunk size
+                title=metadata["title"] or "Untitled",
+                url=metadata["url"] or "",
+                site=metadata["site"],
+                score=score
+            )
+            for metadata, score in hits
+        ]
+    
+    def stats(self) -> Dict:
+        return {"backend": "local", "chunks": self.index.count, "searches": self.searches}
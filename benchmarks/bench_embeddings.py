@@ -0,0 +1,91 @@
+"""
+Embedding throughput benchmark against the local fake embeddings endpoint.
+
+Usage:
+    python -m benchmarks.bench_embeddings --texts 5000 --rps 20
+
+Compares one request per text (the previous behaviour) with the batched
+EmbeddingService on a cold cache, then re-embeds the same corpus on the warm
+cache, which should make no API calls at all.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import httpx
+from openai import AsyncAzureOpenAI
+from backend.embeddings import EmbeddingCache, EmbeddingService
+from benchmarks.fake_openai import FakeOpenAI, create_app
+
+DEPLOYMENT = "text-embedding-3-small"
+
+def make_client(fake: FakeOpenAI) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        azure_endpoint="http://fake-openai",
+        api_key="fake-key",
+        api_version="2024-02-15-preview",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(fake)))
+    )
+
+def corpus(count: int, duplicate_ratio: float = 0.1) -> list:
+    unique = int(count * (1 - duplicate_ratio))
+    texts = [f"Chunk {i}: employees should review the travel and expense policy section {i % 97}." for i in range(unique)]
+    return texts + texts[:count - unique]
+
+async def naive(fake: FakeOpenAI, texts: list) -> dict:
+    """One embeddings request per text, one at a time."""
+    client = make_client(fake)
+    start = time.perf_counter()
+    for text in texts:
+        await client.embeddings.create(model=DEPLOYMENT, input=[text])
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return {"texts": len(texts), "seconds": round(elapsed, 3), "texts_per_second": round(len(texts) / elapsed, 1)}
+
+async def batched(fake: FakeOpenAI, service: EmbeddingService, texts: list) -> dict:
+    requests_before, throttled_before = fake.requests, fake.throttled
+    start = time.perf_counter()
+    vectors = await service.embed(texts)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts)
+    return {
+        "texts": len(texts),
+        "seconds": round(elapsed, 3),
+        "texts_per_second": round(len(texts) / elapsed, 1),
+        "api_requests": fake.requests - requests_before,
+        "throttled_429": fake.throttled - throttled_before
+    }
+
+async def main(count: int, rps: float, batch_size: int, concurrency: int):
+    texts = corpus(count)
+    fake = FakeOpenAI(requests_per_second=rps)
+    results = {"naive_sample": await naive(fake, texts[:min(100, count)])}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        client = make_client(fake)
+        service = EmbeddingService(
+            client,
+            DEPLOYMENT,
+            cache=EmbeddingCache(os.path.join(directory, "embeddings.db")),
+            batch_size=batch_size,
+            max_concurrency=concurrency
+        )
+        await service.start()
+        results["batched_cold"] = await batched(fake, service, texts)
+        results["batched_warm"] = await batched(fake, service, texts)
+        results["service"] = service.stats()
+        await service.close()
+        await client.close()
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding throughput benchmark")
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--rps", type=float, default=20.0, help="Fake endpoint requests per second before 429s")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.texts, args.rps, args.batch_size, args.concurrency))
@@ -0,0 +1,104 @@
+"""
+Delta-sync ingestion benchmark against the local Graph stand-in.
+
+Usage:
+    python -m benchmarks.bench_ingestion --files 2000 --changed 20
+
+Runs a full sync, changes a few files (edit, rename, delete, add), and
+runs again. The second run should list and download only the changed
+items and apply only their chunks to the index, so its cost tracks the
+change volume rather than the corpus size. With --expire, the delta links
+are invalidated before the incremental run, which then has to resync.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import List
+import httpx
+import numpy as np
+from backend.ingestion import ChunkStore, DeltaSync, embed_pending, update_index
+from backend.ratelimit import AdaptiveRateLimiter
+from benchmarks.fake_graph import FakeGraph, create_app, populate
+
+async def fake_embed(texts: List[str]) -> List[List[float]]:
+    return [
+        np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(np.float32).tolist()
+        for text in texts
+    ]
+
+async def fake_token() -> str:
+    return "fake-token"
+
+async def sync_once(graph: FakeGraph, store: ChunkStore, index_path: str, workers: int) -> dict:
+    requests_before, downloads_before = graph.requests, graph.downloads
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(graph)), base_url="http://fake-graph")
+
+    start = time.perf_counter()
+    async with client:
+        sync = DeltaSync(
+            store,
+            fake_token,
+            list(graph.sites),
+            workers=workers,
+            rate_limiter=AdaptiveRateLimiter("fake-graph", rate=10000),
+            client=client
+        )
+        counts = await sync.run()
+    synced = time.perf_counter()
+    embedded = await embed_pending(store, fake_embed)
+    index = await update_index(store, index_path)
+    finished = time.perf_counter()
+
+    return {
+        **counts,
+        "graph_requests": graph.requests - requests_before,
+        "graph_downloads": graph.downloads - downloads_before,
+        "embedded_chunks": embedded,
+        "index": index,
+        "sync_seconds": round(synced - start, 3),
+        "total_seconds": round(finished - start, 3)
+    }
+
+async def main(files: int, changed: int, workers: int, expire: bool):
+    graph = FakeGraph()
+    item_ids = populate(graph, files)
+    drive_id = graph.sites["contoso-site"][0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ChunkStore(os.path.join(directory, "ingestion.db"))
+        store.open()
+        index_path = os.path.join(directory, "index")
+
+        results = {"full_sync": await sync_once(graph, store, index_path, workers)}
+        results["no_change_sync"] = await sync_once(graph, store, index_path, workers)
+
+        quarter = max(changed // 4, 1)
+        for item_id in item_ids[:quarter]:
+            graph.put_file(drive_id, "edited.txt", "Edited policy text. " * 50, item_id=item_id)
+        for item_id in item_ids[quarter:2 * quarter]:
+            graph.rename_file(drive_id, item_id, "renamed.txt")
+        for item_id in item_ids[2 * quarter:3 * quarter]:
+            graph.delete_file(drive_id, item_id)
+        for i in range(quarter):
+            graph.put_file(drive_id, f"new-{i}.txt", "New policy text. " * 50)
+        if expire:
+            graph.expire_tokens()
+
+        results["incremental_sync"] = await sync_once(graph, store, index_path, workers)
+        results["store"] = store.stats()
+        store.close()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delta-sync ingestion benchmark")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--expire", action="store_true", help="Expire delta links before the incremental run")
+    args = parser.parse_args()
+    asyncio.run(main(args.files, args.changed, args.workers, args.expire))
@@ -0,0 +1,316 @@
+"""
+Load test for /api/query and /api/query/stream against local fake upstreams.
+
+Usage:
+    python -m benchmarks.bench_query --rps 20 --duration 30
+    python -m benchmarks.bench_query --mode stream --chat "median=0.4,p99=2,throttle=0.02"
+    python -m benchmarks.bench_query --compare bench_query-abc1234.json
+
+Fake Graph search, Azure OpenAI (embeddings and chat) and the API itself
+are served by uvicorn in this process on loopback ports, so streamed
+responses really stream; Cosmos DB is replaced by an in-memory container
+and the Entra ID token by a static one. Each fake takes a latency/failure
+profile (see benchmarks.faults).
+
+Requests are sent open-loop at the target rate, so a slow server builds
+up a queue rather than lowering the offered load. The report has
+throughput, status counts, client-side latency (and time to first delta
+when streaming) and p50/p95/p99 of every server stage, and is written as
+JSON tagged with the git commit so runs can be compared with --compare.
+Everything shares one CPU core; compare runs from the same machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+import httpx
+import numpy as np
+import uvicorn
+from benchmarks.faults import FaultProfile
+from benchmarks.fake_cosmos import FakeCosmosClient
+from benchmarks.fake_graph import FakeGraph, create_app as create_graph_app
+from benchmarks.fake_openai import FakeOpenAI, create_app as create_openai_app
+
+QUESTIONS = [
+    "What is the travel expense policy?",
+    "How many days of annual leave do employees get?",
+    "Who approves purchase orders over 10000?",
+    "What is the process for onboarding a new contractor?",
+    "How do I report a security incident?",
+    "What are the remote work guidelines?",
+    "How is overtime compensated?",
+    "What is the policy on using personal devices?",
+    "How do I request a new laptop?",
+    "What training is mandatory for managers?",
+    "How are performance reviews scheduled?",
+    "What is the data retention policy for customer records?"
+]
+
+class StaticIdentity:
+    """Stands in for M365AuthClient: always returns the same app-only token."""
+    
+    def acquire_token(self) -> Dict:
+        return {"access_token": "fake-graph-token", "expires_in": 3600}
+
+async def serve(app, port: int = 0) -> uvicorn.Server:
+    """Start `app` on a loopback port in this event loop; the port is in server.port."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server.task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server.task.done():
+            server.task.result()
+        await asyncio.sleep(0.01)
+    server.port = server.servers[0].sockets[0].getsockname()[1]
+    return server
+
+async def stop(server: uvicorn.Server):
+    server.should_exit = True
+    await server.task
+
+def percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "p50_ms": round(p50 * 1000, 2),
+        "p95_ms": round(p95 * 1000, 2),
+        "p99_ms": round(p99 * 1000, 2)
+    }
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, mode: str, repeat_ratio: float, followup_ratio: float, seed: int = 0):
+        self.client = client
+        self.mode = mode
+        self.repeat_ratio = repeat_ratio
+        self.followup_ratio = followup_ratio
+        self._random = random.Random(seed)
+        self.asked: List[str] = []
+        self.conversations: List[tuple] = []
+        self.recording = False
+        self.latencies: List[float] = []
+        self.ttft: List[float] = []
+        self.statuses: Dict[str, int] = defaultdict(int)
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    def on_stage(self, stage: str, seconds: float):
+        if self.recording:
+            self.stages[stage].append(seconds)
+    
+    def next_request(self, i: int) -> Dict:
+        if self.conversations and self._random.random() < self.followup_ratio:
+            user_id, conversation_id = self._random.choice(self.conversations)
+            return {"query": self._random.choice(QUESTIONS), "user_id": user_id, "conversation_id": conversation_id}
+        if self.asked and self._random.random() < self.repeat_ratio:
+            query = self._random.choice(self.asked)
+        else:
+            # Vary the wording so most first turns miss the semantic cache
+            query = f"{self._random.choice(QUESTIONS)} (ref {i})"
+            self.asked.append(query)
+        return {"query": query, "user_id": f"user-{i % 50}"}
+    
+    async def send(self, body: Dict):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        first_delta: Optional[float] = None
+        try:
+            if self.mode == "stream":
+                status, result = await self._stream(body, start)
+                first_delta = result.pop("ttft", None)
+            else:
+                response = await self.client.post("/api/query", json=body)
+                status, result = str(response.status_code), response.json() if response.status_code == 200 else {}
+        except httpx.HTTPError as e:
+            status, result = type(e).__name__, {}
+        finally:
+            self.in_flight -= 1
+        elapsed = time.perf_counter() - start
+        
+        if result.get("conversation_id") not in (None, "none") and not body.get("conversation_id"):
+            self.conversations.append((body["user_id"], result["conversation_id"]))
+        if self.recording:
+            self.statuses[status] += 1
+            if status == "200":
+                self.latencies.append(elapsed)
+                if first_delta is not None:
+                    self.ttft.append(first_delta)
+    
+    async def _stream(self, body: Dict, start: float) -> tuple:
+        """POST to the SSE endpoint; an 'error' event counts as its status code."""
+        result: Dict = {}
+        event = None
+        async with self.client.stream("POST", "/api/query/stream", json=body) as response:
+            if response.status_code != 200:
+                return str(response.status_code), result
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    if event == "delta" and "ttft" not in result:
+                        result["ttft"] = time.perf_counter() - start
+                    elif event == "done":
+                        result.update(json.loads(line[6:]))
+                    elif event == "error":
+                        return str(json.loads(line[6:])["status_code"]), result
+        return "200", result
+    
+    async def run(self, rps: float, duration: float, start_index: int = 0) -> int:
+        """Send requests at `rps` for `duration` seconds (open loop) and wait for them all."""
+        count = int(rps * duration)
+        tasks = []
+        begin = time.perf_counter()
+        for i in range(count):
+            delay = begin + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.send(self.next_request(start_index + i))))
+        await asyncio.gather(*tasks)
+        return count
+
+def compare(current: Dict, baseline: Dict) -> Dict:
+    """Change in throughput and per-stage latency percentiles against a previous report."""
+    def delta(new: Dict, old: Dict) -> Dict:
+        return {
+            key: f"{old[key]} -> {new[key]} ({(new[key] - old[key]) / old[key] * 100:+.1f}%)" if old.get(key) else f"{old.get(key)} -> {new[key]}"
+            for key in ("p50_ms", "p95_ms", "p99_ms") if key in new and key in old
+        }
+    
+    return {
+        "baseline_commit": baseline.get("commit"),
+        "throughput_rps": f"{baseline['throughput_rps']} -> {current['throughput_rps']}",
+        "latency": delta(current["latency"], baseline["latency"]),
+        "stages": {
+            stage: delta(current["stages"][stage], baseline["stages"][stage])
+            for stage in current["stages"] if stage in baseline.get("stages", {})
+        }
+    }
+
+async def main(args: argparse.Namespace) -> Dict:
+    graph = FakeGraph(search_profile=FaultProfile.parse(args.graph, seed=1))
+    openai_fake = FakeOpenAI(
+        request_latency=FaultProfile.parse(args.embeddings).median,
+        chat_profile=FaultProfile.parse(args.chat, seed=2),
+        token_latency=args.token_latency
+    )
+    graph_server = await serve(create_graph_app(graph))
+    openai_server = await serve(create_openai_app(openai_fake))
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # Settings are read when the app is imported
+        os.environ.update({
+            "DEMO_MODE": "false",  # Exercise the real clients against the fakes
+            "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{openai_server.port}",
+            "AZURE_OPENAI_API_KEY": "fake-key",
+            "EMBEDDING_CACHE_PATH": os.path.join(directory, "embeddings.db"),
+            "PERSISTENCE_JOURNAL_PATH": os.path.join(directory, "journal.db"),
+            "PERSISTENCE_WRITE_BEHIND": str(args.write_behind)
+        })
+        import main as api
+        from backend import metrics
+        
+        api.token_provider.auth = StaticIdentity()
+        cosmos = FakeCosmosClient(FaultProfile.parse(args.cosmos, seed=3))
+        api.cosmos_client.client = cosmos
+        api.cosmos_client.container = cosmos.container
+        if isinstance(api.retrieval_client, api.M365RetrievalClient):
+            api.retrieval_client.BASE_URL = f"http://127.0.0.1:{graph_server.port}/v1.0"
+        
+        api_server = await serve(api.app)
+        client = httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{api_server.port}",
+            timeout=120.0,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=200)
+        )
+        generator = LoadGenerator(client, args.mode, args.repeat_ratio, args.followup_ratio)
+        metrics.add_stage_listener(generator.on_stage)
+        
+        if args.warmup:
+            await generator.run(args.rps, args.warmup)
+        generator.recording = True
+        start = time.perf_counter()
+        sent = await generator.run(args.rps, args.duration, start_index=10 ** 6)
+        elapsed = time.perf_counter() - start
+        health = (await client.get("/health")).json()
+        
+        await client.aclose()
+        await stop(api_server)
+    await stop(openai_server)
+    await stop(graph_server)
+    
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            **{key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "profiles": {
+                "graph": graph.search_profile.describe(),
+                "chat": openai_fake.chat_profile.describe(),
+                "cosmos": cosmos.container.profile.describe()
+            }
+        },
+        "requests": sent,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(generator.statuses.get("200", 0) / elapsed, 2),
+        "statuses": dict(generator.statuses),
+        "max_in_flight": generator.max_in_flight,
+        "latency": percentiles(generator.latencies),
+        "time_to_first_delta": percentiles(generator.ttft),
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(generator.stages.items())},
+        "upstreams": {
+            "graph": {"searches": graph.searches, "failures": graph.search_failures},
+            "openai": {
+                "completions": openai_fake.completions,
+                "chat_failures": openai_fake.chat_failures,
+                "embedding_requests": openai_fake.requests
+            },
+            "cosmos": cosmos.container.stats()
+        },
+        "app": {key: health.get(key) for key in ("retrieval_cache", "semantic_cache", "embeddings", "rate_limits", "persistence")}
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query API load test against local fake upstreams")
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds at the same rate first")
+    parser.add_argument("--mode", choices=["blocking", "stream"], default="blocking")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="Share of first turns that repeat an earlier question")
+    parser.add_argument("--followup-ratio", type=float, default=0.3, help="Share of requests that continue a conversation")
+    parser.add_argument("--write-behind", type=lambda v: v.lower() in ("1", "true", "yes"), default=True)
+    parser.add_argument("--graph", default="median=0.15,p99=1.0,errors=0.005,throttle=0.01", help="Graph search profile")
+    parser.add_argument("--chat", default="median=0.4,p99=2.0,throttle=0.01", help="Chat time-to-first-token profile")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per streamed completion token")
+    parser.add_argument("--embeddings", default="median=0.03", help="Embeddings latency profile (median is used)")
+    parser.add_argument("--cosmos", default="median=0.008,p99=0.05,throttle=0.005,retry_after=0.1", help="Cosmos DB profile")
+    parser.add_argument("--output", help="Report path (default: bench_query-<commit>.json)")
+    parser.add_argument("--compare", help="Previous report to compare against")
+    args = parser.parse_args()
+    
+    report = asyncio.run(main(args))
+    output = args.output or f"bench_query-{report['commit']}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            report = {"report": output, "comparison": compare(report, json.load(f))}
+    json.dump(report, sys.stdout, indent=2)
+    print()
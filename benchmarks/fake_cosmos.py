@@ -0,0 +1,275 @@
+"""
+In-memory stand-in for the async Cosmos DB container used by backend.cosmos.
+
+Cosmos's wire protocol (signed requests, partition key range routing) is
+not worth reimplementing for a load test, so the fake replaces the SDK's
+CosmosClient instead. Assign it before startup, and CosmosDBClient.start()
+will use it:
+    
+    cosmos_client.client = FakeCosmosClient(FaultProfile(median=0.008))
+    cosmos_client.container = cosmos_client.client.container
+
+Supported: create/read/replace/upsert/patch item (with `c.field != 'value'`
+filter predicates), transactional batches (failing with
+CosmosBatchOperationError, like the SDK) and the query shapes the app
+issues (comparison and IS_DEFINED filters, ORDER BY, TOP, OFFSET/LIMIT and
+field projection), including paging with max_item_count and
+by_page(continuation_token). Throttled operations
+are delayed by the profile's retry_after and retried, as the SDK's own
+retry policy does; injected 503s are raised as CosmosHttpResponseError.
+"""
+import asyncio
+import copy
+import operator
+import re
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from benchmarks.faults import FaultProfile
+
+COMPARISONS = {"=": operator.eq, ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+async def _iterate(items: List[Dict]) -> AsyncIterator[Dict]:
+    for item in items:
+        yield item
+
+class FakePageIterator:
+    """Pages of a query; the continuation token is the offset of the next page."""
+    
+    def __init__(self, fetch: Callable[[], Awaitable[List[Dict]]], page_size: int, continuation_token: Optional[str]):
+        self._fetch = fetch
+        self._page_size = page_size
+        self._started = False
+        self.continuation_token = continuation_token
+    
+    def __aiter__(self) -> "FakePageIterator":
+        return self
+    
+    async def __anext__(self) -> AsyncIterator[Dict]:
+        if self._started and self.continuation_token is None:
+            raise StopAsyncIteration
+        self._started = True
+        if self.continuation_token is not None and not self.continuation_token.isdigit():
+            raise exceptions.CosmosHttpResponseError(status_code=400, message="Malformed continuation token")
+        
+        # Every page is a separate round trip, as with the real service
+        items = await self._fetch()
+        start = int(self.continuation_token or 0)
+        end = start + self._page_size
+        self.continuation_token = str(end) if end < len(items) else None
+        return _iterate(items[start:end])
+
+class FakeQueryIterable:
+    """Query results, iterated item by item or a page at a time like the SDK's AsyncItemPaged."""
+    
+    def __init__(self, fetch: Callable[[], Awaitable[List[Dict]]], page_size: Optional[int] = None):
+        self._fetch = fetch
+        self._page_size = page_size or 100
+    
+    async def _items(self) -> AsyncIterator[Dict]:
+        for item in await self._fetch():
+            yield item
+    
+    def __aiter__(self) -> AsyncIterator[Dict]:
+        return self._items()
+    
+    def by_page(self, continuation_token: Optional[str] = None) -> FakePageIterator:
+        return FakePageIterator(self._fetch, self._page_size, continuation_token)
+
+class FakeContainer:
+    def __init__(self, profile: Optional[FaultProfile] = None):
+        self.profile = profile or FaultProfile(median=0.0)
+        self.items: Dict[Tuple[tuple, str], Dict] = {}
+        self.operations: Dict[str, int] = {}
+        self.throttled = 0
+        self.errors = 0
+    
+    async def _operation(self, name: str):
+        """Count the operation and apply the profile's latency and failures."""
+        self.operations[name] = self.operations.get(name, 0) + 1
+        while True:
+            await self.profile.delay()
+            failure = self.profile.outcome()
+            if failure == 429:
+                self.throttled += 1
+                await asyncio.sleep(self.profile.retry_after)
+                continue
+            if failure:
+                self.errors += 1
+                raise exceptions.CosmosHttpResponseError(status_code=failure, message="Injected failure")
+            return
+    
+    @staticmethod
+    def _partition(value: Any) -> tuple:
+        return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+    
+    def _key(self, body: Dict) -> Tuple[tuple, str]:
+        return (body["userId"], body["conversationId"]), body["id"]
+    
+    def _store(self, body: Dict) -> Dict:
+        item = copy.deepcopy(body)
+        item["_etag"] = f'"{uuid.uuid4()}"'
+        self.items[self._key(item)] = item
+        return copy.deepcopy(item)
+    
+    def _get(self, item_id: str, partition_key: Any) -> Dict:
+        item = self.items.get((self._partition(partition_key), item_id))
+        if item is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+        return item
+    
+    def _create(self, body: Dict) -> Dict:
+        if self._key(body) in self.items:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+        return self._store(body)
+    
+    def _replace(self, item_id: str, body: Dict, etag: Optional[str] = None, match_condition=None) -> Dict:
+        current = self._get(item_id, self._key(body)[0])
+        if match_condition == MatchConditions.IfNotModified and etag != current["_etag"]:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="ETag mismatch")
+        return self._store(body)
+    
+    def _patch(self, item_id: str, partition_key: Any, operations: List[Dict], filter_predicate: Optional[str] = None) -> Dict:
+        item = self._get(item_id, partition_key)
+        for field, value in re.findall(r"c\.(\w+) != '([^']*)'", filter_predicate or ""):
+            if item.get(field) == value:
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Filter predicate not met")
+        for operation in operations:
+            field = operation["path"].strip("/")
+            if operation["op"] == "incr":
+                item[field] = item.get(field, 0) + operation["value"]
+            elif operation["op"] in ("set", "add", "replace"):
+                item[field] = operation["value"]
+            elif operation["op"] == "remove":
+                item.pop(field, None)
+        item["_etag"] = f'"{uuid.uuid4()}"'
+        return copy.deepcopy(item)
+    
+    async def create_item(self, body: Dict, **kwargs) -> Dict:
+        await self._operation("create")
+        return self._create(body)
+    
+    async def upsert_item(self, body: Dict, **kwargs) -> Dict:
+        await self._operation("upsert")
+        return self._store(body)
+    
+    async def read_item(self, item: str, partition_key: Any, **kwargs) -> Dict:
+        await self._operation("read")
+        return copy.deepcopy(self._get(item, partition_key))
+    
+    async def replace_item(self, item: str, body: Dict, etag: Optional[str] = None, match_condition=None, **kwargs) -> Dict:
+        await self._operation("replace")
+        return self._replace(item, body, etag, match_condition)
+    
+    async def patch_item(
+        self,
+        item: str,
+        partition_key: Any,
+        patch_operations: List[Dict],
+        filter_predicate: Optional[str] = None,
+        **kwargs
+    ) -> Dict:
+        await self._operation("patch")
+        return self._patch(item, partition_key, patch_operations, filter_predicate)
+    
+    async def execute_item_batch(self, batch_operations: List[tuple], partition_key: Any, **kwargs) -> List[Dict]:
+        """All-or-nothing, like a transactional batch."""
+        await self._operation("batch")
+        snapshot = copy.deepcopy(self.items)
+        results = []
+        try:
+            for index, (name, args, *extra) in enumerate(batch_operations):
+                options = extra[0] if extra else {}
+                if name == "create":
+                    results.append(self._create(args[0]))
+                elif name == "upsert":
+                    results.append(self._store(args[0]))
+                elif name == "replace":
+                    results.append(self._replace(args[0], args[1]))
+                elif name == "patch":
+                    results.append(self._patch(args[0], partition_key, args[1], options.get("filter_predicate")))
+                elif name == "read":
+                    results.append(copy.deepcopy(self._get(args[0], partition_key)))
+                elif name == "delete":
+                    self._get(args[0], partition_key)
+                    del self.items[(self._partition(partition_key), args[0])]
+        except exceptions.CosmosHttpResponseError as e:
+            self.items = snapshot
+            raise exceptions.CosmosBatchOperationError(
+                error_index=index,
+                headers={},
+                status_code=e.status_code,
+                message=str(e),
+                operation_responses=[{"statusCode": e.status_code}]
+            )
+        return results
+    
+    def query_items(
+        self,
+        query: str,
+        parameters: Optional[List[Dict]] = None,
+        partition_key: Any = None,
+        max_item_count: Optional[int] = None,
+        **kwargs
+    ) -> FakeQueryIterable:
+        params = {p["name"]: p["value"] for p in parameters or []}
+        
+        def value(token: str) -> Any:
+            return params[token] if token.startswith("@") else int(token)
+        
+        async def results() -> List[Dict]:
+            await self._operation("query")
+            prefix = self._partition(partition_key) if partition_key is not None else ()
+            items = [item for (pk, _), item in self.items.items() if pk[:len(prefix)] == prefix]
+            
+            for field, op, literal, parameter in re.findall(r"c\.(\w+) (>=|<=|=|>|<) (?:'([^']*)'|(@\w+))", query):
+                expected = literal if not parameter else params[parameter]
+                items = [item for item in items if field in item and COMPARISONS[op](item[field], expected)]
+            for field in re.findall(r"IS_DEFINED\(c\.(\w+)\)", query):
+                items = [item for item in items if field in item]
+            
+            order = re.search(r"ORDER BY (.+)", query)
+            if order:
+                # Multi-key ORDER BY: stable sorts from the last key to the first
+                for field, direction in reversed(re.findall(r"c\.(\w+)(?: (ASC|DESC))?", order.group(1))):
+                    items.sort(key=lambda item: item.get(field) or "", reverse=direction == "DESC")
+            
+            top = re.search(r"TOP (@\w+|\d+)", query)
+            if top:
+                items = items[:value(top.group(1))]
+            page = re.search(r"OFFSET (@\w+|\d+) LIMIT (@\w+|\d+)", query)
+            if page:
+                offset = value(page.group(1))
+                items = items[offset:offset + value(page.group(2))]
+            
+            fields = re.findall(r"c\.(\w+)", query[query.index("SELECT"):query.index("FROM")])
+            return [
+                {field: item[field] for field in fields if field in item} if fields else copy.deepcopy(item)
+                for item in items
+            ]
+        
+        return FakeQueryIterable(results, max_item_count)
+    
+    def stats(self) -> Dict:
+        return {
+            "items": len(self.items),
+            "operations": dict(self.operations),
+            "throttled": self.throttled,
+            "errors": self.errors
+        }
+
+class FakeCosmosClient:
+    """Stands in for azure.cosmos.aio.CosmosClient with a single container."""
+    
+    def __init__(self, profile: Optional[FaultProfile] = None):
+        self.container = FakeContainer(profile)
+    
+    def get_database_client(self, database: str) -> "FakeCosmosClient":
+        return self
+    
+    def get_container_client(self, container: str) -> FakeContainer:
+        return self.container
+    
+    async def close(self):
+        pass
@@ -0,0 +1,230 @@
+"""
+Local stand-in for the Microsoft Graph endpoints used by the app.
+
+Serves the subset of Graph used by backend.ingestion:
+    GET /sites/{site_id}/drives
+    GET /drives/{drive_id}/root/delta
+    GET /drives/{drive_id}/items/{item_id}/content
+    GET /drives/{drive_id}/items/{item_id}/permissions
+
+and by backend.retrieval (with the latency, error and 429 rates of
+`search_profile`):
+    POST /search/query (also under /v1.0)
+
+Usage:
+    python -m benchmarks.fake_graph --files 1000 --port 8001
+
+Point ingestion at it with DeltaSync(base_url="http://localhost:8001"), or
+mount create_app() in-process with httpx.ASGITransport.
+"""
+import argparse
+import hashlib
+import uuid
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from benchmarks.faults import FaultProfile
+
+class FakeGraph:
+    """
+    In-memory drives whose delta feed is a change log ordered by a global sequence number.
+
+    A delta token is the sequence number the caller has seen; a delta query
+    returns the latest state (or a tombstone) of every item changed after it.
+    Tokens older than `retained_since` get 410 Gone, like an expired Graph
+    delta link. Items whose only change is to their permissions are listed
+    (annotated with @microsoft.graph.sharedChanged) only when the request
+    sends `Prefer: deltashowsharingchanges`, as in Graph.
+
+    Search results are synthetic: `size` driveItem hits whose summaries
+    contain the query, in the response shape M365RetrievalClient parses.
+    """
+
+    def __init__(self, page_size: int = 200, search_profile: Optional[FaultProfile] = None):
+        self.page_size = page_size
+        self.search_profile = search_profile or FaultProfile(median=0.0)
+        self.searches = 0
+        self.search_failures = {429: 0, 503: 0}
+        self.sites: Dict[str, List[str]] = {}
+        self.items: Dict[str, Dict[str, Dict]] = {}  # drive id -> item id -> item
+        self.contents: Dict[str, str] = {}
+        self.permissions: Dict[str, List[Dict]] = {}  # item id -> Graph permission objects
+        self.seq = 0
+        self.retained_since = 0
+        self.requests = 0
+        self.downloads = 0
+
+    def add_site(self, site_id: str, drive_ids: List[str]):
+        self.sites[site_id] = drive_ids
+        for drive_id in drive_ids:
+            self.items.setdefault(drive_id, {})
+
+    def put_file(self, drive_id: str, name: str, content: str, item_id: Optional[str] = None) -> str:
+        """Create or update a file; content changes bump the cTag."""
+        self.seq += 1
+        item_id = item_id or uuid.uuid4().hex
+        self.items[drive_id][item_id] = {
+            "id": item_id,
+            "name": name,
+            "eTag": f"etag-{self.seq}",
+            "cTag": f"ctag-{self.seq}",
+            "webUrl": f"https://contoso.sharepoint.com/sites/demo/Shared%20Documents/{name}",
+            "file": {"mimeType": "text/plain"},
+            "parentReference": {"driveId": drive_id},
+            "_seq": self.seq
+        }
+        self.contents[item_id] = content
+        return item_id
+
+    def rename_file(self, drive_id: str, item_id: str, name: str):
+        """Metadata-only change: new eTag, same cTag."""
+        self.seq += 1
+        item = self.items[drive_id][item_id]
+        item.update({"name": name, "eTag": f"etag-{self.seq}", "_seq": self.seq, "_sharing_only": False})
+
+    def share_file(self, drive_id: str, item_id: str, permissions: List[Dict]):
+        """Permission-only change: same eTag and cTag."""
+        self.seq += 1
+        self.items[drive_id][item_id].update({"_seq": self.seq, "_sharing_only": True})
+        self.permissions[item_id] = permissions
+
+    def delete_file(self, drive_id: str, item_id: str):
+        self.seq += 1
+        self.items[drive_id][item_id] = {"id": item_id, "deleted": {"state": "deleted"}, "_seq": self.seq}
+        self.contents.pop(item_id, None)
+
+    def expire_tokens(self):
+        """Make every outstanding delta link invalid (410 Gone)."""
+        self.retained_since = self.seq
+
+    def delta(self, drive_id: str, token: int, until: int, skip: int, show_sharing: bool = False) -> Tuple[List[Dict], int]:
+        changed = sorted(
+            (
+                item for item in self.items[drive_id].values()
+                if token < item["_seq"] <= until and (show_sharing or token == 0 or not item.get("_sharing_only"))
+            ),
+            key=lambda item: item["_seq"]
+        )
+        if token == 0:
+            changed = [item for item in changed if "deleted" not in item]
+        return [
+            {
+                **{key: value for key, value in item.items() if not key.startswith("_")},
+                **({"@microsoft.graph.sharedChanged": "True"} if item.get("_sharing_only") and show_sharing else {})
+            }
+            for item in changed[skip:skip + self.page_size]
+        ], len(changed)
+
+    def search_hits(self, query: str, size: int) -> List[Dict]:
+        seed = int(hashlib.sha256(query.lower().encode("utf-8")).hexdigest()[:8], 16)
+        return [
+            {
+                "hitId": f"hit-{seed + i}",
+                "rank": i + 1,
+                "summary": f"Section {(seed + i) % 40} of the handbook covers {query}. "
+                           f"Employees should follow the documented process and contact their manager with questions.",
+                "resource": {
+                    "@odata.type": "#microsoft.graph.driveItem",
+                    "name": f"Handbook section {(seed + i) % 40}.docx",
+                    "webUrl": f"https://contoso.sharepoint.com/sites/demo/Shared%20Documents/handbook-{(seed + i) % 40}.docx",
+                    "parentReference": {"siteId": "contoso-site", "driveId": "drive-1"}
+                }
+            }
+            for i in range(size)
+        ]
+
+def create_app(graph: FakeGraph) -> FastAPI:
+    app = FastAPI(title="Fake Microsoft Graph")
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next):
+        graph.requests += 1
+        return await call_next(request)
+
+    @app.get("/sites/{site_id}/drives")
+    async def list_drives(site_id: str):
+        if site_id not in graph.sites:
+            raise HTTPException(status_code=404, detail="Site not found")
+        return {"value": [{"id": drive_id} for drive_id in graph.sites[site_id]]}
+
+    @app.get("/drives/{drive_id}/root/delta")
+    async def delta(request: Request, drive_id: str, token: int = 0, until: Optional[int] = None, skip: int = 0):
+        if drive_id not in graph.items:
+            raise HTTPException(status_code=404, detail="Drive not found")
+        if 0 < token < graph.retained_since:
+            raise HTTPException(status_code=410, detail="resyncRequired")
+
+        until = graph.seq if until is None else until
+        show_sharing = "deltashowsharingchanges" in request.headers.get("prefer", "")
+        page, total = graph.delta(drive_id, token, until, skip, show_sharing)
+        base = str(request.base_url).rstrip("/")
+        body = {"value": page}
+        if skip + len(page) < total:
+            body["@odata.nextLink"] = f"{base}/drives/{drive_id}/root/delta?token={token}&until={until}&skip={skip + len(page)}"
+        else:
+            body["@odata.deltaLink"] = f"{base}/drives/{drive_id}/root/delta?token={until}"
+        return body
+
+    @app.get("/drives/{drive_id}/items/{item_id}/content")
+    async def content(drive_id: str, item_id: str):
+        if item_id not in graph.contents:
+            raise HTTPException(status_code=404, detail="Item not found")
+        graph.downloads += 1
+        return PlainTextResponse(graph.contents[item_id])
+
+    @app.get("/drives/{drive_id}/items/{item_id}/permissions")
+    async def permissions(drive_id: str, item_id: str):
+        return {"value": graph.permissions.get(item_id, [{"link": {"scope": "organization"}}])}
+
+    @app.post("/search/query")
+    @app.post("/v1.0/search/query")
+    async def search(request: Request):
+        body = await request.json()
+        search_request = body["requests"][0]
+        profile = graph.search_profile
+        graph.searches += 1
+
+        await profile.delay()
+        failure = profile.outcome()
+        if failure:
+            graph.search_failures[failure] += 1
+            return JSONResponse(
+                status_code=failure,
+                headers={"Retry-After": f"{profile.retry_after:g}"} if failure == 429 else {},
+                content={"error": {"code": "TooManyRequests" if failure == 429 else "serviceNotAvailable", "message": "Injected failure"}}
+            )
+
+        size = search_request.get("size", 10)
+        return {
+            "value": [{
+                "searchTerms": search_request["query"]["queryString"].split(),
+                "hitsContainers": [{
+                    "hits": graph.search_hits(search_request["query"]["queryString"], size),
+                    "total": size,
+                    "moreResultsAvailable": False
+                }]
+            }]
+        }
+
+    return app
+
+def populate(graph: FakeGraph, files: int, site_id: str = "contoso-site", drive_id: str = "drive-1") -> List[str]:
+    """Create one site with one drive holding `files` text documents."""
+    graph.add_site(site_id, [drive_id])
+    return [
+        graph.put_file(drive_id, f"doc-{i}.txt", f"Document {i}. " + "Policy text for testing ingestion. " * 80)
+        for i in range(files)
+    ]
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--search", default="median=0.15,p99=1.0", help="Search latency and failure profile")
+    args = parser.parse_args()
+
+    fake = FakeGraph(search_profile=FaultProfile.parse(args.search))
+    populate(fake, args.files)
+    uvicorn.run(create_app(fake), host="127.0.0.1", port=args.port)
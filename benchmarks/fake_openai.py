@@ -0,0 +1,201 @@
+"""
+Local stand-in for the Azure OpenAI embeddings and chat completions endpoints.
+
+Serves POST /openai/deployments/{deployment}/embeddings with a configurable
+per-request and per-input latency, a per-request input limit and a
+requests-per-second limit that answers 429 with retry-after-ms, like the
+real service under throttling. Vectors are deterministic per input text.
+
+Serves POST /openai/deployments/{deployment}/chat/completions, blocking or
+streamed as Server-Sent Events (including Azure's leading prompt-filter
+chunk). `chat_profile` sets the time to first token and the 429/5xx
+rates; each further token takes `token_latency`.
+
+Usage:
+    python -m benchmarks.fake_openai --port 8002
+
+Point a client at it with AsyncAzureOpenAI(azure_endpoint="http://localhost:8002"),
+or mount create_app() in-process with httpx.ASGITransport.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from benchmarks.faults import FaultProfile
+
+ANSWER = (
+    "According to the handbook [1], employees should submit the request through the portal "
+    "and include the supporting documents. Approvals are handled by the line manager [2], "
+    "and the policy applies to all full-time staff."
+)
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        request_latency: float = 0.05,
+        input_latency: float = 0.0005,
+        max_inputs: int = 2048,
+        requests_per_second: float = 0.0,  # 0 disables throttling
+        chat_profile: Optional[FaultProfile] = None,
+        token_latency: float = 0.01,
+        completion_tokens: int = 60
+    ):
+        self.dimensions = dimensions
+        self.chat_profile = chat_profile or FaultProfile(median=0.3)
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.completions = 0
+        self.chat_failures = {429: 0, 503: 0}
+        self.request_latency = request_latency
+        self.input_latency = input_latency
+        self.max_inputs = max_inputs
+        self.requests_per_second = requests_per_second
+        self.requests = 0
+        self.throttled = 0
+        self.inputs = 0
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+    
+    def vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+    
+    def answer_tokens(self) -> List[str]:
+        words = ANSWER.split()
+        return [(" " if i else "") + words[i % len(words)] for i in range(self.completion_tokens)]
+    
+    def throttle_delay(self) -> float:
+        """Seconds until the next request is allowed, or 0 to admit it now."""
+        if not self.requests_per_second:
+            return 0.0
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_requests = now, 0
+        if self._window_requests >= self.requests_per_second:
+            return 1.0 - (now - self._window_start)
+        self._window_requests += 1
+        return 0.0
+
+def create_app(fake: FakeOpenAI) -> FastAPI:
+    app = FastAPI(title="Fake Azure OpenAI")
+    
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        body: Dict = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        
+        delay = fake.throttle_delay()
+        if delay:
+            fake.throttled += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after-ms": str(int(delay * 1000))},
+                content={"error": {"code": "429", "message": "Rate limit exceeded"}}
+            )
+        if len(inputs) > fake.max_inputs:
+            return JSONResponse(
+                status_code=400,
+                content={"error": {"code": "400", "message": f"Too many inputs; max is {fake.max_inputs}"}}
+            )
+        
+        fake.requests += 1
+        fake.inputs += len(inputs)
+        await asyncio.sleep(fake.request_latency + fake.input_latency * len(inputs))
+        return {
+            "object": "list",
+            "model": deployment,
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake.vector(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": sum(len(text) // 4 for text in inputs), "total_tokens": sum(len(text) // 4 for text in inputs)}
+        }
+    
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body: Dict = await request.json()
+        profile = fake.chat_profile
+        
+        failure = profile.outcome()
+        if failure:
+            fake.chat_failures[failure] += 1
+            return JSONResponse(
+                status_code=failure,
+                headers={"retry-after-ms": str(int(profile.retry_after * 1000))} if failure == 429 else {},
+                content={"error": {"code": str(failure), "message": "Injected failure"}}
+            )
+        
+        fake.completions += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        prompt_tokens = sum(len(message.get("content") or "") // 4 for message in body["messages"])
+        tokens = fake.answer_tokens()
+        
+        if not body.get("stream"):
+            await asyncio.sleep(profile.latency() + fake.token_latency * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": deployment,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens)
+                }
+            }
+        
+        def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+            return "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }) + "\n\n"
+        
+        async def events() -> AsyncIterator[str]:
+            # Azure sends prompt filter results first, with no choices
+            yield "data: " + json.dumps({"id": "", "object": "", "created": 0, "model": "", "choices": [], "prompt_filter_results": []}) + "\n\n"
+            await asyncio.sleep(profile.latency())
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(fake.token_latency)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI embeddings and chat endpoints")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--rps", type=float, default=0.0, help="Embedding requests per second before 429s (0 = unlimited)")
+    parser.add_argument("--chat", default="median=0.3,p99=1.5", help="Chat time-to-first-token and failure profile")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per streamed completion token")
+    args = parser.parse_args()
+    
+    fake = FakeOpenAI(
+        requests_per_second=args.rps,
+        chat_profile=FaultProfile.parse(args.chat),
+        token_latency=args.token_latency
+    )
+    uvicorn.run(create_app(fake), host="127.0.0.1", port=args.port)
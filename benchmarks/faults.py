@@ -0,0 +1,69 @@
+"""
+Latency and failure injection shared by the fake upstreams.
+
+A FaultProfile draws per-call latency from a log-normal distribution
+(given by its median and p99, which is how upstream latency is usually
+described) and decides whether a call fails with a 5xx or is throttled
+with a 429. Profiles can be given on the command line as
+"median=0.08,p99=0.6,errors=0.01,throttle=0.02,retry_after=1".
+"""
+import asyncio
+import math
+import random
+from typing import Optional
+
+# z-score of the 99th percentile of a standard normal distribution
+Z_99 = 2.3263
+
+class FaultProfile:
+    def __init__(
+        self,
+        median: float = 0.05,
+        p99: Optional[float] = None,
+        errors: float = 0.0,
+        throttle: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        self.median = median
+        self.p99 = p99 if p99 is not None else median * 3
+        self.errors = errors
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._sigma = math.log(self.p99 / median) / Z_99 if median > 0 and self.p99 > median else 0.0
+    
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "FaultProfile":
+        """Build a profile from "key=value,..." (keys are the constructor arguments)."""
+        values = {}
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            key, _, value = part.partition("=")
+            values[key.strip()] = float(value)
+        return cls(**values, seed=seed)
+    
+    def latency(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self._random.gauss(0.0, self._sigma)) if self._sigma else self.median
+    
+    async def delay(self):
+        await asyncio.sleep(self.latency())
+    
+    def outcome(self) -> Optional[int]:
+        """Status code of an injected failure (429 or 503), or None for a normal response."""
+        draw = self._random.random()
+        if draw < self.throttle:
+            return 429
+        if draw < self.throttle + self.errors:
+            return 503
+        return None
+    
+    def describe(self) -> dict:
+        return {
+            "median": self.median,
+            "p99": self.p99,
+            "errors": self.errors,
+            "throttle": self.throttle,
+            "retry_after": self.retry_after
+        }
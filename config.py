@@ -1,24 +1,148 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 class Settings(BaseSettings):
-    # Demo Mode
+    # Demo Mode (in-memory conversations, local BM25 search and extractive answers; no Azure credentials)
     demo_mode: bool = True
+    demo_docs_path: str = "demo_docs"  # Text/HTML files indexed at startup; subfolders act as sites
     
     # Entra ID
     azure_tenant_id: Optional[str] = None
     azure_client_id: Optional[str] = None
     azure_client_secret: Optional[str] = None
+    token_refresh_margin: float = 240.0  # Refresh this many seconds before expiry (inside MSAL's 5-minute cache window)
+    token_error_ttl: float = 10.0  # Seconds to fail fast after a failed token acquisition
     
     # OpenAI
     openai_api_key: Optional[str] = None
     openai_model: str = "gpt-4o"
     
+    # Azure OpenAI
+    azure_openai_endpoint: Optional[str] = None
+    azure_openai_api_key: Optional[str] = None
+    azure_openai_deployment: str = "gpt-4o"
+    azure_openai_api_version: str = "2024-02-15-preview"
+    llm_max_concurrency: int = 32  # In-flight completions per worker process
+    llm_timeout: float = 60.0  # Seconds per completion call
+    llm_max_tokens: int = 800  # Completion tokens, reserved out of the budget
+    llm_token_budget: int = 6000  # Prompt + completion tokens per request
+    prompt_chunk_max_tokens: int = 350
+    prompt_history_turn_max_tokens: int = 200
+    azure_openai_embedding_deployment: str = "text-embedding-3-small"
+    embedding_batch_size: int = 256  # Inputs per embeddings request
+    embedding_batch_max_tokens: int = 100000  # Input tokens per embeddings request
+    embedding_max_concurrency: int = 4  # In-flight embeddings requests per process
+    embedding_max_retries: int = 6  # Retries on 429/5xx, honouring Retry-After
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = "data/embedding_cache.db"
+    embedding_cache_max_age: Optional[float] = 30 * 24 * 3600.0  # Seconds; older entries are pruned at startup
+    embedding_cache_max_rows: Optional[int] = 1000000  # Oldest entries beyond this are pruned at startup
+    
     # Cosmos DB
     cosmos_endpoint: Optional[str] = None
     cosmos_key: Optional[str] = None
     cosmos_database: str = "m365rag"
     cosmos_container: str = "conversations"
+    cosmos_message_storage: str = "items"  # "items" (one item per message) or "embedded" (legacy)
+    cosmos_index_metrics: bool = False  # Log index utilization of history queries (checks the composite indexes are used)
+    history_max_messages: int = 4  # Prior messages sent to the LLM (and kept in the compacted recent window)
+    
+    # Conversation compaction (rolling summary + recent window on the conversation header)
+    conversation_compaction_enabled: bool = True
+    conversation_summary_max_tokens: int = 300  # Summary length cap, in the prompt and per summary update
+    compaction_workers: int = 2
+    
+    # Conversation API paging (each page is one bounded Cosmos query)
+    conversations_page_size: int = 20
+    messages_page_size: int = 50
+    max_page_size: int = 200
+    
+    # Batch queries (/api/query/batch, e.g. evaluation runs)
+    batch_max_queries: int = 1000
+    batch_concurrency: int = 8  # Queries in flight per process, across all batches
+    batch_rate_limit: float = 4.0  # Queries started per second per process
+    
+    # Background query jobs (/api/jobs; one job table per replica)
+    jobs_db_path: str = "data/jobs.db"
+    job_workers: int = 4  # Jobs run concurrently per replica
+    job_max_queued: int = 100
+    job_result_ttl: float = 3600.0  # Seconds a finished job stays readable
+    
+    # Conversation list cache (first page per user, kept current by write-through)
+    conversation_cache_max_users: int = 10000  # LRU bound
+    conversation_cache_ttl: float = 30.0  # Seconds; bounds staleness from writes in other replicas (0 disables)
+    
+    # Turn persistence (write-behind)
+    persistence_write_behind: bool = True
+    persistence_journal_path: str = "data/turn_journal.db"
+    persistence_flush_interval: float = 0.5  # Seconds between journal flushes when idle
+    persistence_max_retry_delay: float = 30.0  # Backoff cap while Cosmos DB is failing
+    persistence_drain_timeout: float = 25.0  # Shutdown flush; keep below the platform's termination grace period
+    persistence_missing_conversation_grace: float = 300.0  # Retry follow-ups to conversations another replica has not flushed yet
+    
+    # Microsoft Graph HTTP pool
+    graph_http2: bool = True
+    graph_max_connections: int = 100
+    graph_max_keepalive_connections: int = 20
+    graph_keepalive_expiry: float = 30.0  # Seconds an idle connection is kept open
+    graph_timeout: float = 30.0
+    
+    # Retrieval backend
+    retrieval_backend: str = "graph"  # "graph" (live Graph search) or "local" (pre-embedded vector index)
+    vector_index_path: str = "data/vector_index"
+    vector_index_nprobe: int = 8  # Inverted lists scanned per query
+    
+    # Ingestion (Graph delta sync into the local vector index)
+    ingestion_sites: List[str] = []  # Graph site ids, e.g. "contoso.sharepoint.com,<site-guid>,<web-guid>"
+    ingestion_store_path: str = "data/ingestion.db"
+    ingestion_workers: int = 4  # Concurrent file downloads
+    ingestion_rate_limit: float = 10.0  # Graph requests per second
+    ingestion_chunk_chars: int = 1500
+    ingestion_chunk_overlap: int = 200
+    ingestion_item_permissions: bool = False  # Fetch per-item permissions into chunk ACLs
+    ingestion_retrain_ratio: float = 0.2  # Re-train index centroids once this share of rows has changed
+    
+    # Client-side rate limiting (per upstream, per process; adapts with AIMD)
+    graph_rate_limit: float = 20.0  # Initial Graph search requests per second
+    graph_rate_limit_max: float = 100.0
+    openai_rate_limit: float = 10.0  # Initial chat completions per second
+    openai_rate_limit_max: float = 50.0
+    embedding_rate_limit: float = 10.0  # Initial embeddings requests per second
+    embedding_rate_limit_max: float = 50.0
+    rate_limit_min: float = 0.5
+    llm_max_attempts: int = 3  # Completion attempts when throttled
+    
+    # Graph search result cache
+    retrieval_cache_ttl: float = 300.0
+    retrieval_cache_max_entries: int = 2048
+    retrieval_cache_stale_ttl: float = 3600.0  # Expired results kept for use while the circuit is open
+    
+    # Graph search resilience
+    graph_search_timeout: float = 10.0  # Per attempt; the pool default is 30 s
+    graph_breaker_failure_threshold: int = 5  # Consecutive failures that open the circuit
+    graph_breaker_reset_timeout: float = 30.0  # Seconds open before a half-open probe
+    graph_hedging_enabled: bool = True
+    graph_hedge_budget: float = 0.05  # Max share of searches that get a duplicate request
+    graph_hedge_percentile: float = 95.0  # Hedge after this percentile of recent latency
+    retrieval_fallback_local: bool = False  # Serve from the local vector index while the circuit is open
+    
+    # Local re-ranking of Graph candidates
+    rerank_enabled: bool = True
+    rerank_candidates: int = 25  # Graph results fetched before re-ranking down to top_k
+    rerank_use_embeddings: bool = False  # Blend embedding similarity into the BM25 score
+    rerank_embedding_weight: float = 0.5
+    rerank_latency_budget: float = 0.15  # Seconds; Graph order is used if BM25 scoring takes longer
+    rerank_embedding_timeout: Optional[float] = None  # Seconds for the embedding call (default: rest of the budget); BM25 order is used if it is late
+    
+    # Semantic answer cache
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.92  # Minimum cosine similarity for a hit
+    semantic_cache_ttl: float = 3600.0
+    semantic_cache_max_entries: int = 10000
+    
+    # Observability (Prometheus metrics are always served on /metrics)
+    otel_exporter_endpoint: Optional[str] = None  # OTLP/HTTP collector URL, e.g. http://otel-collector:4318; unset disables trace export
+    otel_service_name: str = "rag-backend"
     
     # App
     backend_url: str = "http://localhost:8000"
@@ -70,9 +70,16 @@ az containerapp create \
   --min-replicas 0 \
   --max-replicas 5 \
   --env-vars \
-    DEMO_MODE=true \
+    DEMO_MODE=false \
     OPENAI_API_KEY=secretref:openai-key
 
+# Session affinity: unflushed conversation turns and background jobs live on the replica that accepted them
+echo "📌 Enabling backend session affinity..."
+az containerapp ingress sticky-sessions set \
+  --name $BACKEND_APP \
+  --resource-group $RESOURCE_GROUP \
+  --affinity sticky
+
 # Get backend FQDN
 BACKEND_FQDN=$(az containerapp show -n $BACKEND_APP -g $RESOURCE_GROUP --query properties.configuration.ingress.fqdn -o tsv)
 
@@ -1,39 +1,152 @@
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
-from typing import List, Dict, Optional
+from azure.core import MatchConditions
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
+from typing import List, Dict, Optional, Tuple
+import base64
 import uuid
 from datetime import datetime
 import logging
 from config import settings
+from backend import metrics
 
 logger = logging.getLogger(__name__)
 
+MIGRATION_BATCH_SIZE = 100
+
+# Cap on the size of Cosmos continuation tokens (KB), so they fit in a query string
+CONTINUATION_TOKEN_LIMIT_KB = 1
+
+class InvalidContinuationError(ValueError):
+    """Raised for a continuation token that was not issued by this API."""
+
+def encode_continuation(token: Optional[str]) -> Optional[str]:
+    """Wrap a continuation token (JSON, for Cosmos) as a URL-safe string for clients."""
+    return base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii") if token else None
+
+def decode_continuation(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+    except (ValueError, UnicodeError):
+        raise InvalidContinuationError("Invalid continuation token")
+
+def page_by_offset(items: List, page_size: int, continuation: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """Page through an in-memory list with offset continuation tokens."""
+    try:
+        start = int(decode_continuation(continuation) or 0)
+    except ValueError:
+        raise InvalidContinuationError("Invalid continuation token")
+    end = start + page_size
+    return items[start:end], encode_continuation(str(end)) if end < len(items) else None
+
 class CosmosDBClient:
     """
     Manages conversation history in Azure Cosmos DB.
     Uses hierarchical partition key: [userId, conversationId] for isolation and scale.
+    
+    Two storage layouts are supported (COSMOS_MESSAGE_STORAGE):
+    - "items": a small header item (title, updatedAt, messageCount) plus one item
+      per message in the same partition; appends never rewrite earlier messages.
+    - "embedded": legacy layout with every message inside the conversation item.
+    Legacy conversations are migrated lazily on read in "items" mode.
+    
+    In "items" mode the header also carries the compact history written by
+    the conversation compactor (rolling summary plus a bounded window of
+    recent messages), so the query path reads one small item however long
+    the conversation is; the full transcript is only read, a page at a time,
+    by get_conversation and get_messages_page.
+    
+    Conversation and message lists are paged with Cosmos continuation tokens
+    (see cosmos-indexing-policy.json for the indexes the queries rely on).
+    
+    Built on the async SDK so Cosmos round trips never block the event loop.
+    A single CosmosClient (and its connection pool) is opened at startup and
+    shared by all requests; see start() and close(). The request charge of
+    every response (including each query page) is added to the Cosmos RU
+    counter in backend.metrics. With COSMOS_INDEX_METRICS set, the history
+    queries also ask for index metrics, which are logged, to confirm the
+    composite indexes serve their ORDER BY.
     """
     
     def __init__(self):
-        self.client = CosmosClient(settings.cosmos_endpoint, settings.cosmos_key)
+        self.client: Optional[CosmosClient] = None
+        self.database = None
+        self.container = None
+    
+    async def start(self):
+        """Open the shared Cosmos connection. Called from the FastAPI lifespan."""
+        if self.client is not None:
+            return
+        
+        self.client = CosmosClient(
+            settings.cosmos_endpoint,
+            settings.cosmos_key,
+            raw_response_hook=self._record_request_charge
+        )
         self.database = self.client.get_database_client(settings.cosmos_database)
         self.container = self.database.get_container_client(settings.cosmos_container)
+        logger.info(f"Opened Cosmos DB connection to {settings.cosmos_database}/{settings.cosmos_container}")
+    
+    async def close(self):
+        """Close the shared Cosmos connection. Called from the FastAPI lifespan."""
+        if self.client is None:
+            return
+        
+        await self.client.close()
+        self.client = None
+        self.database = None
+        self.container = None
+    
+    @staticmethod
+    def _record_request_charge(response):
+        """azure-core response hook: count RUs per operation (query, batch or HTTP method)."""
+        request = response.http_request
+        if str(request.headers.get("x-ms-documentdb-isquery")).lower() == "true":
+            operation = "query"
+        elif str(request.headers.get("x-ms-cosmos-is-batch-request")).lower() == "true":
+            operation = "batch"
+        else:
+            operation = request.method.lower()
+        metrics.record_cosmos_request(
+            operation,
+            response.http_response.status_code,
+            response.http_response.headers.get("x-ms-request-charge")
+        )
+        
+        index_metrics = response.http_response.headers.get("x-ms-cosmos-index-utilization")
+        if index_metrics:
+            # Only returned when queries ask for it (COSMOS_INDEX_METRICS)
+            logger.info(f"Cosmos index utilization: {base64.b64decode(index_metrics).decode('utf-8')}")
+    
+    @property
+    def itemized(self) -> bool:
+        """True when each message is stored as its own item (append-only mode)."""
+        return settings.cosmos_message_storage == "items"
     
     async def create_conversation(self, user_id: str, title: str = "New Conversation") -> str:
         """Create a new conversation for a user."""
         conversation_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
         
         item = {
             "id": conversation_id,
             "userId": user_id,
             "conversationId": conversation_id,
             "title": title,
-            "createdAt": datetime.utcnow().isoformat(),
-            "messages": [],
+            "createdAt": now,
+            "updatedAt": now,
             "type": "conversation"
         }
         
+        if self.itemized:
+            # Header item only; messages live in their own items
+            item["messageCount"] = 0
+        else:
+            item["messages"] = []
+        
         try:
-            self.container.create_item(body=item, enable_automatic_id_generation=False)
+            await self.container.create_item(body=item, enable_automatic_id_generation=False)
             logger.info(f"Created conversation {conversation_id} for user {user_id}")
             return conversation_id
         except exceptions.CosmosHttpResponseError as e:
@@ -49,69 +162,557 @@ class CosmosDBClient:
         citations: Optional[List[Dict]] = None
     ):
         """Add a message to an existing conversation."""
+        message = {
+            "id": str(uuid.uuid4()),
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat(),
+            "citations": citations or []
+        }
+        
         try:
+            if self.itemized:
+                await self._append_message_item(user_id, conversation_id, message)
+                return
+            
             # Read existing conversation
-            item = self.container.read_item(
+            item = await self.container.read_item(
                 item=conversation_id,
                 partition_key=[user_id, conversation_id]
             )
             
-            # Add new message
-            message = {
-                "id": str(uuid.uuid4()),
-                "role": role,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat(),
-                "citations": citations or []
-            }
-            
             item["messages"].append(message)
             item["updatedAt"] = datetime.utcnow().isoformat()
             
             # Update item
-            self.container.replace_item(item=item["id"], body=item)
-            
+            await self.container.replace_item(item=item["id"], body=item)
+        
         except exceptions.CosmosHttpResponseError as e:
             logger.error(f"Failed to add message: {str(e)}")
             raise
     
-    async def get_conversation(self, user_id: str, conversation_id: str) -> Optional[Dict]:
-        """Retrieve a conversation with all messages."""
+    async def _append_message_item(self, user_id: str, conversation_id: str, message: Dict):
+        """
+        Append a message as its own item and touch the header in one transactional batch.
+        
+        The write is O(message size) regardless of conversation length, and the
+        header patch (set updatedAt, increment messageCount) is atomic with the
+        insert, so concurrent turns never overwrite each other.
+        """
+        message_item = {
+            **message,
+            "userId": user_id,
+            "conversationId": conversation_id,
+            "type": "message"
+        }
+        
+        await self.container.execute_item_batch(
+            batch_operations=[
+                ("create", (message_item,)),
+                ("patch", (conversation_id, [
+                    {"op": "set", "path": "/updatedAt", "value": message["timestamp"]},
+                    {"op": "incr", "path": "/messageCount", "value": 1}
+                ]))
+            ],
+            partition_key=[user_id, conversation_id]
+        )
+    
+    async def get_conversation(
+        self,
+        user_id: str,
+        conversation_id: str,
+        include_messages: bool = True,
+        include_citations: bool = True,
+        page_size: int = 50
+    ) -> Optional[Dict]:
+        """
+        Retrieve a conversation header with the first page of its messages, oldest first.
+        
+        Later pages come from get_messages_page() with the returned
+        `continuation`. Without `include_messages` only the header is returned.
+        """
+        try:
+            item = await self._read_conversation(user_id, conversation_id)
+            if item is None:
+                return None
+            
+            conversation = {k: v for k, v in item.items() if k not in ("messages", "recentMessages")}
+            if include_messages:
+                page = await self._messages_page(item, page_size, None, include_citations, False)
+                conversation["messages"] = page["messages"]
+                conversation["continuation"] = page["continuation"]
+            
+            return conversation
+        except exceptions.CosmosHttpResponseError as e:
+            logger.error(f"Failed to get conversation: {str(e)}")
+            raise
+    
+    async def _read_conversation(self, user_id: str, conversation_id: str) -> Optional[Dict]:
+        """Point read of a conversation, migrating a legacy one in "items" mode. None if it does not exist."""
+        item = await self.get_conversation_header(user_id, conversation_id)
+        if item is not None and self.itemized and "messages" in item:
+            item = await self.migrate_conversation(user_id, conversation_id)
+        return item
+    
+    async def get_messages_page(
+        self,
+        user_id: str,
+        conversation_id: str,
+        page_size: int = 50,
+        continuation: Optional[str] = None,
+        include_citations: bool = True,
+        newest_first: bool = False
+    ) -> Optional[Dict]:
+        """
+        One page of a conversation's messages and the continuation token for
+        the next, or None if the conversation does not exist.
+        
+        The header is read first (migrating a legacy conversation in "items"
+        mode). In "items" mode each page is then one single-partition query of
+        at most `page_size` items, however long the conversation is; without
+        `include_citations` the citations are left out of the projection.
+        """
+        header = await self._read_conversation(user_id, conversation_id)
+        if header is None:
+            return None
+        return await self._messages_page(header, page_size, continuation, include_citations, newest_first)
+    
+    async def _messages_page(
+        self,
+        header: Dict,
+        page_size: int,
+        continuation: Optional[str],
+        include_citations: bool,
+        newest_first: bool
+    ) -> Dict:
+        """A page of messages of a conversation whose header has been read (embedded or itemized)."""
+        if "messages" in header:
+            return self._page_embedded(header["messages"], page_size, continuation, include_citations, newest_first)
+        
+        citations = ", c.citations" if include_citations else ""
+        query = f"""
+        SELECT c.id, c.role, c.content, c.timestamp{citations}
+        FROM c
+        WHERE c.type = 'message'
+        ORDER BY c.type ASC, c.timestamp {"DESC" if newest_first else "ASC"}
+        """
+        
+        messages, next_continuation = await self._query_page(
+            query,
+            [],
+            [header["userId"], header["conversationId"]],
+            page_size,
+            continuation
+        )
+        return {
+            "messages": messages,
+            "continuation": next_continuation
+        }
+    
+    @staticmethod
+    def _page_embedded(
+        messages: List[Dict],
+        page_size: int,
+        continuation: Optional[str],
+        include_citations: bool,
+        newest_first: bool
+    ) -> Dict:
+        """Offset paging over the messages of a legacy single-document conversation."""
+        ordered = list(reversed(messages)) if newest_first else messages
+        page, next_continuation = page_by_offset(ordered, page_size, continuation)
+        if not include_citations:
+            page = [{k: v for k, v in message.items() if k != "citations"} for message in page]
+        return {
+            "messages": page,
+            "continuation": next_continuation
+        }
+    
+    async def _query_page(
+        self,
+        query: str,
+        parameters: List[Dict],
+        partition_key,
+        page_size: int,
+        continuation: Optional[str]
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """One page of query results, and the client continuation token for the next page (None after the last)."""
+        pages = self.container.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=partition_key,
+            max_item_count=page_size,
+            continuation_token_limit=CONTINUATION_TOKEN_LIMIT_KB,
+            populate_index_metrics=settings.cosmos_index_metrics
+        ).by_page(decode_continuation(continuation))
+        
+        items = []
+        try:
+            async for page in pages:
+                items = [item async for item in page]
+                break
+        except exceptions.CosmosHttpResponseError as e:
+            if continuation and e.status_code == 400:
+                raise InvalidContinuationError("Invalid continuation token")
+            raise
+        return items, encode_continuation(pages.continuation_token)
+    
+    async def get_recent_messages(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limit: int = 4
+    ) -> List[Dict]:
+        """Return the last `limit` messages of a conversation, oldest first."""
+        try:
+            if not self.itemized:
+                item = await self.container.read_item(
+                    item=conversation_id,
+                    partition_key=[user_id, conversation_id]
+                )
+                return item.get("messages", [])[-limit:]
+            
+            messages = await self._query_messages(user_id, conversation_id, limit=limit)
+            
+            # A short result may mean the conversation predates itemized storage
+            if len(messages) < limit:
+                header = await self.container.read_item(
+                    item=conversation_id,
+                    partition_key=[user_id, conversation_id]
+                )
+                if "messages" in header:
+                    await self.migrate_conversation(user_id, conversation_id)
+                    messages = await self._query_messages(user_id, conversation_id, limit=limit)
+            
+            return messages
+        except exceptions.CosmosResourceNotFoundError:
+            return []
+        except exceptions.CosmosHttpResponseError as e:
+            logger.error(f"Failed to get recent messages: {str(e)}")
+            raise
+    
+    async def _query_messages(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        since: Optional[str] = None
+    ) -> List[Dict]:
+        """Single-partition query for message items (newer than `since`, if given), returned oldest first."""
+        top = "TOP @limit " if limit else ""
+        after = " AND c.timestamp > @since" if since else ""
+        query = f"""
+        SELECT {top}c.id, c.role, c.content, c.timestamp, c.citations
+        FROM c
+        WHERE c.type = 'message'{after}
+        ORDER BY c.type ASC, c.timestamp DESC
+        """
+        
+        parameters = [{"name": "@limit", "value": limit}] if limit else []
+        if since:
+            parameters.append({"name": "@since", "value": since})
+        items = self.container.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=[user_id, conversation_id],
+            populate_index_metrics=settings.cosmos_index_metrics
+        )
+        messages = [item async for item in items]
+        messages.reverse()
+        return messages
+    
+    async def get_compact_history(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limit: int = 4
+    ) -> Optional[Dict]:
+        """
+        Rolling summary and last `limit` messages of a conversation, for the query path.
+        
+        A single point read of the header when its compact state covers every
+        message. While compaction is behind (or for legacy conversations) the
+        recent messages are queried instead. Returns None if the conversation
+        does not exist.
+        """
+        header = await self.get_conversation_header(user_id, conversation_id)
+        if header is None:
+            return None
+        
+        if header.get("compactedCount", -1) >= header.get("messageCount", 0):
+            messages = header.get("recentMessages", [])[-limit:]
+        elif not self.itemized and "messages" in header:
+            messages = header["messages"][-limit:]
+        else:
+            messages = await self.get_recent_messages(user_id, conversation_id, limit=limit)
+        
+        return {
+            "summary": header.get("summary"),
+            "messages": messages
+        }
+    
+    async def get_conversation_header(self, user_id: str, conversation_id: str) -> Optional[Dict]:
+        """Point read of the conversation item (the header, in "items" mode)."""
         try:
-            item = self.container.read_item(
+            return await self.container.read_item(
                 item=conversation_id,
                 partition_key=[user_id, conversation_id]
             )
-            return item
         except exceptions.CosmosResourceNotFoundError:
             return None
         except exceptions.CosmosHttpResponseError as e:
-            logger.error(f"Failed to get conversation: {str(e)}")
+            logger.error(f"Failed to read conversation header: {str(e)}")
+            raise
+    
+    async def get_messages_since(self, user_id: str, conversation_id: str, since: Optional[str] = None) -> List[Dict]:
+        """Messages newer than the `since` timestamp (all messages if None), oldest first."""
+        return await self._query_messages(user_id, conversation_id, since=since)
+    
+    async def save_compaction(self, user_id: str, conversation_id: str, state: Dict):
+        """
+        Set the compact history fields on the header in one patch.
+        
+        Only the given fields are written, so the patch never conflicts with
+        turns appended concurrently (which patch updatedAt and messageCount).
+        """
+        try:
+            await self.container.patch_item(
+                item=conversation_id,
+                partition_key=[user_id, conversation_id],
+                patch_operations=[
+                    {"op": "set", "path": f"/{field}", "value": value}
+                    for field, value in state.items()
+                ]
+            )
+        except exceptions.CosmosHttpResponseError as e:
+            logger.error(f"Failed to save compacted history: {str(e)}")
+            raise
+    
+    async def save_turn(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str] = None,
+        create: bool = False
+    ) -> bool:
+        """
+        Persist all messages of a turn in a single write.
+        
+        With `create`, the conversation header is created in the same batch.
+        Messages carry their own ids and timestamps (assigned when the turn was
+        journaled), so a turn replayed after a lost acknowledgement is a no-op:
+        the header is only created if absent, and the header patch of an
+        existing conversation only applies if the header's lastTurnId is not
+        this turn. Either condition failing means the (atomic) batch was
+        already committed, so messageCount is never incremented twice and a
+        replay never overwrites fields written by compaction since.
+        
+        Returns True if the turn was written, False if it had already been saved.
+        """
+        partition_key = [user_id, conversation_id]
+        updated_at = messages[-1]["timestamp"]
+        turn_id = messages[0]["id"]  # Stable across replays of the turn
+        
+        try:
+            if not self.itemized:
+                return await self._save_turn_embedded(user_id, conversation_id, messages, title, create)
+            
+            operations = []
+            if create:
+                operations.append(("create", ({
+                    "id": conversation_id,
+                    "userId": user_id,
+                    "conversationId": conversation_id,
+                    "title": title or "New Conversation",
+                    "createdAt": messages[0]["timestamp"],
+                    "updatedAt": updated_at,
+                    "messageCount": len(messages),
+                    "lastTurnId": turn_id,
+                    "type": "conversation"
+                },)))
+            
+            for message in messages:
+                operations.append(("upsert", ({
+                    **message,
+                    "userId": user_id,
+                    "conversationId": conversation_id,
+                    "type": "message"
+                },)))
+            
+            if not create:
+                operations.append(("patch", (conversation_id, [
+                    {"op": "set", "path": "/updatedAt", "value": updated_at},
+                    {"op": "incr", "path": "/messageCount", "value": len(messages)},
+                    {"op": "set", "path": "/lastTurnId", "value": turn_id}
+                ]), {"filter_predicate": f"FROM c WHERE NOT IS_DEFINED(c.lastTurnId) OR c.lastTurnId != '{turn_id}'"}))
+            
+            try:
+                await self.container.execute_item_batch(
+                    batch_operations=operations,
+                    partition_key=partition_key
+                )
+            except exceptions.CosmosBatchOperationError as e:
+                header_index, already_saved_status = (0, 409) if create else (len(operations) - 1, 412)
+                if e.error_index == header_index and e.status_code == already_saved_status:
+                    logger.info(f"Turn {turn_id} of conversation {conversation_id} was already saved")
+                    return False
+                raise
+            return True
+        
+        except exceptions.CosmosHttpResponseError as e:
+            logger.error(f"Failed to save turn: {str(e)}")
             raise
     
-    async def list_conversations(self, user_id: str, limit: int = 20) -> List[Dict]:
-        """List all conversations for a user (most recent first)."""
+    async def _save_turn_embedded(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict],
+        title: Optional[str],
+        create: bool
+    ) -> bool:
+        """Legacy layout: one read-modify-write of the conversation document per turn."""
+        try:
+            item = await self.container.read_item(
+                item=conversation_id,
+                partition_key=[user_id, conversation_id]
+            )
+        except exceptions.CosmosResourceNotFoundError:
+            if not create:
+                raise
+            item = {
+                "id": conversation_id,
+                "userId": user_id,
+                "conversationId": conversation_id,
+                "title": title or "New Conversation",
+                "createdAt": messages[0]["timestamp"],
+                "messages": [],
+                "type": "conversation"
+            }
+        
+        existing_ids = {message["id"] for message in item["messages"]}
+        added = [m for m in messages if m["id"] not in existing_ids]
+        if not added:
+            logger.info(f"Turn {messages[0]['id']} of conversation {conversation_id} was already saved")
+            return False
+        item["messages"].extend(added)
+        item["updatedAt"] = messages[-1]["timestamp"]
+        
+        if "_etag" in item:
+            await self.container.replace_item(
+                item=conversation_id,
+                body=item,
+                etag=item["_etag"],
+                match_condition=MatchConditions.IfNotModified
+            )
+        else:
+            await self.container.create_item(body=item)
+        return True
+    
+    async def migrate_conversation(self, user_id: str, conversation_id: str) -> Dict:
+        """
+        Split a legacy single-document conversation into header + message items.
+        
+        Message items are upserted with their original ids, so a migration that
+        is interrupted can simply be re-run. The header replace is conditioned on
+        the ETag read at the start; if another writer changed the document in the
+        meantime the migration fails and leaves the document untouched.
+        
+        Returns the migrated header item.
+        """
+        item = await self.container.read_item(
+            item=conversation_id,
+            partition_key=[user_id, conversation_id]
+        )
+        if "messages" not in item:
+            return item
+        
+        messages = item.pop("messages")
+        partition_key = [user_id, conversation_id]
+        
+        # Transactional batches are limited to 100 operations
+        for start in range(0, len(messages), MIGRATION_BATCH_SIZE):
+            await self.container.execute_item_batch(
+                batch_operations=[
+                    ("upsert", ({
+                        **message,
+                        "userId": user_id,
+                        "conversationId": conversation_id,
+                        "type": "message"
+                    },))
+                    for message in messages[start:start + MIGRATION_BATCH_SIZE]
+                ],
+                partition_key=partition_key
+            )
+        
+        item["messageCount"] = item.get("messageCount", 0) + len(messages)
+        item.setdefault("updatedAt", item.get("createdAt"))
+        header = {k: v for k, v in item.items() if not k.startswith("_")}
+        
+        header = await self.container.replace_item(
+            item=conversation_id,
+            body=header,
+            etag=item["_etag"],
+            match_condition=MatchConditions.IfNotModified
+        )
+        logger.info(f"Migrated conversation {conversation_id} ({len(messages)} messages) to itemized storage")
+        return header
+    
+    async def migrate_legacy_conversations(self) -> int:
+        """Migrate every legacy single-document conversation. Returns the number migrated."""
         query = """
-        SELECT c.id, c.conversationId, c.title, c.createdAt, c.updatedAt
+        SELECT c.userId, c.conversationId
+        FROM c
+        WHERE c.type = 'conversation' AND IS_DEFINED(c.messages)
+        """
+        
+        migrated = 0
+        async for row in self.container.query_items(query=query):
+            try:
+                await self.migrate_conversation(row["userId"], row["conversationId"])
+                migrated += 1
+            except exceptions.CosmosHttpResponseError as e:
+                logger.error(f"Failed to migrate conversation {row['conversationId']}: {str(e)}")
+        
+        return migrated
+    
+    async def list_conversations(
+        self,
+        user_id: str,
+        page_size: int = 20,
+        continuation: Optional[str] = None
+    ) -> Dict:
+        """
+        One page of a user's conversation headers (most recently updated first).
+        
+        Pass the returned `continuation` to get the next page. The ORDER BY
+        lists every composite index path, (userId, type, updatedAt DESC), so
+        the index serves the sort; an ORDER BY on updatedAt alone would not
+        use it.
+        """
+        query = """
+        SELECT c.id, c.conversationId, c.title, c.createdAt, c.updatedAt, c.messageCount
         FROM c
         WHERE c.userId = @userId AND c.type = 'conversation'
-        ORDER BY c.updatedAt DESC
-        OFFSET 0 LIMIT @limit
+        ORDER BY c.userId ASC, c.type ASC, c.updatedAt DESC
         """
         
         try:
-            items = list(self.container.query_items(
-                query=query,
-                parameters=[
-                    {"name": "@userId", "value": user_id},
-                    {"name": "@limit", "value": limit}
-                ],
-                partition_key=user_id,  # Scoped to user partition
-                enable_cross_partition_query=False
-            ))
-            return items
+            conversations, next_continuation = await self._query_page(
+                query,
+                [{"name": "@userId", "value": user_id}],
+                user_id,  # Scoped to user partition
+                page_size,
+                continuation
+            )
         except exceptions.CosmosHttpResponseError as e:
+            # Not an empty page: callers (and the list cache) must not mistake a failure for "no conversations"
             logger.error(f"Failed to list conversations: {str(e)}")
-            return []
+            raise
+        
+        return {
+            "conversations": conversations,
+            "continuation": next_continuation
+        }
 
 cosmos_client = CosmosDBClient()
@@ -1,30 +1,61 @@
 from msal import ConfidentialClientApplication
-from typing import Optional
+from typing import Dict, Optional
+import asyncio
 import logging
+import time
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+class TokenUnavailableError(Exception):
+    """Raised when no valid Graph token is available."""
+
 class M365AuthClient:
     """Handles Microsoft 365 authentication using app-only (client credentials) flow."""
     
     def __init__(self):
         self.authority = f"https://login.microsoftonline.com/{settings.azure_tenant_id}"
         self.scopes = ["https://graph.microsoft.com/.default"]
+        self._app: Optional[ConfidentialClientApplication] = None
+    
+    @property
+    def app(self) -> ConfidentialClientApplication:
+        # Created on first use: MSAL fetches the tenant's OpenID configuration on
+        # construction, which would otherwise make importing the app need network
+        if self._app is None:
+            self._app = ConfidentialClientApplication(
+                client_id=settings.azure_client_id,
+                client_credential=settings.azure_client_secret,
+                authority=self.authority
+            )
+        return self._app
+    
+    @property
+    def permission_context(self) -> str:
+        """
+        Identity whose permissions trim retrieval results.
         
-        self.app = ConfidentialClientApplication(
-            client_id=settings.azure_client_id,
-            client_credential=settings.azure_client_secret,
-            authority=self.authority
-        )
+        Tokens are app-only, so every caller sees the same documents; results
+        can be shared across callers with the same permission context.
+        """
+        return f"app:{settings.azure_client_id}"
+    
+    def acquire_token(self) -> Dict:
+        """
+        Acquire a token via MSAL (blocking). Returns the raw MSAL result, which
+        contains either 'access_token' and 'expires_in' or 'error_description'.
+        """
+        result = self.app.acquire_token_silent(self.scopes, account=None)
+        
+        if not result:
+            result = self.app.acquire_token_for_client(scopes=self.scopes)
+        
+        return result
     
     def get_access_token(self) -> Optional[str]:
         """Get access token for Microsoft Graph API."""
         try:
-            result = self.app.acquire_token_silent(self.scopes, account=None)
-            
-            if not result:
-                result = self.app.acquire_token_for_client(scopes=self.scopes)
+            result = self.acquire_token()
             
             if "access_token" in result:
                 return result["access_token"]
@@ -36,4 +67,115 @@ class M365AuthClient:
             logger.error(f"Authentication error: {str(e)}")
             return None
 
+class AsyncTokenProvider:
+    """
+    Keeps a Graph access token in memory for the request path.
+    
+    A background task refreshes the token `refresh_margin` seconds before it
+    expires, so requests normally just read the cached value. If a request
+    does need a token, only one acquisition runs at a time and concurrent
+    callers wait for it. After a failed acquisition the error is cached for
+    `error_ttl` seconds and callers fail fast instead of queueing on an
+    identity endpoint that is down.
+    """
+    
+    def __init__(
+        self,
+        auth: M365AuthClient,
+        refresh_margin: float = 240.0,
+        error_ttl: float = 10.0,
+        max_retry_delay: float = 60.0
+    ):
+        self.auth = auth
+        self.refresh_margin = refresh_margin
+        self.error_ttl = error_ttl
+        self.max_retry_delay = max_retry_delay
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._error: Optional[str] = None
+        self._error_until = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Acquire the first token and start background refresh. Called from the FastAPI lifespan."""
+        if self._task is not None:
+            return
+        
+        try:
+            await self._refresh()
+        except TokenUnavailableError:
+            pass  # Logged in _refresh; the refresh loop keeps retrying
+        self._task = asyncio.create_task(self._refresh_loop())
+    
+    async def close(self):
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def get_token(self) -> str:
+        """Return a valid access token, acquiring one only if the cache is empty or expired."""
+        if self._valid():
+            return self._token
+        
+        if self._error and time.monotonic() < self._error_until:
+            raise TokenUnavailableError(self._error)
+        
+        return await self._refresh()
+    
+    def _valid(self) -> bool:
+        # Keep a small safety window so a token never expires in flight
+        return self._token is not None and time.monotonic() < self._expires_at - 30
+    
+    async def _refresh(self, force: bool = False) -> str:
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not force and self._valid():
+                return self._token
+            
+            try:
+                result = await asyncio.to_thread(self.auth.acquire_token)
+            except Exception as e:
+                result = {"error_description": str(e)}
+            
+            if "access_token" not in result:
+                self._error = result.get("error_description") or "Token acquisition failed"
+                self._error_until = time.monotonic() + self.error_ttl
+                logger.error(f"Token acquisition failed: {self._error}")
+                raise TokenUnavailableError(self._error)
+            
+            self._token = result["access_token"]
+            self._expires_at = time.monotonic() + float(result.get("expires_in", 3600))
+            self._error = None
+            return self._token
+    
+    async def _refresh_loop(self):
+        retry_delay = 1.0
+        while True:
+            if self._valid():
+                delay = max(self._expires_at - self.refresh_margin - time.monotonic(), 0)
+                # MSAL may hand back the same cached token; don't spin on it
+                delay = max(delay, retry_delay)
+            else:
+                delay = retry_delay
+            await asyncio.sleep(delay)
+            
+            previous_expiry = self._expires_at
+            try:
+                await self._refresh(force=True)
+                retry_delay = 1.0 if self._expires_at > previous_expiry else min(retry_delay * 2, self.max_retry_delay)
+            except TokenUnavailableError:
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+
 auth_client = M365AuthClient()
+token_provider = AsyncTokenProvider(
+    auth_client,
+    refresh_margin=settings.token_refresh_margin,
+    error_ttl=settings.token_error_ttl
+)
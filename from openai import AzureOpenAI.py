@@ -1,27 +1,105 @@
-from openai import AzureOpenAI
-from typing import List
+import openai
+from openai import AsyncAzureOpenAI
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
 import logging
 from config import settings
+from backend import metrics
+from backend.embeddings import EmbeddingCache, EmbeddingService
+from backend.prompt import PromptBuilder, TokenCounter
+from backend.ratelimit import rate_limiters
 from backend.retrieval import RetrievalResult
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = """You are an enterprise knowledge assistant. Follow these rules strictly:
+
+1. Answer ONLY using the provided context documents
+2. If the answer is not in the documents, respond: "I don't have that information in the available documents."
+3. Always cite your sources using [1], [2], etc.
+4. Be concise and professional
+5. Do not make assumptions or use external knowledge"""
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an enterprise knowledge assistant.
+Rewrite the summary so it also covers the new messages. Keep the topics, facts, names, numbers and open
+questions that later questions may refer to, and drop pleasantries. Reply with the summary only, as plain prose."""
+
 class LLMClient:
-    """Handles Azure OpenAI interactions for grounded response generation."""
+    """
+    Handles Azure OpenAI interactions for grounded response generation.
+    
+    Uses the async client so completions never block the event loop. A
+    semaphore bounds in-flight completions per process, and every call
+    carries its own timeout. Prompts are assembled by a token-budgeted
+    PromptBuilder; its per-section token counts are returned under
+    usage["prompt"].
+    
+    Completions are paced by the deployment's adaptive rate limiter, which
+    reads the rate-limit headers of every response; a throttled call is
+    retried after the limiter's pause instead of by the SDK.
+    
+    Prompt build and completion time, time to first token (streaming) and
+    token usage are recorded in backend.metrics.
+    
+    summarize_conversation() updates the rolling conversation summary for
+    the conversation compactor, through the same limits.
+    """
     
     def __init__(self):
-        self.client = AzureOpenAI(
+        self.client = AsyncAzureOpenAI(
             azure_endpoint=settings.azure_openai_endpoint,
             api_key=settings.azure_openai_api_key,
-            api_version=settings.azure_openai_api_version
+            api_version=settings.azure_openai_api_version,
+            max_retries=0
         )
         self.deployment = settings.azure_openai_deployment
+        self.embedding_deployment = settings.azure_openai_embedding_deployment
+        self.timeout = settings.llm_timeout
+        self.max_tokens = settings.llm_max_tokens
+        self._semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+        self.rate_limiter = rate_limiters.get(
+            f"openai:{self.deployment}",
+            rate=settings.openai_rate_limit,
+            min_rate=settings.rate_limit_min,
+            max_rate=settings.openai_rate_limit_max
+        )
+        self.max_attempts = settings.llm_max_attempts
+        self.prompt_builder = PromptBuilder(
+            SYSTEM_PROMPT,
+            token_budget=settings.llm_token_budget,
+            max_completion_tokens=settings.llm_max_tokens,
+            chunk_max_tokens=settings.prompt_chunk_max_tokens,
+            history_turn_max_tokens=settings.prompt_history_turn_max_tokens,
+            summary_max_tokens=settings.conversation_summary_max_tokens,
+            counter=TokenCounter(settings.openai_model)
+        )
+        self.embeddings = EmbeddingService(
+            self.client,
+            self.embedding_deployment,
+            cache=EmbeddingCache(
+                settings.embedding_cache_path,
+                max_age=settings.embedding_cache_max_age,
+                max_rows=settings.embedding_cache_max_rows
+            ) if settings.embedding_cache_enabled else None,
+            batch_size=settings.embedding_batch_size,
+            batch_max_tokens=settings.embedding_batch_max_tokens,
+            max_concurrency=settings.embedding_max_concurrency,
+            max_retries=settings.embedding_max_retries,
+            timeout=self.timeout,
+            rate_limiter=rate_limiters.get(
+                f"openai:{self.embedding_deployment}",
+                rate=settings.embedding_rate_limit,
+                min_rate=settings.rate_limit_min,
+                max_rate=settings.embedding_rate_limit_max
+            )
+        )
     
-    def generate_grounded_response(
+    async def generate_grounded_response(
         self,
         query: str,
         retrieved_chunks: List[RetrievalResult],
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        conversation_summary: Optional[str] = None
     ) -> Dict[str, any]:
         """
         Generate a response grounded in retrieved documents.
@@ -29,57 +107,36 @@ class LLMClient:
         Returns:
             Dict with 'answer', 'citations', and 'diagnostic_info'
         """
-        # Build context from retrieved chunks
-        context = self._build_context(retrieved_chunks)
-        
-        # Build system prompt with strict grounding rules
-        system_prompt = """You are an enterprise knowledge assistant. Follow these rules strictly:
-
-1. Answer ONLY using the provided context documents
-2. If the answer is not in the documents, respond: "I don't have that information in the available documents."
-3. Always cite your sources using [1], [2], etc.
-4. Be concise and professional
-5. Do not make assumptions or use external knowledge"""
-        
-        # Build messages
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
-        ]
-        
-        # Add conversation history if provided
-        if conversation_history:
-            messages = [messages[0]] + conversation_history[-4:] + [messages[1]]
+        messages, chunks, prompt_usage = self._build_messages(
+            query,
+            retrieved_chunks,
+            conversation_history,
+            conversation_summary
+        )
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=messages,
-                temperature=0.2,  # Low temperature for factual responses
-                max_tokens=800,
-                top_p=0.95
-            )
+            async with self._semaphore:
+                with metrics.stage("llm"):
+                    response = await self._create_completion(
+                        model=self.deployment,
+                        messages=messages,
+                        temperature=0.2,  # Low temperature for factual responses
+                        max_tokens=self.max_tokens,
+                        top_p=0.95,
+                        timeout=self.timeout
+                    )
             
             answer = response.choices[0].message.content
-            
-            # Build citations
-            citations = [
-                {
-                    "number": idx + 1,
-                    "title": chunk.title,
-                    "url": chunk.url,
-                    "snippet": chunk.content[:200]
-                }
-                for idx, chunk in enumerate(retrieved_chunks)
-            ]
+            metrics.record_tokens(self.deployment, response.usage.prompt_tokens, response.usage.completion_tokens)
             
             return {
                 "answer": answer,
-                "citations": citations,
+                "citations": self._build_citations(chunks),
                 "usage": {
                     "prompt_tokens": response.usage.prompt_tokens,
                     "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
+                    "total_tokens": response.usage.total_tokens,
+                    "prompt": prompt_usage
                 }
             }
             
@@ -87,13 +144,149 @@ class LLMClient:
             logger.error(f"LLM generation failed: {str(e)}")
             raise
     
-    def _build_context(self, chunks: List[RetrievalResult]) -> str:
-        """Build formatted context string from retrieval results."""
-        context_parts = []
+    async def stream_grounded_response(
+        self,
+        query: str,
+        retrieved_chunks: List[RetrievalResult],
+        conversation_history: List[Dict] = None,
+        conversation_summary: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Stream a grounded response token by token.
+        
+        Yields a 'citations' event first (known before generation starts),
+        then one 'delta' event per content fragment, then a final 'done'
+        event carrying the full answer and the prompt token breakdown. The
+        concurrency slot is held until the stream is exhausted.
+        """
+        messages, chunks, prompt_usage = self._build_messages(
+            query,
+            retrieved_chunks,
+            conversation_history,
+            conversation_summary
+        )
+        citations = self._build_citations(chunks)
         
-        for idx, chunk in enumerate(chunks, 1):
-            context_parts.append(
-                f"[{idx}] {chunk.title}\n{chunk.content}\nSource: {chunk.url}\n"
+        yield {"type": "citations", "citations": citations}
+        
+        try:
+            async with self._semaphore:
+                with metrics.stage("llm") as timer:
+                    stream = await self._create_completion(
+                        model=self.deployment,
+                        messages=messages,
+                        temperature=0.2,
+                        max_tokens=self.max_tokens,
+                        top_p=0.95,
+                        stream=True,
+                        timeout=self.timeout
+                    )
+                    
+                    answer_parts = []
+                    async for chunk in stream:
+                        # Azure sends a leading chunk with prompt filter results and no choices
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not answer_parts:
+                                metrics.LLM_TTFT_SECONDS.observe(timer.elapsed())
+                            answer_parts.append(delta)
+                            yield {"type": "delta", "content": delta}
+            
+            answer = "".join(answer_parts)
+            # Streamed chunks carry no usage; count with the prompt builder's tokenizer
+            metrics.record_tokens(
+                self.deployment,
+                prompt_usage["prompt_tokens"],
+                self.prompt_builder.counter.count(answer)
             )
+            yield {
+                "type": "done",
+                "answer": answer,
+                "citations": citations,
+                "usage": {"prompt": prompt_usage}
+            }
+            
+        except Exception as e:
+            logger.error(f"LLM streaming failed: {str(e)}")
+            raise
+    
+    async def _create_completion(self, **kwargs):
+        """Chat completion paced by the rate limiter, retrying throttled attempts."""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.rate_limiter.acquire()
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(**kwargs)
+            except openai.APIStatusError as e:
+                self.rate_limiter.observe(e.status_code, e.response.headers)
+                if e.status_code not in self.rate_limiter.THROTTLE_STATUS or attempt == self.max_attempts:
+                    raise
+                metrics.RETRIES.labels(self.rate_limiter.name).inc()
+                logger.warning(f"Completion attempt {attempt} throttled; retrying")
+                continue
+            
+            self.rate_limiter.observe(raw.status_code, raw.headers)
+            return raw.parse()
+    
+    async def summarize_conversation(self, summary: Optional[str], messages: List[Dict]) -> str:
+        """
+        Fold `messages` (oldest first) into the rolling conversation summary.
+        
+        Each message is capped at the per-turn history limit, and the reply
+        at CONVERSATION_SUMMARY_MAX_TOKENS.
+        """
+        counter = self.prompt_builder.counter
+        transcript = "\n".join(
+            f"{message['role']}: {counter.truncate(message['content'], settings.prompt_history_turn_max_tokens)}"
+            for message in messages
+        )
+        
+        async with self._semaphore:
+            with metrics.stage("summary"):
+                response = await self._create_completion(
+                    model=self.deployment,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"}
+                    ],
+                    temperature=0,
+                    max_tokens=settings.conversation_summary_max_tokens,
+                    timeout=self.timeout
+                )
+        
+        metrics.record_tokens(self.deployment, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content.strip()
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with the embedding deployment (batched and cached)."""
+        return await self.embeddings.embed(texts)
+    
+    def _build_messages(
+        self,
+        query: str,
+        retrieved_chunks: List[RetrievalResult],
+        conversation_history: List[Dict] = None,
+        conversation_summary: Optional[str] = None
+    ) -> Tuple[List[Dict], List[RetrievalResult], Dict]:
+        """
+        Assemble the chat messages: system prompt, conversation summary, recent history, grounded question.
         
-        return "\n---\n".join(context_parts)
+        Returns the messages, the chunks that fit in the token budget (citations
+        must be numbered from these) and the prompt token breakdown.
+        """
+        history = (conversation_history or [])[-settings.history_max_messages:]
+        with metrics.stage("prompt_build"):
+            return self.prompt_builder.build(query, retrieved_chunks, history, conversation_summary)
+    
+    def _build_citations(self, chunks: List[RetrievalResult]) -> List[Dict]:
+        """Build citation entries matching the [n] markers in the context."""
+        return [
+            {
+                "number": idx + 1,
+                "title": chunk.title,
+                "url": chunk.url,
+                "snippet": chunk.content[:200]
+            }
+            for idx, chunk in enumerate(chunks)
+        ]
@@ -1,8 +1,13 @@
+import asyncio
 import httpx
 import logging
 from typing import List, Dict, Optional
 from pydantic import BaseModel
-from tenacity import retry, stop_after_attempt, wait_exponential
+from backend import metrics
+from backend.cache import SingleFlight, TTLCache
+from backend.http_pool import HttpClientPool
+from backend.ratelimit import AdaptiveRateLimiter
+from backend.resilience import CircuitBreaker, Hedger
 
 logger = logging.getLogger(__name__)
 
@@ -14,20 +19,58 @@ class RetrievalResult(BaseModel):
     score: Optional[float] = None
 
 class M365RetrievalClient:
-    """Handles retrieval from Microsoft 365 Copilot Retrieval API."""
+    """
+    Handles retrieval from Microsoft 365 Copilot Retrieval API.
+    
+    Requests go through the shared Graph connection pool when one is provided;
+    the access token is passed per call so a single client serves every request.
+    
+    Results are cached per (query, top, site_filter) for a short TTL, and
+    identical searches that arrive while one is in flight share its result.
+    Tokens are app-only, so cached results are valid for every caller.
+    
+    Graph calls are paced by a shared adaptive rate limiter: throttled
+    responses pause all callers for the Retry-After period and lower the
+    rate, and retries queue behind the limiter instead of firing blindly.
+    
+    A circuit breaker stops calling Graph after repeated failures; while it
+    is open, searches are answered from expired cache entries or the
+    `fallback` client (e.g. the local index). An optional Hedger re-sends
+    calls that are slower than the recent p95 to cut tail latency; the
+    duplicate takes its own rate limiter token or is not sent.
+    """
     
     BASE_URL = "https://graph.microsoft.com/v1.0"
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
     
-    def __init__(self, access_token: str):
-        self.headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+    def __init__(
+        self,
+        pool: Optional[HttpClientPool] = None,
+        cache_ttl: float = 300.0,
+        cache_max_entries: int = 2048,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        max_attempts: int = 3,
+        request_timeout: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+        hedger: Optional[Hedger] = None,
+        cache_stale_ttl: float = 0.0,
+        fallback=None  # Any client with a compatible search_content
+    ):
+        self.pool = pool
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter("graph-search", rate=20.0)
+        self.max_attempts = max_attempts
+        self.request_timeout = request_timeout
+        self.breaker = breaker or CircuitBreaker("graph-search")
+        self.hedger = hedger
+        self.fallback = fallback
+        self.cache = TTLCache(max_entries=cache_max_entries, ttl=cache_ttl, stale_ttl=cache_stale_ttl)
+        self.single_flight = SingleFlight()
+        self.fallbacks = {"stale_cache": 0, "fallback_client": 0, "empty": 0}
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     async def search_content(
         self,
         query: str,
+        access_token: str,
         top: int = 5,
         site_filter: Optional[str] = None
     ) -> List[RetrievalResult]:
@@ -36,9 +79,68 @@ class M365RetrievalClient:
         
         Args:
             query: User's search query
+            access_token: Graph bearer token for this call
             top: Maximum number of results (5-10 recommended)
             site_filter: Optional SharePoint site URL filter
         """
+        key = (" ".join(query.lower().split()), top, site_filter)
+        
+        cached = self.cache.get(key)
+        metrics.record_cache("retrieval", hits=int(cached is not None), misses=int(cached is None))
+        if cached is not None:
+            return cached
+        
+        if not self.breaker.allow():
+            return await self._fallback(key, query, access_token, top, site_filter)
+        
+        async def fetch() -> List[RetrievalResult]:
+            results = await self._search(query, access_token, top, site_filter)
+            # Empty results may come from a swallowed error; don't pin them in the cache
+            if results:
+                self.cache.set(key, results)
+            return results
+        
+        return await self.single_flight.do(key, fetch)
+    
+    def stats(self) -> Dict:
+        return {
+            **self.cache.stats(),
+            "coalesced": self.single_flight.coalesced,
+            "breaker": self.breaker.stats(),
+            "hedging": self.hedger.stats() if self.hedger else None,
+            "fallbacks": dict(self.fallbacks)
+        }
+    
+    async def _fallback(
+        self,
+        key: tuple,
+        query: str,
+        access_token: str,
+        top: int,
+        site_filter: Optional[str]
+    ) -> List[RetrievalResult]:
+        """Results to serve while the Graph circuit is open."""
+        stale = self.cache.get_stale(key)
+        if stale is not None:
+            self.fallbacks["stale_cache"] += 1
+            return stale
+        
+        if self.fallback is not None:
+            self.fallbacks["fallback_client"] += 1
+            return await self.fallback.search_content(query, access_token, top, site_filter)
+        
+        self.fallbacks["empty"] += 1
+        logger.warning("Graph search circuit open and no fallback results available")
+        return []
+    
+    async def _search(
+        self,
+        query: str,
+        access_token: str,
+        top: int,
+        site_filter: Optional[str]
+    ) -> List[RetrievalResult]:
+        """Uncached call to the Graph /search/query endpoint."""
         try:
             # Build KQL filter if site specified
             kql_filter = f"site:{site_filter}" if site_filter else None
@@ -60,32 +162,78 @@ class M365RetrievalClient:
             if kql_filter:
                 request_body["requests"][0]["query"]["kql"] = kql_filter
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.BASE_URL}/search/query",
-                    headers=self.headers,
-                    json=request_body
-                )
-                
-                # Log diagnostics on errors or high latency
-                if response.status_code != 200 or response.elapsed.total_seconds() > 2:
-                    logger.warning(f"Search diagnostics - Status: {response.status_code}, "
-                                 f"Latency: {response.elapsed.total_seconds():.2f}s")
-                
-                response.raise_for_status()
-                data = response.json()
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+            
+            for attempt in range(1, self.max_attempts + 1):
+                await self.rate_limiter.acquire()
+                if self.hedger is not None:
+                    response = await self.hedger.run(
+                        lambda: self._post(headers, request_body),
+                        self.rate_limiter,
+                        accept=lambda r: r.status_code not in self.RETRYABLE_STATUS
+                    )
+                else:
+                    response = await self._post(headers, request_body)
+                self.rate_limiter.observe(response.status_code, response.headers)
                 
-                return self._parse_results(data)
+                if response.status_code not in self.RETRYABLE_STATUS or attempt == self.max_attempts:
+                    break
                 
+                logger.warning(f"Search attempt {attempt} failed with {response.status_code}; retrying")
+                metrics.RETRIES.labels(self.rate_limiter.name).inc()
+                if response.status_code not in self.rate_limiter.THROTTLE_STATUS:
+                    # Server errors aren't throttling; back off without slowing other callers
+                    await asyncio.sleep(min(2 ** attempt, 10))
+            
+            # Log diagnostics on errors or high latency
+            if response.status_code != 200 or response.elapsed.total_seconds() > 2:
+                logger.warning(f"Search diagnostics - Status: {response.status_code}, "
+                             f"Latency: {response.elapsed.total_seconds():.2f}s")
+            
+            response.raise_for_status()
+            data = response.json()
+            self.breaker.record_success()
+            
+            return self._parse_results(data)
+            
         except httpx.HTTPStatusError as e:
+            if e.response.status_code in self.RETRYABLE_STATUS:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()  # Graph answered; the request itself was bad
             if e.response.status_code == 429:
-                logger.error("Rate limit hit - implement retry-after logic")
+                logger.error(f"Search still throttled after {self.max_attempts} attempts")
             logger.error(f"Search failed: {str(e)}")
             raise
+        except httpx.TransportError as e:
+            # Timeouts and connection failures
+            self.breaker.record_failure()
+            logger.error(f"Search transport error: {type(e).__name__} {str(e)}")
+            return []
         except Exception as e:
+            self.breaker.record_failure()
             logger.error(f"Unexpected error during search: {str(e)}")
             return []
     
+    async def _post(self, headers: Dict, request_body: Dict) -> httpx.Response:
+        if self.pool is not None:
+            return await self.pool.client.post(
+                f"{self.BASE_URL}/search/query",
+                headers=headers,
+                json=request_body,
+                timeout=self.request_timeout
+            )
+        
+        async with httpx.AsyncClient(timeout=self.request_timeout) as client:
+            return await client.post(
+                f"{self.BASE_URL}/search/query",
+                headers=headers,
+                json=request_body
+            )
+    
     def _parse_results(self, data: Dict) -> List[RetrievalResult]:
         """Parse Microsoft Graph search response into structured results."""
         results = []
@@ -1,17 +1,66 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import logging
-from backend.auth import auth_client
-from backend.retrieval import M365RetrievalClient
+import time
+from backend.auth import TokenUnavailableError, auth_client, token_provider as entra_token_provider
+from backend.compaction import ConversationCompactor
+from backend.conversation_cache import CachedConversationStore, etag_matches, page_etag
+from backend.http_pool import graph_pool
+from backend.jobs import JobQueue, JobQueueFullError, JobStore
+from backend.retrieval import M365RetrievalClient, RetrievalResult
 from backend.llm import LLMClient
-from backend.cosmos import cosmos_client
+from backend.cosmos import InvalidContinuationError, cosmos_client
+from backend import demo, metrics
+from backend.persistence import conversation_age, new_conversation_id, new_messages, turn_writer
+from backend.pipeline import StageGraph
+from backend.ratelimit import TokenBucket, rate_limiters
+from backend.resilience import CircuitBreaker, Hedger
+from backend.rerank import Reranker
+from backend.semantic_cache import SemanticCache
+from backend.vector_index import LocalRetrievalClient, VectorIndex
+from config import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="ADIC SharePoint RAG API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream connections on startup and release them on shutdown."""
+    if settings.otel_exporter_endpoint:
+        metrics.configure_tracing(settings.otel_exporter_endpoint, settings.otel_service_name)
+    await graph_pool.start()
+    await token_provider.start()
+    await conversation_store.start()
+    await llm_client.embeddings.start()
+    if settings.demo_mode:
+        await retrieval_client.start()
+    elif settings.retrieval_backend == "local" or settings.retrieval_fallback_local:
+        vector_index.open()
+    if settings.persistence_write_behind:
+        await turn_writer.start()
+    if settings.conversation_compaction_enabled:
+        await compactor.start()
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.close()
+        await turn_writer.close(timeout=settings.persistence_drain_timeout)
+        await compactor.close()
+        vector_index.close()
+        await llm_client.embeddings.close()
+        await conversation_store.close()
+        await token_provider.close()
+        await graph_pool.close()
+        metrics.shutdown_tracing()
+
+app = FastAPI(title="ADIC SharePoint RAG API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -22,108 +71,620 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-llm_client = LLMClient()
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Open a span per request so stage spans are grouped into one trace."""
+    with metrics.span("request") as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if span is not None and route is not None:
+            span.update_name(f"{request.method} {route.path}")
+        return response
+
+# Demo mode swaps every upstream (Entra ID, Graph, Azure OpenAI, Cosmos DB) for a local stand-in
+if settings.demo_mode:
+    token_provider = demo.StaticTokenProvider()
+    llm_client = demo.ExtractiveAnswerGenerator()
+    conversation_backend = demo.InMemoryConversationStore()
+else:
+    token_provider = entra_token_provider
+    llm_client = LLMClient()
+    conversation_backend = cosmos_client
+# Writes go through the cache wrapper (including write-behind flushes) so cached conversation lists stay current
+conversation_store = CachedConversationStore(
+    conversation_backend,
+    page_size=settings.conversations_page_size,
+    max_users=settings.conversation_cache_max_users,
+    ttl=settings.conversation_cache_ttl
+)
+turn_writer.store = conversation_store
+compactor = ConversationCompactor(
+    conversation_store,
+    llm_client.summarize_conversation,
+    window=settings.history_max_messages,
+    workers=settings.compaction_workers
+)
+turn_writer.add_flush_listener(compactor.schedule)
+vector_index = VectorIndex(settings.vector_index_path)
+local_retrieval_client = LocalRetrievalClient(
+    vector_index,
+    llm_client.embed,
+    principals=[auth_client.permission_context],
+    nprobe=settings.vector_index_nprobe
+)
+if settings.demo_mode:
+    retrieval_client = demo.DemoRetrievalClient(
+        settings.demo_docs_path,
+        chunk_chars=settings.ingestion_chunk_chars,
+        chunk_overlap=settings.ingestion_chunk_overlap
+    )
+elif settings.retrieval_backend == "local":
+    retrieval_client = local_retrieval_client
+else:
+    retrieval_client = M365RetrievalClient(
+        graph_pool,
+        cache_ttl=settings.retrieval_cache_ttl,
+        cache_max_entries=settings.retrieval_cache_max_entries,
+        rate_limiter=rate_limiters.get(
+            "graph-search",
+            rate=settings.graph_rate_limit,
+            min_rate=settings.rate_limit_min,
+            max_rate=settings.graph_rate_limit_max
+        ),
+        request_timeout=settings.graph_search_timeout,
+        breaker=CircuitBreaker(
+            "graph-search",
+            failure_threshold=settings.graph_breaker_failure_threshold,
+            reset_timeout=settings.graph_breaker_reset_timeout
+        ),
+        hedger=Hedger(
+            budget=settings.graph_hedge_budget,
+            percentile=settings.graph_hedge_percentile
+        ) if settings.graph_hedging_enabled else None,
+        cache_stale_ttl=settings.retrieval_cache_stale_ttl,
+        fallback=local_retrieval_client if settings.retrieval_fallback_local else None
+    )
+reranker = Reranker(
+    embed_fn=llm_client.embed if settings.rerank_use_embeddings else None,
+    embedding_weight=settings.rerank_embedding_weight,
+    latency_budget=settings.rerank_latency_budget,
+    embedding_timeout=settings.rerank_embedding_timeout
+)
+semantic_cache = SemanticCache(
+    llm_client.embed,
+    threshold=settings.semantic_cache_threshold,
+    ttl=settings.semantic_cache_ttl,
+    max_entries=settings.semantic_cache_max_entries
+)
+# Shared by all batches in this process, so concurrent evaluation runs don't add up
+batch_semaphore = asyncio.Semaphore(settings.batch_concurrency)
+batch_limiter = TokenBucket(settings.batch_rate_limit, burst=settings.batch_concurrency)
+
+NO_RESULTS_ANSWER = "I couldn't find relevant information in the available documents."
 
 class QueryRequest(BaseModel):
     query: str
     conversation_id: Optional[str] = None
     user_id: str
+    site_filter: Optional[str] = None
     top_k: int = 5
 
 class QueryResponse(BaseModel):
     answer: str
     citations: List[dict]
     conversation_id: str
+    usage: Optional[Dict] = None  # Token counts, including the prompt breakdown
 
-@app.post("/api/query", response_model=QueryResponse)
-async def query_knowledge(request: QueryRequest):
-    """Main RAG endpoint: retrieval + generation."""
+class BatchQueryItem(BaseModel):
+    query: str
+    id: Optional[str] = None  # Echoed back, since results arrive in completion order
+    conversation_id: Optional[str] = None
+    site_filter: Optional[str] = None
+    top_k: int = 5
+
+class BatchQueryRequest(BaseModel):
+    user_id: str
+    queries: List[BatchQueryItem]
+    persist: bool = False  # Save each question and answer as a conversation
+    use_cache: bool = True  # Semantic cache lookups (disable to evaluate prompt or model changes)
+
+async def authenticate() -> str:
+    """Get a Microsoft Graph access token (normally served from memory)."""
     try:
-        # Step 1: Authenticate with M365
-        access_token = auth_client.get_access_token()
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Authentication failed")
-        
-        # Step 2: Retrieve relevant content
-        retrieval_client = M365RetrievalClient(access_token)
-        chunks = await retrieval_client.search_content(
-            query=request.query,
-            top=min(request.top_k, 10),  # Cap at 10
-            site_filter=request.site_f  # Cap at 10
-        
-        if not chunks:
-            return QueryResponse(
-                answer="I couldn't find relevant information in the available documents.",
-                citations=[],
-                conversation_id=request.conversation_id or "none"
-            )
-        
-        # Step 3: Get conversation history
-        conversation_history = None
-        if request.conversation_id:
-            conv = await cosmos_client.get_conversation(request.user_id, request.conversation_id)
-            if conv:
-                conversation_history = [
-                    {"role": msg["role"], "content": msg["content"]}
-                    for msg in conv.get("messages", [])
-                ]
-        
-        # Step 4: Generate grounded response
-        result = llm_client.generate_grounded_response(
-            query=request.query,
-            retrieved_chunks=chunks,
-            conversation_history=conversation_history
-        )
+        return await token_provider.get_token()
+    except TokenUnavailableError:
+        raise HTTPException(status_code=401, detail="Authentication failed")
+
+async def lookup_cached_answer(request: QueryRequest, use_cache: bool = True) -> Optional[Dict]:
+    """
+    Semantic cache stage. Returns the query embedding, its cache scope and the
+    cached answer on a hit, or None when the cache does not apply.
+    
+    Only first turns are served from cache: follow-up questions depend on
+    conversation history that the cache key does not capture.
+    """
+    if not (settings.semantic_cache_enabled and use_cache) or request.conversation_id:
+        return None
+    
+    try:
+        embedding = await semantic_cache.embed(request.query)
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup skipped: {str(e)}")
+        return None
+    
+    scope = SemanticCache.scope_key(request.site_filter, auth_client.permission_context, request.top_k)
+    hit = semantic_cache.lookup(embedding, scope)
+    metrics.record_cache("semantic", hits=int(hit is not None), misses=int(hit is None))
+    return {
+        "embedding": embedding,
+        "scope": scope,
+        "hit": hit
+    }
+
+def cached_answer(results: Dict) -> Optional[Dict]:
+    return (results.get("cache") or {}).get("hit")
+
+def remember_answer(results: Dict, answer: str, citations: List[Dict]):
+    """Store a freshly generated answer in the semantic cache."""
+    cache = results.get("cache")
+    if cache and not cache["hit"]:
+        semantic_cache.store(cache["embedding"], cache["scope"], {"answer": answer, "citations": citations})
+
+async def retrieve_chunks(request: QueryRequest, access_token: str) -> List[RetrievalResult]:
+    """
+    Retrieve relevant M365 content for the query.
+    
+    With re-ranking enabled, a larger candidate pool is fetched from Graph and
+    only the locally best `top_k` chunks are passed on.
+    """
+    top_k = min(request.top_k, 10)  # Cap at 10
+    
+    candidates = await retrieval_client.search_content(
+        query=request.query,
+        access_token=access_token,
+        top=max(settings.rerank_candidates, top_k) if settings.rerank_enabled else top_k,
+        site_filter=request.site_filter
+    )
+    
+    if not settings.rerank_enabled:
+        return candidates
+    return await reranker.rerank(request.query, candidates, top_k)
+
+async def load_history(request: QueryRequest) -> Optional[Dict]:
+    """
+    Load the compact history of the conversation, if continuing one: the
+    rolling summary of earlier turns and the most recent messages.
+    
+    This reads the conversation header only; the full transcript is never
+    loaded on the query path. An unknown conversation is a 404, before
+    anything is generated or journaled, unless it was started within the
+    write-behind grace period: its first turn may still be journaled on
+    another replica, so the turn proceeds without history.
+    """
+    if not request.conversation_id:
+        return None
+    
+    history = await conversation_store.get_compact_history(
+        request.user_id,
+        request.conversation_id,
+        limit=settings.history_max_messages
+    )
+    summary = history["summary"] if history else None
+    messages = history["messages"] if history else []
+    
+    # Include turns that are journaled but not yet flushed to Cosmos DB
+    pending = []
+    if settings.persistence_write_behind:
+        seen = {message["id"] for message in messages}
+        pending = turn_writer.pending_messages(request.user_id, request.conversation_id)
+        messages = (messages + [m for m in pending if m["id"] not in seen])[-settings.history_max_messages:]
+    
+    if history is None and not pending:
+        age = conversation_age(request.conversation_id)
+        recent = age is not None and age < settings.persistence_missing_conversation_grace
+        if not (settings.persistence_write_behind and recent):
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    if not messages and not summary:
+        return None
+    
+    return {
+        "summary": summary,
+        "messages": [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in messages
+        ]
+    }
+
+def history_arguments(results: Dict) -> Dict:
+    """Generation keyword arguments for the loaded conversation history."""
+    history = results["history"] or {}
+    return {
+        "conversation_history": history.get("messages"),
+        "conversation_summary": history.get("summary")
+    }
+
+async def retrieve_unless_cached(
+    request: QueryRequest,
+    results: Dict,
+    cache_lookup: asyncio.Future
+) -> List[RetrievalResult]:
+    """
+    Retrieval stage. Runs alongside the cache lookup, so a miss does not wait
+    for the query embedding first; a hit that arrives before retrieval has
+    finished cancels it.
+    """
+    retrieval = asyncio.ensure_future(retrieve_chunks(request, results["auth"]))
+    try:
+        await asyncio.wait({cache_lookup, retrieval}, return_when=asyncio.FIRST_COMPLETED)
+        if cache_lookup.done() and cached_answer({"cache": cache_lookup.result()}):
+            return []
+        return await retrieval
+    finally:
+        retrieval.cancel()  # No-op once it has finished
+
+def build_query_graph(request: QueryRequest, use_cache: bool = True) -> StageGraph:
+    """
+    Stages shared by the blocking and streaming endpoints.
+    
+    The semantic cache lookup runs alongside auth, retrieval and the history
+    fetch; a cache hit cancels retrieval if it is still running, and the
+    retrieval result is ignored otherwise. Each stage is timed into the
+    per-stage latency histogram.
+    """
+    cache_lookup = asyncio.ensure_future(lookup_cached_answer(request, use_cache))
+    graph = StageGraph(observer=metrics.stage)
+    graph.add("auth", lambda results: authenticate())
+    graph.add("cache", lambda results: cache_lookup)
+    graph.add("retrieval", lambda results: retrieve_unless_cached(request, results, cache_lookup), depends_on=["auth"])
+    graph.add("history", lambda results: load_history(request))
+    return graph
+
+async def persist_turn(request: QueryRequest, answer: str, citations: List[Dict]) -> str:
+    """
+    Save the user question and assistant answer, creating the conversation if needed.
+    
+    A new conversation's header is written together with its first turn,
+    only once there is an answer, so a failed generation leaves nothing behind.
+    """
+    with metrics.stage("persistence"):
+        conversation_id = request.conversation_id or new_conversation_id()
+        messages = [
+            {"role": "user", "content": request.query},
+            {"role": "assistant", "content": answer, "citations": citations}
+        ]
         
-        # Step 5: Save to Cosmos DB
-        if not request.conversation_id:
-            request.conversation_id = await cosmos_client.create_conversation(
+        if settings.persistence_write_behind:
+            # Journal locally and return; the turn writer flushes to Cosmos DB in the background
+            await turn_writer.submit(
                 user_id=request.user_id,
-                title=request.query[:50]
+                conversation_id=conversation_id,
+                messages=messages,
+                title=request.query[:50],
+                create=not request.conversation_id
             )
+            return conversation_id
         
-        # Save user message
-        await cosmos_client.add_message(
+        await conversation_store.save_turn(
             user_id=request.user_id,
-            conversation_id=request.conversation_id,
-            role="user",
-            content=request.query
+            conversation_id=conversation_id,
+            messages=new_messages(messages),
+            title=request.query[:50],
+            create=not request.conversation_id
         )
-        
-        # Save assistant message
-        await cosmos_client.add_message(
-            user_id=request.user_id,
-            conversation_id=request.conversation_id,
-            role="assistant",
-            content=result["answer"],
-            citations=result["citations"]
-        )
-        
-        return QueryResponse(
-            answer=result["answer"],
-            citations=result["citations"],
-            conversation_id=request.conversation_id
+        compactor.schedule(request.user_id, conversation_id)
+        return conversation_id
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def answer_query(
+    request: QueryRequest,
+    persist: bool = True,
+    use_cache: bool = True
+) -> Tuple[QueryResponse, Dict[str, float]]:
+    """
+    Run the blocking pipeline for one query. Returns the response and the stage durations.
+    
+    With persist=False the turn is not saved and the response's
+    conversation_id is the request's (or "none").
+    """
+    async def generate(results: Dict) -> Optional[Dict]:
+        if cached_answer(results) or not results["retrieval"]:
+            return None
+        return await llm_client.generate_grounded_response(
+            query=request.query,
+            retrieved_chunks=results["retrieval"],
+            **history_arguments(results)
         )
-        
+    
+    # Steps 1-4: cache lookup, auth -> retrieval and history fetch in parallel, then generation
+    graph = build_query_graph(request, use_cache=use_cache)
+    graph.add("generation", generate, depends_on=["cache", "retrieval", "history"])
+    results = await graph.run()
+    
+    result = cached_answer(results)
+    if not result:
+        if not results["retrieval"]:
+            return QueryResponse(
+                answer=NO_RESULTS_ANSWER,
+                citations=[],
+                conversation_id=request.conversation_id or "none"
+            ), graph.timings
+        result = results["generation"]
+        remember_answer(results, result["answer"], result["citations"])
+    
+    # Step 5: Save to Cosmos DB
+    conversation_id = request.conversation_id or "none"
+    if persist:
+        conversation_id = await persist_turn(request, result["answer"], result["citations"])
+    
+    return QueryResponse(
+        answer=result["answer"],
+        citations=result["citations"],
+        conversation_id=conversation_id,
+        usage=result.get("usage")
+    ), graph.timings
+
+@app.post("/api/query", response_model=QueryResponse)
+async def query_knowledge(request: QueryRequest, response: Response):
+    """
+    Main RAG endpoint: retrieval + generation.
+    
+    Stage durations are returned in a Server-Timing header.
+    """
+    try:
+        result, timings = await answer_query(request)
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Query processing failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def answer_batch_item(index: int, item: BatchQueryItem, batch: BatchQueryRequest) -> Dict:
+    """One NDJSON record for a batch item: its result, or the error it failed with."""
+    request = QueryRequest(
+        query=item.query,
+        conversation_id=item.conversation_id,
+        user_id=batch.user_id,
+        site_filter=item.site_filter,
+        top_k=item.top_k
+    )
+    async with batch_semaphore:
+        await batch_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result, timings = await answer_query(request, persist=batch.persist, use_cache=batch.use_cache)
+        except HTTPException as e:
+            return {"type": "error", "index": index, "id": item.id, "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Batch query {index} failed: {str(e)}")
+            return {"type": "error", "index": index, "id": item.id, "status_code": 500, "detail": str(e)}
+    
+    return {
+        "type": "result",
+        "index": index,
+        "id": item.id,
+        **result.model_dump(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "timings": {name: round(seconds, 3) for name, seconds in timings.items()}
+    }
+
+@app.post("/api/query/batch")
+async def query_knowledge_batch(batch: BatchQueryRequest):
+    """
+    Answer many queries in one request, e.g. an evaluation set (NDJSON response).
+    
+    Items run concurrently, limited by a per-process semaphore and rate
+    limiter shared by all batches. One 'result' or 'error' line is written
+    per item as it finishes (so in completion order; match them by `index`
+    or `id`), then a final 'done' line. Turns are not saved unless
+    `persist` is set.
+    """
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="No queries")
+    if len(batch.queries) > settings.batch_max_queries:
+        raise HTTPException(status_code=413, detail=f"At most {settings.batch_max_queries} queries per batch")
+    
+    async def lines() -> AsyncIterator[str]:
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(answer_batch_item(i, item, batch)) for i, item in enumerate(batch.queries)]
+        failed = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                record = await task
+                failed += record["type"] == "error"
+                yield json.dumps(record) + "\n"
+            yield json.dumps({
+                "type": "done",
+                "count": len(tasks),
+                "failed": failed,
+                "seconds": round(time.perf_counter() - started, 3)
+            }) + "\n"
+        finally:
+            # The client went away: stop the items still queued or running
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+async def run_query_job(request: Dict) -> Dict:
+    """Job function for /api/jobs: the blocking pipeline, with stage timings in the result."""
+    result, timings = await answer_query(QueryRequest(**request))
+    return {
+        **result.model_dump(),
+        "timings": {name: round(seconds, 3) for name, seconds in timings.items()}
+    }
+
+job_queue = JobQueue(
+    JobStore(settings.jobs_db_path),
+    run_query_job,
+    workers=settings.job_workers,
+    max_queued=settings.job_max_queued,
+    result_ttl=settings.job_result_ttl
+)
+
+@app.post("/api/jobs", status_code=202)
+async def submit_query_job(request: QueryRequest):
+    """
+    Run a query in the background, for answers that take longer than a client can wait.
+    
+    Returns the job at once; poll GET /api/jobs/{job_id} until its status is
+    succeeded (the answer is in `result`), failed (see `error`) or cancelled.
+    Results stay available for JOB_RESULT_TTL seconds. Jobs run on the
+    replica that accepted them.
+    """
+    try:
+        return await job_queue.submit(request.model_dump())
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Too many queued jobs: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_query_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_query_job(job_id: str):
+    """Cancel a queued or running job; returns the job in its final state."""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.post("/api/query/stream")
+async def query_knowledge_stream(request: QueryRequest):
+    """
+    Streaming RAG endpoint (Server-Sent Events).
+    
+    Emits a 'citations' event, then 'delta' events with answer fragments as the
+    model produces them, then a 'done' event once the turn has been persisted.
+    Failures after the stream has started are reported as an 'error' event.
+    """
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            results = await build_query_graph(request).run()
+            chunks = results["retrieval"]
+            
+            cached = cached_answer(results)
+            if cached:
+                yield sse_event("citations", {"citations": cached["citations"]})
+                yield sse_event("delta", {"content": cached["answer"]})
+                conversation_id = await persist_turn(request, cached["answer"], cached["citations"])
+                yield sse_event("done", {"answer": cached["answer"], "conversation_id": conversation_id})
+                return
+            
+            if not chunks:
+                yield sse_event("citations", {"citations": []})
+                yield sse_event("delta", {"content": NO_RESULTS_ANSWER})
+                yield sse_event("done", {
+                    "answer": NO_RESULTS_ANSWER,
+                    "conversation_id": request.conversation_id or "none"
+                })
+                return
+            
+            stream = llm_client.stream_grounded_response(
+                query=request.query,
+                retrieved_chunks=chunks,
+                **history_arguments(results)
+            )
+            
+            answer, citations, usage = "", [], None
+            async for event in stream:
+                if event["type"] == "citations":
+                    citations = event["citations"]
+                    yield sse_event("citations", {"citations": citations})
+                elif event["type"] == "delta":
+                    yield sse_event("delta", {"content": event["content"]})
+                elif event["type"] == "done":
+                    answer = event["answer"]
+                    usage = event["usage"]
+            
+            # Persist and cache only complete turns
+            remember_answer(results, answer, citations)
+            conversation_id = await persist_turn(request, answer, citations)
+            yield sse_event("done", {"answer": answer, "conversation_id": conversation_id, "usage": usage})
+        
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Streaming query failed: {str(e)}")
+            yield sse_event("error", {"status_code": 500, "detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so deltas flush immediately
+        }
+    )
+
+def page_size_or_default(page_size: Optional[int], default: int) -> int:
+    return min(page_size or default, settings.max_page_size)
+
 @app.get("/api/conversations/{user_id}")
-async def list_conversations(user_id: str):
-    """List all conversations for a user."""
+async def list_conversations(
+    user_id: str,
+    page_size: Optional[int] = Query(None, ge=1),
+    continuation: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    List a user's conversations, most recently updated first, one page at a time.
+    
+    Pass the returned `continuation` to get the next page; it is null after the last.
+    Responses carry an ETag; a request whose If-None-Match matches gets a 304.
+    """
     try:
-        conversations = await cosmos_client.list_conversations(user_id)
-        return {"conversations": conversations}
+        page = await conversation_store.list_conversations(
+            user_id,
+            page_size=page_size_or_default(page_size, settings.conversations_page_size),
+            continuation=continuation
+        )
+        etag = page_etag(page)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=page, headers=headers)
+    except InvalidContinuationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to list conversations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/conversations/{user_id}/{conversation_id}")
-async def get_conversation(user_id: str, conversation_id: str):
-    """Get a specific conversation with all messages."""
+async def get_conversation(
+    user_id: str,
+    conversation_id: str,
+    include_messages: bool = True,
+    include_citations: bool = True,
+    page_size: Optional[int] = Query(None, ge=1)
+):
+    """
+    Get a conversation header with the first page of its messages (oldest first).
+    
+    Later pages come from /messages with the returned `continuation`. Use
+    include_messages=false for the header only, or include_citations=false
+    to leave citation snippets out.
+    """
     try:
-        conversation = await cosmos_client.get_conversation(user_id, conversation_id)
+        conversation = await conversation_store.get_conversation(
+            user_id,
+            conversation_id,
+            include_messages=include_messages,
+            include_citations=include_citations,
+            page_size=page_size_or_default(page_size, settings.messages_page_size)
+        )
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         return conversation
@@ -133,6 +694,54 @@ async def get_conversation(user_id: str, conversation_id: str):
         logger.error(f"Failed to get conversation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/conversations/{user_id}/{conversation_id}/messages")
+async def list_messages(
+    user_id: str,
+    conversation_id: str,
+    page_size: Optional[int] = Query(None, ge=1),
+    continuation: Optional[str] = None,
+    include_citations: bool = True,
+    newest_first: bool = False
+):
+    """One page of a conversation's messages; pass the returned `continuation` for the next."""
+    try:
+        page = await conversation_store.get_messages_page(
+            user_id,
+            conversation_id,
+            page_size=page_size_or_default(page_size, settings.messages_page_size),
+            continuation=continuation,
+            include_citations=include_citations,
+            newest_first=newest_first
+        )
+        if page is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return page
+    except HTTPException:
+        raise
+    except InvalidContinuationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to list messages: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latencies, tokens, cache hits, retries, Cosmos RU."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "demo_mode": settings.demo_mode,
+        "persistence": turn_writer.stats(),
+        "compaction": compactor.stats(),
+        "conversation_cache": conversation_store.stats(),
+        "batch_queries": batch_limiter.stats(),
+        "jobs": job_queue.stats(),
+        "retrieval_cache": retrieval_client.stats(),
+        "reranker": reranker.stats(),
+        "embeddings": llm_client.embeddings.stats(),
+        "rate_limits": rate_limiters.stats(),
+        "semantic_cache": semantic_cache.stats()
+    }
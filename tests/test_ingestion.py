@@ -0,0 +1,110 @@
+"""
+Delta sync and incremental vector index updates against the local Graph stand-in.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import hashlib
+from typing import Dict, List, Optional
+import httpx
+import numpy as np
+from backend.ingestion import ChunkStore, DeltaSync, embed_pending, update_index
+from backend.ratelimit import AdaptiveRateLimiter
+from backend.vector_index import PUBLIC_PRINCIPAL, IndexedChunk, VectorIndex
+from benchmarks.fake_graph import FakeGraph, create_app, populate
+
+async def fake_embed(texts: List[str]) -> List[List[float]]:
+    return [
+        np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(np.float32).tolist()
+        for text in texts
+    ]
+
+async def fake_token() -> str:
+    return "fake-token"
+
+async def sync_once(graph: FakeGraph, store: ChunkStore, index_path: str) -> Dict:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(graph)), base_url="http://fake-graph") as client:
+        sync = DeltaSync(
+            store,
+            fake_token,
+            list(graph.sites),
+            rate_limiter=AdaptiveRateLimiter("fake-graph", rate=10000),
+            item_permissions=True,
+            client=client
+        )
+        counts = await sync.run()
+    await embed_pending(store, fake_embed)
+    return {**counts, "index": await update_index(store, index_path, retrain_ratio=1.0)}
+
+def visible(index_path: str, principals: List[str]) -> Dict[str, List[str]]:
+    """Every chunk of the index visible to `principals`, as content by title."""
+    index = VectorIndex(index_path)
+    index.open()
+    try:
+        hits = index.search(np.ones(index.dim, dtype=np.float32), index.count, principals, nprobe=index.count)
+    finally:
+        index.close()
+    found: Dict[str, List[str]] = {}
+    for metadata, _ in hits:
+        found.setdefault(metadata["title"], []).append(metadata["content"])
+    return found
+
+def chunk(chunk_id: str, content: str, acl: Optional[List[str]] = None) -> IndexedChunk:
+    return IndexedChunk(
+        chunk_id=chunk_id,
+        content=content,
+        title=chunk_id,
+        url=f"https://contoso.sharepoint.com/sites/demo/{chunk_id}",
+        acl=acl or [PUBLIC_PRINCIPAL]
+    )
+
+def test_update_drops_changed_and_removed_rows(tmp_path):
+    index_path = str(tmp_path / "index")
+    rng = np.random.default_rng(0)
+    VectorIndex.build(index_path, [chunk(f"c{i}", f"v1 of c{i}") for i in range(8)], rng.normal(size=(8, 16)), n_lists=2)
+
+    manifest = VectorIndex.update(
+        index_path,
+        [chunk("c1", "v2 of c1", acl=["user:bob"]), chunk("c8", "v1 of c8")],
+        rng.normal(size=(2, 16)),
+        removed=["c2", "c3"]
+    )
+
+    assert manifest["count"] == 7
+    assert manifest["trained_count"] == 8
+    assert manifest["changed"] == 5  # Three rows dropped (one of them re-added), two added
+    public = visible(index_path, [PUBLIC_PRINCIPAL])
+    assert sorted(public) == ["c0", "c4", "c5", "c6", "c7", "c8"]
+    assert visible(index_path, ["user:bob"]) == {"c1": ["v2 of c1"]}
+
+def test_incremental_sync_applies_edits_deletes_and_permission_changes(tmp_path):
+    async def scenario():
+        graph = FakeGraph()
+        item_ids = populate(graph, 6)
+        drive_id = graph.sites["contoso-site"][0]
+        store = ChunkStore(str(tmp_path / "ingestion.db"))
+        store.open()
+        index_path = str(tmp_path / "index")
+        try:
+            assert (await sync_once(graph, store, index_path))["index"] == "rebuilt"
+            assert len(visible(index_path, [PUBLIC_PRINCIPAL])) == 6
+            assert (await sync_once(graph, store, index_path))["index"] == "unchanged"
+
+            graph.put_file(drive_id, "doc-0.txt", "Edited policy text.", item_id=item_ids[0])
+            graph.delete_file(drive_id, item_ids[1])
+            graph.share_file(drive_id, item_ids[2], [{"grantedToV2": {"user": {"id": "bob"}}}])
+            counts = await sync_once(graph, store, index_path)
+        finally:
+            store.close()
+
+        assert counts["index"] == "updated"
+        assert counts["downloaded"] == 1
+        assert counts["deleted"] == 1
+        assert counts["acl_updated"] == 1
+        public = visible(index_path, [PUBLIC_PRINCIPAL])
+        assert sorted(public) == ["doc-0.txt", "doc-3.txt", "doc-4.txt", "doc-5.txt"]
+        assert public["doc-0.txt"] == ["Edited policy text."]
+        assert sorted(visible(index_path, ["user:bob"])) == ["doc-2.txt"]
+
+    asyncio.run(scenario())
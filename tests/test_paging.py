@@ -0,0 +1,121 @@
+"""
+Continuation-token paging of conversations and messages against the in-memory Cosmos DB stand-in.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import base64
+import string
+import pytest
+from fastapi.testclient import TestClient
+from backend.conversation_cache import CachedConversationStore
+from backend.cosmos import CosmosDBClient, InvalidContinuationError, decode_continuation, encode_continuation
+from backend.persistence import new_conversation_id
+from benchmarks.fake_cosmos import FakeCosmosClient
+import main
+
+URL_SAFE = set(string.ascii_letters + string.digits + "-_=")
+
+def cosmos_store() -> CosmosDBClient:
+    store = CosmosDBClient()
+    store.client = FakeCosmosClient()
+    store.container = store.client.container
+    return store
+
+async def seed(store: CosmosDBClient, conversations: int, messages: int) -> list:
+    """Create conversations (oldest first) with `messages` messages each; returns their ids."""
+    conversation_ids = []
+    for i in range(conversations):
+        conversation_id = new_conversation_id()
+        await store.save_turn("alice", conversation_id, [
+            {"id": f"{conversation_id}-{m}", "role": "user", "content": f"c{i} m{m}",
+             "timestamp": f"2024-01-01T00:{i:02d}:{m:02d}", "citations": []}
+            for m in range(messages)
+        ], title=f"c{i}", create=True)
+        conversation_ids.append(conversation_id)
+    return conversation_ids
+
+def test_continuation_tokens_are_url_safe_and_round_trip():
+    token = '{"token":"+RID:~abc/def==#RT:1","range":{"min":"","max":"FF"}}'
+    wrapped = encode_continuation(token)
+    assert set(wrapped) <= URL_SAFE
+    assert decode_continuation(wrapped) == token
+    assert encode_continuation(None) is None
+    assert decode_continuation(None) is None
+
+def test_conversations_page_most_recently_updated_first():
+    async def scenario():
+        store = cosmos_store()
+        await seed(store, 5, 1)
+
+        titles, continuation = [], None
+        while True:
+            page = await store.list_conversations("alice", page_size=2, continuation=continuation)
+            titles += [conversation["title"] for conversation in page["conversations"]]
+            continuation = page["continuation"]
+            if continuation is None:
+                break
+            assert set(continuation) <= URL_SAFE
+        assert titles == ["c4", "c3", "c2", "c1", "c0"]
+
+    asyncio.run(scenario())
+
+def test_messages_page_in_both_directions():
+    async def scenario():
+        store = cosmos_store()
+        [conversation_id] = await seed(store, 1, 5)
+
+        for newest_first, expected in ((False, ["m0", "m1", "m2", "m3", "m4"]), (True, ["m4", "m3", "m2", "m1", "m0"])):
+            contents, continuation = [], None
+            while True:
+                page = await store.get_messages_page(
+                    "alice", conversation_id, page_size=2, continuation=continuation, newest_first=newest_first
+                )
+                contents += [message["content"].split()[1] for message in page["messages"]]
+                continuation = page["continuation"]
+                if continuation is None:
+                    break
+            assert contents == expected
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("continuation", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),  # Not UTF-8
+    base64.urlsafe_b64encode(b"forged").decode("ascii")  # Well-formed, but rejected by Cosmos DB
+])
+def test_invalid_continuation_raises(continuation):
+    async def scenario():
+        store = cosmos_store()
+        [conversation_id] = await seed(store, 1, 3)
+        with pytest.raises(InvalidContinuationError):
+            await store.list_conversations("alice", page_size=1, continuation=continuation)
+        with pytest.raises(InvalidContinuationError):
+            await store.get_messages_page("alice", conversation_id, page_size=1, continuation=continuation)
+
+    asyncio.run(scenario())
+
+def test_api_pages_and_rejects_invalid_continuations(monkeypatch):
+    store = cosmos_store()
+    conversation_id = asyncio.run(seed(store, 3, 3))[0]
+    monkeypatch.setattr(main, "conversation_store", CachedConversationStore(store, page_size=2, ttl=0))
+    client = TestClient(main.app)
+
+    first = client.get("/api/conversations/alice", params={"page_size": 2})
+    assert first.status_code == 200
+    assert first.headers["ETag"]
+    second = client.get("/api/conversations/alice", params={"page_size": 2, "continuation": first.json()["continuation"]})
+    assert second.status_code == 200
+    assert [c["title"] for c in first.json()["conversations"] + second.json()["conversations"]] == ["c2", "c1", "c0"]
+    assert second.json()["continuation"] is None
+
+    messages = client.get(f"/api/conversations/alice/{conversation_id}/messages", params={"page_size": 2})
+    assert messages.status_code == 200
+    assert messages.json()["continuation"]
+
+    forged = base64.urlsafe_b64encode(b"forged").decode("ascii")
+    assert client.get("/api/conversations/alice", params={"continuation": forged}).status_code == 400
+    assert client.get(
+        f"/api/conversations/alice/{conversation_id}/messages", params={"continuation": "not base64!"}
+    ).status_code == 400
@@ -0,0 +1,190 @@
+"""
+Write-behind persistence (TurnWriter) against the in-memory Cosmos DB stand-in.
+
+Usage:
+    python -m pytest tests
+"""
+import asyncio
+import uuid
+from typing import Dict, List
+from azure.cosmos import exceptions
+from backend.cosmos import CosmosDBClient
+from backend.persistence import TurnJournal, TurnWriter, new_conversation_id
+from benchmarks.fake_cosmos import FakeCosmosClient
+
+def cosmos_store() -> CosmosDBClient:
+    store = CosmosDBClient()
+    store.client = FakeCosmosClient()
+    store.container = store.client.container
+    return store
+
+def open_writer(store, path: str, **kwargs) -> TurnWriter:
+    """A writer with its journal open but no flush task; tests call _flush() themselves."""
+    writer = TurnWriter(store, TurnJournal(path), **kwargs)
+    writer.journal.open()
+    return writer
+
+def turn(question: str) -> List[Dict]:
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": f"Answer to {question}"}]
+
+class FlakyStore:
+    """Fails the next `failures` writes of one conversation with a 503, and records every attempt."""
+
+    def __init__(self, store, conversation_id: str, failures: int = 1):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.failures = failures
+        self.attempts: List[str] = []
+
+    async def save_turn(self, **kwargs) -> bool:
+        self.attempts.append(kwargs["messages"][0]["content"])
+        if kwargs["conversation_id"] == self.conversation_id and self.failures:
+            self.failures -= 1
+            raise exceptions.CosmosHttpResponseError(status_code=503, message="Service unavailable")
+        return await self.store.save_turn(**kwargs)
+
+async def contents(store: CosmosDBClient, user_id: str, conversation_id: str) -> List[str]:
+    page = await store.get_messages_page(user_id, conversation_id, page_size=100)
+    return [message["content"] for message in page["messages"]]
+
+def test_flush_writes_turns_in_order(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        writer = open_writer(store, str(tmp_path / "journal.db"))
+        conversation_id = new_conversation_id()
+        await writer.submit("alice", conversation_id, turn("q1"), title="q1", create=True)
+        await writer.submit("alice", conversation_id, turn("q2"))
+        assert [m["content"] for m in writer.pending_messages("alice", conversation_id)] == [
+            "q1", "Answer to q1", "q2", "Answer to q2"
+        ]
+
+        assert await writer._flush()
+        assert await contents(store, "alice", conversation_id) == ["q1", "Answer to q1", "q2", "Answer to q2"]
+        assert (await store.get_conversation_header("alice", conversation_id))["messageCount"] == 4
+        assert writer.journal.pending() == []
+        assert writer.stats()["queue_depth"] == 0
+        assert writer.stats()["flushed_total"] == 2
+
+    asyncio.run(scenario())
+
+def test_transient_failure_blocks_only_its_conversation(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        writer = open_writer(store, str(tmp_path / "journal.db"))
+        first, second = new_conversation_id(), new_conversation_id()
+        await writer.submit("alice", first, turn("a1"), create=True)
+        await writer.submit("alice", second, turn("b1"), create=True)
+        assert await writer._flush()
+
+        writer.store = FlakyStore(store, first)
+        await writer.submit("alice", first, turn("a2"))
+        await writer.submit("alice", first, turn("a3"))
+        await writer.submit("alice", second, turn("b2"))
+
+        assert not await writer._flush()
+        # a3 must not overtake the failed a2; the other conversation is unaffected
+        assert writer.store.attempts == ["a2", "b2"]
+        assert await contents(store, "alice", second) == ["b1", "Answer to b1", "b2", "Answer to b2"]
+        assert writer.stats()["queue_depth"] == 2
+        assert writer.journal.pending()[0][1]["messages"][0]["content"] == "a2"
+
+        assert await writer._flush()
+        assert await contents(store, "alice", first) == [
+            "a1", "Answer to a1", "a2", "Answer to a2", "a3", "Answer to a3"
+        ]
+        assert writer.journal.dead_letter_count() == 0
+
+    asyncio.run(scenario())
+
+def test_permanent_failure_is_dead_lettered(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        writer = open_writer(store, str(tmp_path / "journal.db"))
+        unknown = str(uuid.uuid4())  # Not minted by new_conversation_id, so no grace period
+        created = new_conversation_id()
+        await writer.submit("alice", unknown, turn("lost"))
+        await writer.submit("alice", created, turn("kept"), create=True)
+
+        assert await writer._flush()
+        assert writer.journal.dead_letter_count() == 1
+        assert writer.stats()["dead_lettered_total"] == 1
+        assert writer.journal.pending() == []
+        assert writer.pending_messages("alice", unknown) == []
+        assert await contents(store, "alice", created) == ["kept", "Answer to kept"]
+
+    asyncio.run(scenario())
+
+def test_follow_up_is_retried_until_another_replica_creates_the_conversation(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        creator = open_writer(store, str(tmp_path / "a.db"))
+        follower = open_writer(store, str(tmp_path / "b.db"))
+        conversation_id = new_conversation_id()
+        await creator.submit("alice", conversation_id, turn("q1"), create=True)
+        await follower.submit("alice", conversation_id, turn("q2"))
+
+        # The follow-up reaches the store first: 404, but within the grace period
+        assert not await follower._flush()
+        assert follower.journal.dead_letter_count() == 0
+        assert follower.stats()["queue_depth"] == 1
+
+        assert await creator._flush()
+        assert await follower._flush()
+        assert await contents(store, "alice", conversation_id) == ["q1", "Answer to q1", "q2", "Answer to q2"]
+        assert (await store.get_conversation_header("alice", conversation_id))["messageCount"] == 4
+
+    asyncio.run(scenario())
+
+def test_follow_up_is_dead_lettered_after_the_grace_period(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        writer = open_writer(store, str(tmp_path / "journal.db"), missing_conversation_grace=0.0)
+        await writer.submit("alice", new_conversation_id(), turn("q2"))
+
+        assert await writer._flush()
+        assert writer.journal.dead_letter_count() == 1
+
+    asyncio.run(scenario())
+
+def test_replayed_turns_are_written_once(tmp_path):
+    async def scenario():
+        store = cosmos_store()
+        writer = open_writer(store, str(tmp_path / "journal.db"))
+        conversation_id = new_conversation_id()
+        await writer.submit("alice", conversation_id, turn("q1"), title="q1", create=True)
+        await writer.submit("alice", conversation_id, turn("q2"))
+
+        # Both turns reach Cosmos DB but the acknowledgements are lost, so the journal still holds them
+        for _, journaled in writer.journal.pending():
+            assert await store.save_turn(
+                user_id=journaled["user_id"],
+                conversation_id=journaled["conversation_id"],
+                messages=journaled["messages"],
+                title=journaled["title"],
+                create=journaled["create"]
+            )
+
+        assert await writer._flush()
+        assert writer.journal.dead_letter_count() == 0
+        assert writer.journal.pending() == []
+        header = await store.get_conversation_header("alice", conversation_id)
+        assert header["messageCount"] == 4
+        assert await contents(store, "alice", conversation_id) == ["q1", "Answer to q1", "q2", "Answer to q2"]
+
+    asyncio.run(scenario())
+
+def test_save_turn_reports_whether_it_wrote():
+    async def scenario():
+        store = cosmos_store()
+        conversation_id = new_conversation_id()
+        created = [{"id": "m1", "role": "user", "content": "q1", "timestamp": "2024-01-01T00:00:00", "citations": []}]
+        follow_up = [{"id": "m2", "role": "user", "content": "q2", "timestamp": "2024-01-01T00:01:00", "citations": []}]
+
+        assert await store.save_turn("alice", conversation_id, created, create=True)
+        assert not await store.save_turn("alice", conversation_id, created, create=True)
+        assert await store.save_turn("alice", conversation_id, follow_up)
+        # The header patch's filter predicate (lastTurnId) rejects the replay
+        assert not await store.save_turn("alice", conversation_id, follow_up)
+        assert (await store.get_conversation_header("alice", conversation_id))["messageCount"] == 2
+
+    asyncio.run(scenario())